@@ -0,0 +1,261 @@
+"""
+Multi-account browser profile pool.
+
+Each named profile is a persistent Chrome user-data dir holding one logged-in XHS
+account. ``default`` is the original ``./browser_memory``; the others live in
+``browser_profiles/<name>/``, and ``browser_profiles/pool.json`` records their
+settings and health:
+
+    {"profiles": {"alt1": {"concurrency": 2, "enabled": true,
+                           "status": "ok", "cooldown_until": 0, ...}}}
+
+Workers lease a profile for one job (``with pool.lease() as lease``). A lease
+carries the profile's own rate limiter and concurrency, and is exposed to step1
+via ``current_lease()``. Risk signals reported during the job update the health
+of the profile: a login wall marks it ``logged_out`` (skipped until re-login
+with ``login_tool.py --profile``), and captchas or 429/461 responses put it on
+cool-down for ``ACCOUNT_COOLDOWN_SECONDS``.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import contextvars
+import contextlib
+
+from utils import env_clean
+from rate_limiter import AdaptiveRateLimiter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE = "default"
+DEFAULT_PROFILE_DIR = os.path.join(BASE_DIR, "browser_memory")
+PROFILES_DIR = os.path.join(BASE_DIR, "browser_profiles")
+POOL_FILE = os.path.join(PROFILES_DIR, "pool.json")
+RATE_STATE_FILENAME = "rate_state.json"
+
+STATUS_OK = "ok"
+STATUS_LOGGED_OUT = "logged_out"
+STATUS_RATE_LIMITED = "rate_limited"
+
+_current_lease = contextvars.ContextVar("account_lease", default=None)
+
+
+class NoAccountAvailable(Exception):
+    """Every profile is disabled or logged out."""
+
+
+def _cooldown_seconds():
+    try:
+        return float(env_clean("ACCOUNT_COOLDOWN_SECONDS", "600"))
+    except (TypeError, ValueError):
+        return 600.0
+
+
+def valid_profile_name(name):
+    return bool(name) and re.fullmatch(r"[\w.-]{1,64}", name) is not None
+
+
+def profile_dir(name):
+    """User-data dir of profile ``name`` (``default`` -> ./browser_memory)."""
+    if not name or name == DEFAULT_PROFILE:
+        return DEFAULT_PROFILE_DIR
+    return os.path.join(PROFILES_DIR, name)
+
+
+def current_lease():
+    """The lease the calling thread / task is working under, or None."""
+    return _current_lease.get()
+
+
+class Lease:
+    """One job's hold on a profile."""
+
+    def __init__(self, pool, name, record):
+        self.pool = pool
+        self.name = name
+        self.user_data_dir = profile_dir(name)
+        self.concurrency = max(1, int(record.get("concurrency", 1)))
+        self.limiter = pool.limiter_for(name)
+
+    def report(self, url, outcome):
+        """Feed a rate outcome to this profile's limiter and health record."""
+        self.limiter.report(url, outcome)
+        self.pool.record_outcome(self.name, outcome)
+
+
+class AccountPool:
+    """Thread-safe profile leasing with per-profile concurrency, rate budget and health."""
+
+    def __init__(self, pool_file=POOL_FILE, log=print):
+        self.pool_file = pool_file
+        self.log = log
+        self._lock = threading.Condition()
+        self._active = {}
+        self._limiters = {}
+        self.data = self._load()
+
+    # --- persistence ---
+
+    def _load(self):
+        try:
+            with open(self.pool_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault("profiles", {})
+        data["profiles"].setdefault(DEFAULT_PROFILE, {})
+        for record in data["profiles"].values():
+            record.setdefault("concurrency", 1)
+            record.setdefault("enabled", True)
+            record.setdefault("status", STATUS_OK)
+            record.setdefault("cooldown_until", 0)
+        return data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.pool_file), exist_ok=True)
+        tmp = self.pool_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.pool_file)
+
+    # --- management (login_tool) ---
+
+    def profiles(self):
+        return dict(self.data["profiles"])
+
+    def add(self, name, concurrency=None):
+        if not valid_profile_name(name):
+            raise ValueError(f"非法的 profile 名称: {name!r}")
+        with self._lock:
+            record = self.data["profiles"].setdefault(name, {})
+            record.setdefault("enabled", True)
+            record.setdefault("cooldown_until", 0)
+            record["concurrency"] = max(1, int(concurrency or record.get("concurrency", 1)))
+            record["status"] = STATUS_OK
+            self.save()
+        os.makedirs(profile_dir(name), exist_ok=True)
+        return record
+
+    def update(self, name, **fields):
+        with self._lock:
+            if name not in self.data["profiles"]:
+                raise KeyError(name)
+            self.data["profiles"][name].update(fields)
+            self.save()
+            self._lock.notify_all()
+
+    def usable(self):
+        """Names of enabled, logged-in profiles whose user-data dir exists."""
+        return [
+            name for name, record in self.data["profiles"].items()
+            if record.get("enabled") and record.get("status") != STATUS_LOGGED_OUT
+            and os.path.isdir(profile_dir(name))
+        ]
+
+    # --- leasing ---
+
+    def limiter_for(self, name):
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                state_path = os.path.join(profile_dir(name), RATE_STATE_FILENAME)
+                limiter = self._limiters[name] = AdaptiveRateLimiter(state_path=state_path, log=self.log)
+            return limiter
+
+    def _pick(self, now, only=None):
+        """Least-recently-used free profile that is off cool-down, or (None, seconds until one frees up)."""
+        best, soonest = None, None
+        for name in self.usable():
+            if only and name != only:
+                continue
+            record = self.data["profiles"][name]
+            cooldown = record.get("cooldown_until", 0) - now
+            if cooldown > 0:
+                soonest = cooldown if soonest is None else min(soonest, cooldown)
+                continue
+            # One job at a time per profile; the profile's concurrency applies inside the job.
+            if self._active.get(name, 0) >= 1:
+                continue
+            if best is None or record.get("last_used", 0) < self.data["profiles"][best].get("last_used", 0):
+                best = name
+        return best, soonest
+
+    def acquire(self, timeout=None, name=None):
+        """Block until a profile (or the profile ``name``) is free; raises NoAccountAvailable when none can ever be."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        only = name
+        with self._lock:
+            while True:
+                usable = self.usable()
+                if not usable or (only and only not in usable):
+                    raise NoAccountAvailable("没有可用账号：全部已禁用或已登出，请运行 login_tool.py --profile <name> 重新登录")
+                name, soonest = self._pick(time.time(), only)
+                if name:
+                    record = self.data["profiles"][name]
+                    self._active[name] = self._active.get(name, 0) + 1
+                    record["last_used"] = time.time()
+                    if record.get("status") == STATUS_RATE_LIMITED:
+                        record["status"] = STATUS_OK
+                    return Lease(self, name, record)
+                wait = soonest if soonest is not None else 1.0
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("等待可用账号超时")
+                    wait = min(wait, remaining)
+                self._lock.wait(timeout=max(0.05, wait))
+
+    def release(self, lease):
+        with self._lock:
+            self._active[lease.name] = max(0, self._active.get(lease.name, 0) - 1)
+            self._lock.notify_all()
+
+    @contextlib.contextmanager
+    def lease(self, timeout=None, name=None):
+        """Lease a profile for the duration of the block and expose it via ``current_lease()``."""
+        lease = self.acquire(timeout=timeout, name=name)
+        token = _current_lease.set(lease)
+        try:
+            yield lease
+        finally:
+            _current_lease.reset(token)
+            self.release(lease)
+
+    # --- health ---
+
+    def record_outcome(self, name, outcome):
+        if not outcome:
+            return
+        with self._lock:
+            record = self.data["profiles"].get(name)
+            if record is None:
+                return
+            if outcome == "login_wall":
+                record["status"] = STATUS_LOGGED_OUT
+                self.log(f"🚫 账号 {name} 已掉登录，暂停使用（运行 login_tool.py --profile {name} 重新登录）")
+            elif outcome in ("captcha", "rate_limited"):
+                record["status"] = STATUS_RATE_LIMITED
+                record["cooldown_until"] = time.time() + _cooldown_seconds()
+                self.log(f"🧊 账号 {name} 触发风控 [{outcome}]，冷却 {int(_cooldown_seconds())} 秒")
+            elif outcome == "ok" and record.get("status") != STATUS_OK:
+                record["status"] = STATUS_OK
+            else:
+                return
+            record["last_outcome"] = outcome
+            record["updated_at"] = int(time.time())
+            self.save()
+            self._lock.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = AccountPool()
+        return _pool
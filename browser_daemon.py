@@ -0,0 +1,218 @@
+"""
+常驻浏览器服务
+启动一次带登录记忆的 Chrome，并开放 CDP 端口，供 step1/step3/step5 通过
+connect_over_cdp 复用，省去每条链接重新启动浏览器和抢占 profile 锁的开销。
+
+使用方法:
+    python browser_daemon.py                 # 前台运行（Ctrl+C 退出）
+    python browser_daemon.py --port 9333     # 指定 CDP 端口
+    python browser_daemon.py --status        # 查看服务是否存活
+
+客户端侧：设置 BROWSER_DAEMON=1（自动拉起/复用本服务），
+或 BROWSER_CDP_URL=http://127.0.0.1:9222（连接已有的 Chrome）。
+无图形界面的服务器上设置 SCRAPE_HEADLESS=1（或 --headless）以无界面模式运行。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from playwright.sync_api import sync_playwright
+
+from http_pool import get_session
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_DATA_DIR = os.path.join(BASE_DIR, "browser_memory")
+DAEMON_LOG_FILE = os.path.join(BASE_DIR, "browser_daemon.log")
+DAEMON_STATE_FILE = os.path.join(BASE_DIR, "browser_daemon.json")
+
+DEFAULT_CDP_PORT = int(os.getenv("BROWSER_CDP_PORT", "9222"))
+HEALTH_CHECK_SECONDS = float(os.getenv("BROWSER_HEALTH_CHECK_SECONDS", "10"))
+MAX_RESTARTS = int(os.getenv("BROWSER_MAX_RESTARTS", "20"))
+
+BROWSER_VIEWPORT = {'width': 1280, 'height': 800}
+BROWSER_ARGS = ['--no-sandbox', '--disable-blink-features=AutomationControlled']
+WEBDRIVER_INIT_SCRIPT = "Object.defineProperty(navigator, 'webdriver', { get: () => undefined })"
+# 无界面 Chrome 的默认 UA 带有 "HeadlessChrome"，会被直接识别，统一换成桌面 UA
+HEADLESS_USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+)
+
+
+def cdp_endpoint(port=None):
+    return f"http://127.0.0.1:{port or DEFAULT_CDP_PORT}"
+
+
+def is_alive(endpoint, timeout=2):
+    """通过 CDP 的 /json/version 做健康检查。"""
+    try:
+        # 健康检查不重试：失败次数由调用方统计
+        res = get_session("probe", retries=0).get(endpoint.rstrip("/") + "/json/version", timeout=timeout)
+        return res.status_code == 200 and "webSocketDebuggerUrl" in res.json()
+    except Exception:
+        return False
+
+
+def headless_requested():
+    """SCRAPE_HEADLESS=1：所有抓取浏览器（含常驻浏览器）以无界面模式启动。"""
+    return os.getenv("SCRAPE_HEADLESS", "0") == "1"
+
+
+def launch_options(user_data_dir, headless=False, args=None):
+    """launch_persistent_context 的公共参数；无界面模式额外伪装 UA。"""
+    options = {
+        "user_data_dir": user_data_dir,
+        "headless": headless,
+        "viewport": BROWSER_VIEWPORT,
+        "args": list(args or BROWSER_ARGS),
+    }
+    if headless:
+        options["user_agent"] = HEADLESS_USER_AGENT
+    return options
+
+
+def daemon_requested():
+    return os.getenv("BROWSER_DAEMON", "0") == "1"
+
+
+def resolve_endpoint():
+    """返回客户端应连接的 CDP 地址；未启用常驻浏览器时返回 None。
+
+    BROWSER_CDP_URL 优先（外部 Chrome）；BROWSER_DAEMON=1 时服务不在线会自动拉起。
+    """
+    explicit = os.getenv("BROWSER_CDP_URL", "").strip()
+    if explicit:
+        return explicit
+    if not daemon_requested():
+        return None
+    return ensure_daemon()
+
+
+def ensure_daemon(port=None, wait_seconds=30):
+    """确保常驻浏览器在线：已存活直接返回地址，否则后台拉起并等待就绪。"""
+    endpoint = cdp_endpoint(port)
+    if is_alive(endpoint):
+        return endpoint
+
+    print(f"🧩 常驻浏览器未运行，正在后台启动 (CDP {endpoint})...")
+    cmd = [sys.executable, os.path.abspath(__file__), "--port", str(port or DEFAULT_CDP_PORT)]
+    if headless_requested():
+        cmd.append("--headless")
+    with open(DAEMON_LOG_FILE, "a", encoding="utf-8") as log_f:
+        subprocess.Popen(
+            cmd,
+            stdout=log_f,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            cwd=BASE_DIR,
+            start_new_session=True,
+        )
+
+    deadline = time.time() + wait_seconds
+    while time.time() < deadline:
+        if is_alive(endpoint):
+            print("✅ 常驻浏览器已就绪。")
+            return endpoint
+        time.sleep(0.5)
+    print(f"⚠️ 常驻浏览器启动超时，请查看日志: {DAEMON_LOG_FILE}")
+    return None
+
+
+def _write_state(port, restarts):
+    try:
+        with open(DAEMON_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump({
+                "pid": os.getpid(),
+                "endpoint": cdp_endpoint(port),
+                "user_data_dir": USER_DATA_DIR,
+                "restarts": restarts,
+                "updated_at": int(time.time()),
+            }, f, ensure_ascii=False, indent=2)
+    except Exception:
+        pass
+
+
+def _launch(p, port, headless=False):
+    options = launch_options(USER_DATA_DIR, headless, BROWSER_ARGS + [f"--remote-debugging-port={port}"])
+    try:
+        context = p.chromium.launch_persistent_context(channel="chrome", **options)
+    except Exception:
+        context = p.chromium.launch_persistent_context(**options)
+    # 挂在 context 上，客户端通过 CDP 新开的标签页同样生效
+    context.add_init_script(WEBDRIVER_INIT_SCRIPT)
+    if not context.pages:
+        context.new_page()
+    return context
+
+
+def serve(port=None, headless=False):
+    """前台运行常驻浏览器：定期健康检查，崩溃或失联时自动重启。"""
+    port = port or DEFAULT_CDP_PORT
+    endpoint = cdp_endpoint(port)
+    if is_alive(endpoint):
+        print(f"ℹ️ {endpoint} 已有浏览器在运行，无需重复启动。")
+        return
+
+    restarts = 0
+    with sync_playwright() as p:
+        while restarts <= MAX_RESTARTS:
+            context = None
+            try:
+                print(f"🚀 启动常驻浏览器 (第 {restarts + 1} 次)，CDP: {endpoint}")
+                context = _launch(p, port, headless=headless)
+                _write_state(port, restarts)
+
+                # Chrome 崩溃或被关闭时 CDP 端口随之失效，连续 3 次失败即重启
+                failures = 0
+                while True:
+                    time.sleep(HEALTH_CHECK_SECONDS)
+                    if is_alive(endpoint):
+                        failures = 0
+                        continue
+                    failures += 1
+                    print(f"⚠️ 健康检查失败 ({failures}/3)")
+                    if failures >= 3:
+                        break
+            except KeyboardInterrupt:
+                print("\n👋 收到中断，关闭常驻浏览器。")
+                if context:
+                    try:
+                        context.close()
+                    except Exception:
+                        pass
+                return
+            except Exception as e:
+                print(f"❌ 常驻浏览器异常: {e}")
+
+            if context:
+                try:
+                    context.close()
+                except Exception:
+                    pass
+            restarts += 1
+            time.sleep(min(30, 2 ** min(restarts, 5)))
+
+    print(f"❌ 已重启 {MAX_RESTARTS} 次仍不稳定，常驻浏览器退出。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻浏览器服务（CDP 复用登录态）")
+    parser.add_argument("--port", type=int, default=DEFAULT_CDP_PORT, help="CDP 调试端口（默认: 9222）")
+    parser.add_argument("--headless", action="store_true", help="无界面运行")
+    parser.add_argument("--status", action="store_true", help="仅检查服务是否存活")
+    args = parser.parse_args()
+
+    if args.status:
+        endpoint = cdp_endpoint(args.port)
+        alive = is_alive(endpoint)
+        print(f"{'✅' if alive else '❌'} {endpoint} {'在线' if alive else '离线'}")
+        sys.exit(0 if alive else 1)
+
+    serve(port=args.port, headless=args.headless or headless_requested())
+
+
+if __name__ == "__main__":
+    main()
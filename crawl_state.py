@@ -0,0 +1,187 @@
+"""
+Per-creator crawl watermarks for incremental profile scraping.
+
+``<work_dir>/crawl_state.json`` remembers, for every creator profile, the note
+ids already ingested, the newest of them, and when the profile was last crawled:
+
+    {"profiles": {"user:5f1a...": {"known": ["66b0...", ...], "newest": "66b0...",
+                                   "last_run": 1760000000, "last_new": 2}}}
+
+A profile's notes are listed newest first, so a re-run can stop as soon as it
+walks into notes it has already ingested. A single known note is not enough to
+stop: pinned notes sit on top of the grid regardless of age (the feed API flags
+them as ``sticky`` but the DOM grid does not), and a deleted note can make the
+newest known id disappear. The crawl therefore stops after
+``CRAWL_STOP_AFTER_KNOWN`` consecutive known, non-pinned notes (default 3).
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+STATE_FILENAME = "crawl_state.json"
+# Known ids kept per profile; far more than one refresh ever walks back.
+KEEP_IDS = 500
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def incremental_enabled():
+    return os.getenv("CRAWL_INCREMENTAL", "1") != "0"
+
+
+def stop_after_known():
+    try:
+        return max(1, int(os.getenv("CRAWL_STOP_AFTER_KNOWN", "3")))
+    except ValueError:
+        return 3
+
+
+def profile_key(profile_url):
+    """``user:<id>`` for XHS profile URLs, otherwise the URL without its query string."""
+    url = str(profile_url or "")
+    match = re.search(r"/user/profile/(\w+)", url)
+    if match:
+        return f"user:{match.group(1)}"
+    return url.split("?", 1)[0].rstrip("/")
+
+
+def profile_url_for(key):
+    """Inverse of ``profile_key`` for XHS profiles."""
+    if key.startswith("user:"):
+        return f"https://www.xiaohongshu.com/user/profile/{key[5:]}"
+    return key
+
+
+def note_id_from_url(url):
+    match = re.search(r"/explore/(\w+)", str(url or ""))
+    return match.group(1) if match else None
+
+
+class Watermark:
+    """Decides, note by note in listing order, whether the crawl has reached known notes."""
+
+    def __init__(self, known, stop_after=None, is_known=None):
+        self.known = set(known or ())
+        self.stop_after = stop_after or stop_after_known()
+        self.is_known = is_known
+        self.streak = 0
+        self.stopped = False
+        self.skipped = 0
+        self._verdicts = {}
+
+    def _known(self, note_id):
+        if note_id in self.known:
+            return True
+        try:
+            return bool(self.is_known and self.is_known(note_id))
+        except Exception:
+            return False
+
+    def check(self, note_id, sticky=False):
+        """Return "new", "known" or "stop". Repeated calls for the same id return the first verdict."""
+        if note_id in self._verdicts:
+            return self._verdicts[note_id]
+        if self.stopped:
+            verdict = "stop"
+        elif not self._known(note_id):
+            verdict = "new"
+            self.streak = 0
+        else:
+            verdict = "known"
+            self.skipped += 1
+            if not sticky:
+                self.streak += 1
+                if self.streak >= self.stop_after:
+                    self.stopped = True
+        self._verdicts[note_id] = verdict
+        return verdict
+
+    def filter(self, urls):
+        """Keep the new note URLs of a newest-first listing, up to the stop point."""
+        fresh = []
+        for url in urls:
+            verdict = self.check(note_id_from_url(url) or url)
+            if verdict == "new":
+                fresh.append(url)
+            elif verdict == "stop":
+                break
+        return fresh
+
+
+class CrawlState:
+    """JSON store of ingested note ids per creator profile.
+
+    Every mutation re-reads the file under a lock and writes it back atomically,
+    so download callbacks (and separate runs) don't overwrite each other's records.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.path = os.path.join(work_dir, STATE_FILENAME)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if not isinstance(data.get("profiles"), dict):
+            data["profiles"] = {}
+        return data
+
+    def _save(self, data):
+        os.makedirs(self.work_dir, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def profile_urls(self):
+        with self._lock:
+            return [profile_url_for(key) for key in self._load()["profiles"]]
+
+    def entry(self, profile_url):
+        with self._lock:
+            return dict(self._load()["profiles"].get(profile_key(profile_url), {}))
+
+    def watermark(self, profile_url, is_known=None, stop_after=None):
+        return Watermark(self.entry(profile_url).get("known"), stop_after=stop_after, is_known=is_known)
+
+    def record(self, profile_url, note_ids, newest=None):
+        """Add ingested note ids to the profile's watermark; ``newest`` is the top note of this run."""
+        note_ids = [n for n in note_ids if n]
+        if not note_ids and newest is None:
+            return
+        with self._lock:
+            data = self._load()
+            entry = data["profiles"].setdefault(profile_key(profile_url), {})
+            known = entry.get("known") or []
+            added = [n for n in dict.fromkeys(note_ids) if n not in known]
+            entry["known"] = (added + known)[:KEEP_IDS]
+            if newest:
+                entry["newest"] = newest
+            entry["updated_at"] = int(time.time())
+            self._save(data)
+
+    def finish_run(self, profile_url, new_count):
+        """Stamp the run once its downloads have resolved; ``new_count`` is how many were saved."""
+        with self._lock:
+            data = self._load()
+            entry = data["profiles"].setdefault(profile_key(profile_url), {})
+            entry["last_run"] = int(time.time())
+            entry["last_new"] = new_count
+            self._save(data)
+
+
+def get_state(work_dir):
+    """Process-wide crawl state for ``work_dir``."""
+    key = os.path.abspath(work_dir)
+    with _states_lock:
+        if key not in _states:
+            _states[key] = CrawlState(work_dir)
+        return _states[key]
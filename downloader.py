@@ -0,0 +1,320 @@
+"""
+Shared resumable downloader used by step1_scraper and scripts/download_douyin.py.
+
+Data is streamed into ``<dest>.part``. On retry the request resumes from the bytes
+already on disk with an HTTP ``Range`` header, the final size is verified against
+``Content-Length`` / ``Content-Range``, and the part file is atomically renamed to
+the destination only once it is complete.
+
+Large files on servers that accept ranges can be fetched as N concurrent segments
+written into a preallocated part file; finished segments are recorded next to it
+(``<dest>.part.segments``) so an interrupted segmented download resumes too.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from http_pool import get_session
+
+PART_SUFFIX = ".part"
+SEGMENTS_SUFFIX = ".segments"
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Files smaller than this are always fetched as a single stream.
+SEGMENT_MIN_SIZE = 16 * 1024 * 1024
+SEGMENT_RETRIES = 2
+
+
+class IncompleteDownload(Exception):
+    """The stream ended before the advertised number of bytes arrived."""
+
+
+def parse_content_range(value):
+    """Parse ``bytes start-end/total`` (or ``bytes */total``) into (start, total)."""
+    if not value:
+        return None, None
+    match = re.match(r"bytes\s+(\d+|\*)-?(\d*)/(\d+|\*)", value.strip())
+    if not match:
+        return None, None
+    start = int(match.group(1)) if match.group(1) != "*" else None
+    total = int(match.group(3)) if match.group(3) != "*" else None
+    return start, total
+
+
+def _expected_total(response, offset):
+    """Work out the full file size for a 200/206 response, or None if unknown."""
+    if response.status_code == 206:
+        _, total = parse_content_range(response.headers.get("Content-Range"))
+        if total is not None:
+            return total
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return int(length) + (offset if response.status_code == 206 else 0)
+    return None
+
+
+def _stream_once(session, url, part_path, headers, timeout, chunk_size, progress):
+    """Fetch the missing bytes of ``part_path`` once. Returns the expected total size."""
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    req_headers = dict(headers or {})
+    req_headers.setdefault("Accept-Encoding", "identity")
+    if offset:
+        req_headers["Range"] = f"bytes={offset}-"
+
+    response = session.get(url, headers=req_headers, stream=True, timeout=timeout)
+    try:
+        if response.status_code == 416 and offset:
+            # Range past the end: the part file may already be complete.
+            _, total = parse_content_range(response.headers.get("Content-Range"))
+            if total == offset:
+                return total
+            os.remove(part_path)
+            raise IncompleteDownload(f"range not satisfiable at {offset}, restarting")
+
+        if response.status_code == 206:
+            start, _ = parse_content_range(response.headers.get("Content-Range"))
+            if start not in (None, offset):
+                os.remove(part_path)
+                raise IncompleteDownload(f"server resumed at {start}, expected {offset}")
+            mode = "ab"
+        elif response.status_code == 200:
+            # Server ignored the Range header; start over.
+            offset = 0
+            mode = "wb"
+        else:
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+
+        total = _expected_total(response, offset)
+        done = offset
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(done, total)
+        return total
+    finally:
+        response.close()
+
+
+def probe_range_support(session, url, headers=None, timeout=30):
+    """Ask for the first byte only. Returns (total_size, accepts_ranges)."""
+    req_headers = dict(headers or {})
+    req_headers["Range"] = "bytes=0-0"
+    req_headers.setdefault("Accept-Encoding", "identity")
+    try:
+        response = session.get(url, headers=req_headers, stream=True, timeout=timeout)
+    except Exception:
+        return None, False
+    try:
+        if response.status_code == 206:
+            _, total = parse_content_range(response.headers.get("Content-Range"))
+            return total, total is not None
+        length = response.headers.get("Content-Length")
+        return (int(length) if length and length.isdigit() else None), False
+    finally:
+        response.close()
+
+
+def plan_segments(total, segments):
+    """Split ``total`` bytes into ``segments`` inclusive (start, end) ranges."""
+    segments = max(1, min(segments, total))
+    size = total // segments
+    ranges = []
+    for i in range(segments):
+        start = i * size
+        end = total - 1 if i == segments - 1 else start + size - 1
+        ranges.append((start, end))
+    return ranges
+
+
+def _load_segment_state(state_path, total):
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("total") == total:
+            return state
+    except Exception:
+        pass
+    return None
+
+
+def _finished_segments(state_path):
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return len(json.load(f).get("done", []))
+    except Exception:
+        return 0
+
+
+def _save_segment_state(state_path, state):
+    tmp = state_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
+
+
+def _fetch_segment(session, url, part_path, start, end, headers, timeout, chunk_size, on_bytes):
+    req_headers = dict(headers or {})
+    req_headers["Range"] = f"bytes={start}-{end}"
+    req_headers.setdefault("Accept-Encoding", "identity")
+    expected = end - start + 1
+    for attempt in range(SEGMENT_RETRIES + 1):
+        written = 0
+        try:
+            response = session.get(url, headers=req_headers, stream=True, timeout=timeout)
+            try:
+                if response.status_code != 206:
+                    raise IncompleteDownload(f"segment {start}-{end}: HTTP {response.status_code}")
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            chunk = chunk[:expected - written]
+                            f.write(chunk)
+                            written += len(chunk)
+                            on_bytes(len(chunk))
+                            if written >= expected:
+                                break
+            finally:
+                response.close()
+            if written == expected:
+                return True
+            raise IncompleteDownload(f"segment {start}-{end}: got {written} of {expected} bytes")
+        except Exception:
+            on_bytes(-written)
+            if attempt >= SEGMENT_RETRIES:
+                raise
+            time.sleep(min(10, 2 ** attempt))
+    return False
+
+
+def _download_segmented(session, url, dest_path, total, segments, headers, timeout, chunk_size, progress, log):
+    part_path = dest_path + PART_SUFFIX
+    state_path = part_path + SEGMENTS_SUFFIX
+    ranges = plan_segments(total, segments)
+
+    state = _load_segment_state(state_path, total)
+    if state is None or state.get("ranges") != [list(r) for r in ranges]:
+        state = {"total": total, "ranges": [list(r) for r in ranges], "done": []}
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != total:
+        with open(part_path, "wb") as f:
+            f.truncate(total)
+        state["done"] = []
+    _save_segment_state(state_path, state)
+
+    lock = threading.Lock()
+    done_bytes = {"value": sum(ranges[i][1] - ranges[i][0] + 1 for i in state["done"])}
+
+    def _on_bytes(n):
+        with lock:
+            done_bytes["value"] += n
+            if progress:
+                progress(done_bytes["value"], total)
+
+    def _worker(index):
+        start, end = ranges[index]
+        _fetch_segment(session, url, part_path, start, end, headers, timeout, chunk_size, _on_bytes)
+        with lock:
+            state["done"].append(index)
+            _save_segment_state(state_path, state)
+
+    pending = [i for i in range(len(ranges)) if i not in state["done"]]
+    log(f"🧩 分段并行下载: {total:,} bytes / {len(ranges)} 段（待下载 {len(pending)} 段）")
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="segment") as pool:
+        futures = [pool.submit(_worker, i) for i in pending]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        log(f"⚠️ 分段下载未完成 ({len(errors)} 段失败): {errors[0]}")
+        return None
+
+    os.replace(part_path, dest_path)
+    try:
+        os.remove(state_path)
+    except OSError:
+        pass
+    return dest_path
+
+
+def download_file(url, dest_path, headers=None, session=None, timeout=60, retries=3,
+                  chunk_size=DEFAULT_CHUNK_SIZE, min_size=0, progress=None, log=print,
+                  segments=1, segment_min_size=SEGMENT_MIN_SIZE):
+    """Download ``url`` to ``dest_path`` with resume support.
+
+    Returns ``dest_path`` on success, or None after ``retries`` failed resume attempts.
+    A leftover ``.part`` file from an earlier run is resumed as well. With
+    ``segments > 1`` files of at least ``segment_min_size`` bytes on range-capable
+    servers are fetched over parallel connections; anything else falls back to a
+    single stream. Failed segments are retried without refetching finished ones,
+    and a segmented leftover is resumed segment-wise (or discarded if the server no
+    longer serves ranges), never as a sequential prefix.
+    """
+    session = session or get_session()
+    part_path = dest_path + PART_SUFFIX
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+
+    state_path = part_path + SEGMENTS_SUFFIX
+    resuming = os.path.exists(state_path)
+    # A plain .part without segment state is a sequential download: keep resuming it that way.
+    sequential_leftover = os.path.exists(part_path) and not resuming
+    if (segments > 1 or resuming) and not sequential_leftover:
+        total, ranged = probe_range_support(session, url, headers=headers, timeout=timeout)
+        state = _load_segment_state(state_path, total) if resuming and ranged else None
+        if state:
+            # Keep the original split so the finished segments still count.
+            segments = len(state["ranges"])
+        if ranged and total and (state or (segments > 1 and total >= max(segment_min_size, min_size))):
+            for attempt in range(retries + 1):
+                finished = _finished_segments(state_path)
+                result = _download_segmented(
+                    session, url, dest_path, total, segments, headers, timeout, chunk_size, progress, log
+                )
+                if result:
+                    return result
+                if _finished_segments(state_path) <= finished:
+                    # Not a single segment landed: this server does not cooperate with ranges.
+                    break
+                if attempt < retries:
+                    wait = min(10, 2 ** attempt)
+                    log(f"🔁 {wait}s 后重试未完成的分段 (第 {attempt + 1}/{retries} 次重试)...")
+                    time.sleep(wait)
+            else:
+                log("⚠️ 分段下载仍未完成，已保留进度，下次运行继续下载未完成的分段")
+                return None
+            log("↩️ 分段下载失败，回退为单连接断点续传...")
+        # A segmented .part is preallocated to the full size; it must never be resumed as a prefix.
+        for leftover in (part_path, state_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    for attempt in range(retries + 1):
+        try:
+            total = _stream_once(session, url, part_path, headers, timeout, chunk_size, progress)
+            size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if total is not None and size != total:
+                raise IncompleteDownload(f"got {size} of {total} bytes")
+            if size < min_size:
+                os.remove(part_path)
+                log(f"⚠️ 下载文件过小 ({size} bytes)，可能已损坏")
+                return None
+            os.replace(part_path, dest_path)
+            return dest_path
+        except requests.HTTPError as e:
+            status = getattr(e.response, "status_code", None)
+            log(f"⚠️ 下载失败，状态码: {status}")
+            if status is not None and status < 500 and status != 429:
+                return None
+        except Exception as e:
+            resumed = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            log(f"⚠️ 下载中断 ({e})，已保留 {resumed:,} bytes")
+
+        if attempt < retries:
+            wait = min(10, 2 ** attempt)
+            log(f"🔁 {wait}s 后断点续传 (第 {attempt + 1}/{retries} 次重试)...")
+            time.sleep(wait)
+    return None
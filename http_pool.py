@@ -0,0 +1,315 @@
+"""
+Process-wide pooled HTTP sessions.
+
+Every HTTP caller in the project (video/cover downloads, ImgBB uploads, LLM calls,
+Notion pushes, CDP health checks) goes through ``get_session()`` so keep-alive
+connections and TLS handshakes are shared across a whole batch instead of being
+rebuilt per request.
+
+Configuration (all optional, read from the environment / .env):
+
+    HTTP_POOL_CONNECTIONS   number of per-host pools kept alive (default 16)
+    HTTP_POOL_MAXSIZE       connections per host pool (default 16)
+    HTTP_HOST_POOL_SIZES    per-host overrides, e.g. "api.imgbb.com=4,sns-video-bd.xhscdn.com=32"
+    HTTP_RETRIES            retries on connect errors / 5xx (default 3)
+    HTTP_BACKOFF            retry backoff factor in seconds (default 1)
+    HTTP_TIMEOUT            default timeout when a caller passes none (default 30)
+    HTTP_TRANSPORT          "requests" (default) or "httpx" for HTTP/2
+"""
+
+import os
+import ssl
+import threading
+import http.client
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import env_clean
+
+RETRY_STATUS = (500, 502, 503, 504)
+DEFAULT_TRANSPORT = "requests"
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_transports = {}
+
+
+def _env_int(name, default):
+    try:
+        return int(env_clean(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(env_clean(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_host_pool_sizes(value):
+    """Parse ``host=size,host=size`` into a dict, skipping malformed entries."""
+    sizes = {}
+    for item in (value or "").split(","):
+        host, _, size = item.partition("=")
+        host = host.strip().lower()
+        if host and size.strip().isdigit():
+            sizes[host] = int(size.strip())
+    return sizes
+
+
+def pool_config(**overrides):
+    """Effective pool settings: environment defaults updated with ``overrides``."""
+    config = {
+        "pool_connections": _env_int("HTTP_POOL_CONNECTIONS", 16),
+        "pool_maxsize": _env_int("HTTP_POOL_MAXSIZE", 16),
+        "host_pool_sizes": parse_host_pool_sizes(env_clean("HTTP_HOST_POOL_SIZES", "")),
+        "retries": _env_int("HTTP_RETRIES", 3),
+        "backoff": _env_float("HTTP_BACKOFF", 1.0),
+        "timeout": _env_float("HTTP_TIMEOUT", 30.0),
+        "transport": (env_clean("HTTP_TRANSPORT", DEFAULT_TRANSPORT) or DEFAULT_TRANSPORT).lower(),
+        "verify": True,
+    }
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    return config
+
+
+def register_transport(name, factory):
+    """Register an adapter factory: ``factory(pool_maxsize, config) -> requests adapter``."""
+    _transports[name.lower()] = factory
+
+
+def _retry(config):
+    return Retry(
+        total=config["retries"],
+        backoff_factor=config["backoff"],
+        status_forcelist=RETRY_STATUS,
+        raise_on_status=False,
+    )
+
+
+def _requests_transport(pool_maxsize, config):
+    return HTTPAdapter(
+        pool_connections=config["pool_connections"],
+        pool_maxsize=pool_maxsize,
+        max_retries=_retry(config),
+    )
+
+
+class _HttpxOriginal:
+    """Stands in for urllib3's ``_original_response`` so requests can read Set-Cookie headers."""
+
+    def __init__(self, headers):
+        self.msg = http.client.HTTPMessage()
+        for name, value in headers.multi_items():
+            self.msg[name] = value
+
+
+class _HttpxRaw:
+    """File-like body so ``Response.iter_content`` / ``.content`` work on httpx streams."""
+
+    def __init__(self, response):
+        self._response = response
+        self._original_response = _HttpxOriginal(response.headers)
+        # iter_bytes undoes gzip/deflate/br like urllib3 does for the requests transport.
+        self._iter = response.iter_bytes()
+        self._buffer = b""
+
+    def read(self, amt=None, decode_content=None):
+        while amt is None or len(self._buffer) < amt:
+            try:
+                self._buffer += next(self._iter)
+            except StopIteration:
+                break
+        if amt is None:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self.close()
+
+
+def _ssl_context(verify, cert):
+    """SSL context for requests-style ``verify`` (bool or CA bundle path) and ``cert``."""
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        bundle = verify if isinstance(verify, str) else requests.utils.DEFAULT_CA_BUNDLE_PATH
+        if os.path.isdir(bundle):
+            context = ssl.create_default_context(capath=bundle)
+        else:
+            context = ssl.create_default_context(cafile=bundle)
+    if cert:
+        certfile, keyfile = cert if isinstance(cert, (tuple, list)) else (cert, None)
+        context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+class HttpxAdapter(BaseAdapter):
+    """requests adapter backed by an ``httpx.Client`` (HTTP/2 when ``h2`` is installed).
+
+    httpx fixes TLS and proxy settings per client, so each distinct
+    ``verify`` / ``cert`` / proxy that requests resolves for a call (including
+    REQUESTS_CA_BUNDLE and the proxy environment variables) gets its own pooled client.
+    """
+
+    def __init__(self, pool_maxsize, config):
+        super().__init__()
+        import httpx
+
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        self._httpx = httpx
+        self._http2 = http2
+        self._pool_maxsize = pool_maxsize
+        self._retries = config["retries"]
+        self._default_verify = config["verify"]
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._client = self._build_client(config["verify"], None, None)
+
+    def _build_client(self, verify, cert, proxy):
+        if cert or isinstance(verify, str):
+            verify = _ssl_context(verify, cert)
+        return self._httpx.Client(
+            http2=self._http2,
+            limits=self._httpx.Limits(max_connections=self._pool_maxsize,
+                                      max_keepalive_connections=self._pool_maxsize),
+            transport=self._httpx.HTTPTransport(retries=self._retries, http2=self._http2,
+                                                verify=verify, proxy=proxy, trust_env=False),
+        )
+
+    def _client_for(self, verify, cert, proxy):
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        key = (verify, cert, proxy)
+        if key == (self._default_verify, None, None):
+            return self._client
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self._build_client(verify, cert, proxy)
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = self._httpx.Timeout(timeout[1], connect=timeout[0])
+        proxy = requests.utils.select_proxy(request.url, proxies) if proxies else None
+        try:
+            client = self._client_for(verify, cert, proxy)
+            upstream = client.send(
+                client.build_request(request.method, request.url, headers=dict(request.headers),
+                                     content=request.body, timeout=timeout),
+                stream=True,
+            )
+        except self._httpx.TimeoutException as e:
+            raise requests.Timeout(str(e), request=request)
+        except self._httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e), request=request)
+
+        response = requests.Response()
+        response.status_code = upstream.status_code
+        response.headers = requests.structures.CaseInsensitiveDict(upstream.headers)
+        if "Content-Encoding" in response.headers:
+            # The body is handed over decoded, so the encoded length no longer applies.
+            response.headers.pop("Content-Encoding")
+            response.headers.pop("Content-Length", None)
+        response.raw = _HttpxRaw(upstream)
+        response.url = str(upstream.url)
+        response.reason = upstream.reason_phrase
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.request = request
+        requests.cookies.extract_cookies_to_jar(response.cookies, request, response.raw)
+        if not stream:
+            response.content  # noqa: B018 - consume the body before releasing the stream
+            upstream.close()
+        return response
+
+    def close(self):
+        self._client.close()
+        with self._clients_lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+register_transport("requests", _requests_transport)
+register_transport("httpx", HttpxAdapter)
+
+
+class PooledSession(requests.Session):
+    """``requests.Session`` that applies the pool's default timeout when none is given."""
+
+    def __init__(self, default_timeout=None):
+        super().__init__()
+        self.default_timeout = default_timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+def build_session(**overrides):
+    """Create a new pooled session (most callers want the shared ``get_session()``)."""
+    config = pool_config(**overrides)
+    factory = _transports.get(config["transport"])
+    if factory is None:
+        print(f"⚠️ 未知的 HTTP_TRANSPORT={config['transport']}，使用 requests")
+        factory = _transports[DEFAULT_TRANSPORT]
+
+    def make_adapter(pool_maxsize):
+        try:
+            return factory(pool_maxsize, config)
+        except ImportError as e:
+            print(f"⚠️ HTTP 传输 {config['transport']} 不可用 ({e})，使用 requests")
+            return _requests_transport(pool_maxsize, config)
+
+    session = PooledSession(default_timeout=config["timeout"])
+    session.verify = config["verify"]
+    adapter = make_adapter(config["pool_maxsize"])
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Longer prefixes win in requests' adapter lookup, so host-specific pools take precedence.
+    for host, size in config["host_pool_sizes"].items():
+        host_adapter = make_adapter(size)
+        session.mount(f"https://{host}", host_adapter)
+        session.mount(f"http://{host}", host_adapter)
+    return session
+
+
+def get_session(name="default", **overrides):
+    """Return the process-wide session called ``name``, creating it on first use.
+
+    ``overrides`` (retries, timeout, verify, transport, ...) only apply when the
+    session is first built; give differently configured sessions different names.
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = build_session(**overrides)
+            _sessions[name] = session
+        return session
+
+
+def close_all():
+    """Close every shared session (mainly for tests and clean shutdown)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
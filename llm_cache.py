@@ -0,0 +1,174 @@
+"""
+Persistent LLM response cache.
+
+Re-running step2 on the same videos used to pay the provider again for every
+identical prompt. Responses are now stored in a SQLite file keyed by a
+fingerprint of (provider, model, full prompt, cover image hash) and served
+before any network call.
+
+- Entries older than ``LLM_CACHE_TTL_DAYS`` are treated as misses and dropped.
+- When the stored responses exceed ``LLM_CACHE_MAX_MB``, the least recently
+  used entries are evicted.
+- Hit/miss counters live in the same database, so ``--workers`` processes add
+  up to one set of numbers for the run summary.
+
+SQLite runs in WAL mode with a busy timeout, so several analyzer processes
+can share the file.
+
+Configuration (environment / .env):
+
+    LLM_CACHE               1 (default) enables the cache, 0 bypasses it
+    LLM_CACHE_PATH          database file (default workspace_data/llm_cache.sqlite3)
+    LLM_CACHE_TTL_DAYS      entry lifetime in days (default 30)
+    LLM_CACHE_MAX_MB        size bound before LRU eviction (default 200)
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from utils import WORK_DIR, env_clean
+
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_MB = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    provider TEXT,
+    model TEXT,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _env_float(name, default):
+    try:
+        return float(env_clean(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def cache_enabled():
+    return env_clean("LLM_CACHE", "1") != "0"
+
+
+def fingerprint(provider, model, prompt, cover_base64=None):
+    """Cache key for one provider request; the cover is reduced to its own hash first."""
+    cover_hash = hashlib.sha256(cover_base64.encode("utf-8")).hexdigest() if cover_base64 else ""
+    digest = hashlib.sha256()
+    for part in (provider or "", model or "", cover_hash, prompt or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response store with TTL expiry and size-bounded LRU eviction."""
+
+    def __init__(self, path, ttl_seconds=None, max_bytes=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else _env_float("LLM_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS) * 86400
+        self.max_bytes = max_bytes if max_bytes is not None else int(_env_float("LLM_CACHE_MAX_MB", DEFAULT_MAX_MB) * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            pass
+        self._conn.executescript(_SCHEMA)
+
+    def _count(self, name, amount=1):
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get_first(self, keys):
+        """``(key, response)`` for the first cached, unexpired key, or None.
+
+        One lookup counts as a single hit or miss however many keys it tries
+        (one per provider of the fallback chain).
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                if now - row[1] > self.ttl_seconds:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    continue
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self._count("hits")
+                return key, row[0]
+            self._count("misses")
+            return None
+
+    def get(self, key):
+        """Cached response text for ``key``, or None (expired entries count as misses)."""
+        hit = self.get_first([key])
+        return hit[1] if hit else None
+
+    def put(self, key, response, provider=None, model=None):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, provider, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, model, response, size, now, now),
+            )
+            self._count("stores")
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._count("evictions", evicted)
+
+    def counters(self):
+        """Persistent totals: {"hits", "misses", "stores", "evictions"}."""
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        return {name: rows.get(name, 0) for name in ("hits", "misses", "stores", "evictions")}
+
+    def entry_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+def get_cache(path=None):
+    """Process-wide cache for ``path`` (default ``LLM_CACHE_PATH``)."""
+    path = os.path.abspath(path or env_clean("LLM_CACHE_PATH", os.path.join(WORK_DIR, "llm_cache.sqlite3")))
+    # Keyed by pid too: a SQLite connection must not be reused in a forked worker.
+    key = (os.getpid(), path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ResponseCache(path)
+        return _caches[key]
+
+
+def counters_delta(before, after):
+    return {name: after.get(name, 0) - before.get(name, 0) for name in after}
@@ -0,0 +1,163 @@
+"""
+Asyncio transport for LLM provider calls.
+
+One background event loop per process owns a pooled ``httpx.AsyncClient``,
+the async Anthropic clients and one ``asyncio.Semaphore`` per provider. Every
+analysis in the process, whichever thread or event loop it runs on, therefore
+shares keep-alive connections and a bounded number of in-flight requests per
+provider:
+
+    raw = llm_transport.run(coro)                  # from sync code (blocks this thread only)
+    await asyncio.gather(*(analyze_content_async(...) for ...))  # from async code
+
+Coroutines may be awaited from any loop; the actual I/O is always hopped onto
+the transport loop. When httpx is not installed, OpenAI-compatible requests go
+through the shared requests session in a worker thread (same semaphores).
+
+Configuration (environment / .env):
+
+    LLM_CONCURRENCY            in-flight requests per provider (default 8)
+    LLM_CONCURRENCY_<NAME>     per-provider override, e.g. LLM_CONCURRENCY_KIMI=2
+    LLM_POOL_SIZE              pooled connections across providers (default 32)
+"""
+
+import os
+import json
+import asyncio
+import threading
+
+from http_pool import get_session
+from utils import env_clean
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_POOL_SIZE = 32
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+# Only touched from the transport loop thread.
+_semaphores = {}
+_anthropic_clients = {}
+_client = None
+
+
+class LLMResponse:
+    """The part of an HTTP response the provider callers need."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _env_int(name, default):
+    try:
+        return int(env_clean(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def concurrency_for(provider):
+    default = _env_int("LLM_CONCURRENCY", DEFAULT_CONCURRENCY)
+    return max(1, _env_int(f"LLM_CONCURRENCY_{provider.upper()}", default))
+
+
+def get_loop():
+    """The process-wide transport loop, started on first use in a daemon thread.
+
+    A forked worker inherits the parent's ``_loop`` but not its thread, so the
+    loop (and everything bound to it) is rebuilt when the pid changes.
+    """
+    global _loop, _loop_pid, _client
+    with _loop_lock:
+        if _loop is None or _loop.is_closed() or _loop_pid != os.getpid():
+            _semaphores.clear()
+            _anthropic_clients.clear()
+            _client = None
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-transport", daemon=True).start()
+            _loop = loop
+            _loop_pid = os.getpid()
+        return _loop
+
+
+def run(coro, timeout=None):
+    """Run ``coro`` on the transport loop and block the calling thread for its result."""
+    loop = get_loop()
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+    if current is loop:
+        coro.close()
+        raise RuntimeError("llm_transport.run() called from the transport loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+async def _on_loop(coro):
+    loop = get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def _slot(provider):
+    semaphore = _semaphores.get(provider)
+    if semaphore is None:
+        semaphore = _semaphores[provider] = asyncio.Semaphore(concurrency_for(provider))
+    return semaphore
+
+
+def _http_client():
+    global _client
+    if _client is None:
+        size = _env_int("LLM_POOL_SIZE", DEFAULT_POOL_SIZE)
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            timeout=300,
+        )
+    return _client
+
+
+async def _post_json(provider, url, headers, payload, timeout):
+    async with _slot(provider):
+        if httpx is None:
+            response = await asyncio.to_thread(
+                get_session("llm").post, url, headers=headers, json=payload, timeout=timeout
+            )
+            return LLMResponse(response.status_code, response.text)
+        response = await _http_client().post(url, headers=headers, json=payload, timeout=timeout)
+        return LLMResponse(response.status_code, response.text)
+
+
+async def post_json(provider, url, headers, payload, timeout=300):
+    """POST ``payload`` as JSON under ``provider``'s concurrency limit; returns an ``LLMResponse``."""
+    return await _on_loop(_post_json(provider, url, headers, payload, timeout))
+
+
+def _anthropic_client(api_key):
+    client = _anthropic_clients.get(api_key)
+    if client is None:
+        import anthropic
+
+        client = _anthropic_clients[api_key] = anthropic.AsyncAnthropic(
+            api_key=api_key, timeout=300.0, max_retries=2
+        )
+    return client
+
+
+async def _anthropic_messages(api_key, kwargs):
+    async with _slot("anthropic"):
+        return await _anthropic_client(api_key).messages.create(**kwargs)
+
+
+async def anthropic_messages(api_key, **kwargs):
+    """``AsyncAnthropic.messages.create(**kwargs)`` under the anthropic concurrency limit."""
+    return await _on_loop(_anthropic_messages(api_key, kwargs))
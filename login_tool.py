@@ -1,11 +1,20 @@
 import os
+import sys
 import time
+import argparse
 import threading
 from playwright.sync_api import sync_playwright
 
+import account_pool
+import browser_daemon
+import login_watcher
+
 # 这里定义“浏览器记忆”保存的位置
 USER_DATA_DIR = "./browser_memory"
 LOGIN_COOKIE_NAMES = {"web_session"}
+# 无界面登录：把登录弹窗里的二维码截图保存下来，供运维在别处扫码
+QR_FILENAME = "login_qr.png"
+QR_SELECTORS = [".qrcode-img", "img[class*='qrcode']", ".login-container"]
 
 
 def _collect_cookie_names(context):
@@ -19,19 +28,22 @@ def _collect_cookie_names(context):
     return {str(c.get("name", "")).lower() for c in cookies if isinstance(c, dict)}
 
 
+LOGIN_SUCCESS_SELECTORS = [
+    '[href*="/user/profile"]',
+    'img[class*="avatar"]',
+    '.user-side-bar',
+    '.user-name',
+]
+LOGIN_SIGNALS = {"success": LOGIN_SUCCESS_SELECTORS, "cookies": sorted(LOGIN_COOKIE_NAMES)}
+
+
 def is_logged_in(context, page):
     """通过 cookie + 页面特征判断是否已登录。"""
     cookie_names = _collect_cookie_names(context)
     if LOGIN_COOKIE_NAMES.intersection(cookie_names):
         return True
 
-    selectors = [
-        '[href*="/user/profile"]',
-        'img[class*="avatar"]',
-        '.user-side-bar',
-        '.user-name',
-    ]
-    for selector in selectors:
+    for selector in LOGIN_SUCCESS_SELECTORS:
         try:
             if page.query_selector(selector):
                 return True
@@ -40,8 +52,28 @@ def is_logged_in(context, page):
     return False
 
 
-def wait_for_login(context, page, timeout_seconds=300, poll_seconds=2):
-    """等待用户登录成功；支持自动检测和手动回车两种结束方式。"""
+def save_login_qr(page, path):
+    """截取登录二维码（找不到二维码元素时截整页），成功返回 True。"""
+    for selector in QR_SELECTORS:
+        try:
+            element = page.query_selector(selector)
+            if element:
+                element.screenshot(path=path)
+                return True
+        except Exception:
+            continue
+    try:
+        page.screenshot(path=path)
+        return True
+    except Exception:
+        return False
+
+
+def wait_for_login(context, page, timeout_seconds=300, poll_seconds=2, qr_path=None):
+    """等待用户登录成功；支持自动检测和手动回车两种结束方式。
+
+    传入 qr_path 时（无界面模式）每次提示都会重新截取二维码，避免二维码过期。
+    """
     manual_confirmed = threading.Event()
 
     def _wait_manual_input():
@@ -59,47 +91,69 @@ def wait_for_login(context, page, timeout_seconds=300, poll_seconds=2):
 
     deadline = time.time() + timeout_seconds
     last_echo = 0
-    while time.time() < deadline:
-        if manual_confirmed.is_set():
-            return True, "manual"
+    changed = True
+    # 只有页面登录信号变化、导航或登录接口响应后才重新检查（短时间片只为及时响应回车）
+    with login_watcher.LoginWatcher(context, page, LOGIN_SIGNALS) as watcher:
+        while time.time() < deadline:
+            if manual_confirmed.is_set():
+                return True, "manual"
 
-        if is_logged_in(context, page):
-            return True, "auto"
+            now = time.time()
+            if now - last_echo >= 15:
+                remain = max(0, int(deadline - now))
+                if qr_path and save_login_qr(page, qr_path):
+                    print(f"📷 登录二维码已更新: {qr_path} (剩余约 {remain} 秒)")
+                else:
+                    print(f"⏳ 等待登录完成... (剩余约 {remain} 秒)")
+                last_echo = now
+                # 兜底：HttpOnly cookie 变化没有页面事件，随提示一起复查
+                changed = True
 
-        now = time.time()
-        if now - last_echo >= 15:
-            remain = max(0, int(deadline - now))
-            print(f"⏳ 等待登录完成... (剩余约 {remain} 秒)")
-            last_echo = now
+            if changed and is_logged_in(context, page):
+                return True, "auto"
 
-        try:
-            page.wait_for_timeout(int(poll_seconds * 1000))
-        except Exception:
-            time.sleep(poll_seconds)
+            try:
+                changed = watcher.wait(poll_seconds, poll_seconds)
+            except Exception:
+                time.sleep(poll_seconds)
+                changed = True
 
     return False, "timeout"
 
 
-def login_and_save_state(timeout_seconds=300):
-    if not os.path.exists(USER_DATA_DIR):
-        os.makedirs(USER_DATA_DIR)
+def login_and_save_state(timeout_seconds=300, profile=None, headless=False):
+    """登录并保存浏览器记忆；profile 为账号池中的账号名（默认账号使用 ./browser_memory）。
+
+    headless=True 用于无图形界面的服务器：二维码截图保存到账号目录下的 login_qr.png。
+    """
+    user_data_dir = USER_DATA_DIR
+    if profile and profile != account_pool.DEFAULT_PROFILE:
+        account_pool.get_pool().add(profile)
+        user_data_dir = account_pool.profile_dir(profile)
+        print(f"👤 账号池账号: {profile}")
+    if not os.path.exists(user_data_dir):
+        os.makedirs(user_data_dir)
         
+    qr_path = os.path.join(user_data_dir, QR_FILENAME) if headless else None
+
     print("🚀 正在启动“有记忆”的浏览器...")
     print("------------------------------------------------")
-    print("👉 1. 窗口弹出后，如果页面空白，请手动刷新网页！")
-    print("👉 2. 扫码登录。")
-    print("👉 3. 登录成功后，回到这里按【回车键】保存退出。")
+    if headless:
+        print(f"👉 1. 无界面模式：二维码截图会保存到 {qr_path}")
+        print("👉 2. 用小红书 App 扫描截图中的二维码。")
+        print("👉 3. 登录成功后会自动保存退出（二维码过期会自动刷新截图）。")
+    else:
+        print("👉 1. 窗口弹出后，如果页面空白，请手动刷新网页！")
+        print("👉 2. 扫码登录。")
+        print("👉 3. 登录成功后，回到这里按【回车键】保存退出。")
     print("------------------------------------------------")
     
     with sync_playwright() as p:
         # 启动持久化浏览器
-        context = p.chromium.launch_persistent_context(
-            user_data_dir=USER_DATA_DIR,
-            headless=False, # 必须有界面
-            viewport={'width': 1280, 'height': 800},
-            channel="chrome", 
-            args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-        )
+        options = browser_daemon.launch_options(user_data_dir, headless)
+        context = p.chromium.launch_persistent_context(channel="chrome", **options)
+        if headless:
+            context.add_init_script(browser_daemon.WEBDRIVER_INIT_SCRIPT)
 
         if context.pages:
             page = context.pages[0]
@@ -114,7 +168,12 @@ def login_and_save_state(timeout_seconds=300):
             print(f"⚠️ 页面加载提示: {e}")
             print("   (这不影响使用，只要你能看到网页就行)")
 
-        success, mode = wait_for_login(context, page, timeout_seconds=timeout_seconds)
+        if qr_path:
+            # 等登录弹窗渲染出二维码再截第一张
+            page.wait_for_timeout(3000)
+            if save_login_qr(page, qr_path):
+                print(f"📷 登录二维码已保存: {qr_path}")
+        success, mode = wait_for_login(context, page, timeout_seconds=timeout_seconds, qr_path=qr_path)
         if success and mode == "auto":
             print("✅ 检测到登录成功，准备保存并返回流程。")
         elif success and mode == "manual":
@@ -127,13 +186,72 @@ def login_and_save_state(timeout_seconds=300):
         page.wait_for_timeout(3000)
         
         try:
-            context.storage_state(path=os.path.join(USER_DATA_DIR, "state.json"))
+            context.storage_state(path=os.path.join(user_data_dir, "state.json"))
         except Exception:
             pass
 
         context.close()
-        print(f"✅ 成功！登录状态已保存到: {USER_DATA_DIR}")
+        if qr_path and os.path.exists(qr_path):
+            os.remove(qr_path)
+        if success:
+            # 重新登录后恢复账号健康状态，账号池会再次分配它
+            account_pool.get_pool().update(profile or account_pool.DEFAULT_PROFILE,
+                                           status=account_pool.STATUS_OK, cooldown_until=0)
+        print(f"✅ 成功！登录状态已保存到: {user_data_dir}")
         print("   现在可继续运行 step3_batch.py / step5_auto_pipeline.py 开始分析。")
 
+def print_profiles():
+    pool = account_pool.get_pool()
+    print("👥 账号池:")
+    for name, record in pool.profiles().items():
+        exists = os.path.isdir(account_pool.profile_dir(name))
+        state = record.get("status", account_pool.STATUS_OK)
+        cooldown = record.get("cooldown_until", 0) - time.time()
+        if cooldown > 0:
+            state += f"（冷却剩余 {int(cooldown)} 秒）"
+        if not record.get("enabled", True):
+            state += "，已禁用"
+        if not exists:
+            state += "，未登录过"
+        print(f"   - {name}: 并发 {record.get('concurrency', 1)}，状态 {state}")
+
+
+def update_profile(name, **fields):
+    """修改账号池里已有账号的设置；账号从未登录过时提示先登录并返回 False。"""
+    pool = account_pool.get_pool()
+    if name not in pool.profiles() or not os.path.isdir(account_pool.profile_dir(name)):
+        print(f"❌ 账号池中没有 {name}，请先运行 python login_tool.py --profile {name} 登录")
+        return False
+    pool.update(name, **fields)
+    return True
+
+
 if __name__ == "__main__":
-    login_and_save_state()
+    parser = argparse.ArgumentParser(description="登录小红书并保存浏览器记忆；支持多账号池")
+    parser.add_argument("--profile", "-p", type=str, default=None,
+                        help="账号名（保存到 browser_profiles/<name>），不填则为默认账号 ./browser_memory")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="该账号在达人主页模式下的并发标签页数")
+    parser.add_argument("--headless", action="store_true", default=browser_daemon.headless_requested(),
+                        help="无界面登录（服务器使用）：二维码截图保存到账号目录的 login_qr.png")
+    parser.add_argument("--list", action="store_true", help="列出账号池及健康状态")
+    parser.add_argument("--disable", action="store_true", help="禁用该账号（不再分配）")
+    parser.add_argument("--enable", action="store_true", help="重新启用该账号并清除冷却状态")
+    args = parser.parse_args()
+
+    name = args.profile or account_pool.DEFAULT_PROFILE
+    if args.list:
+        print_profiles()
+    elif args.disable or args.enable or args.concurrency:
+        fields = {}
+        if args.disable:
+            fields["enabled"] = False
+        if args.enable:
+            fields.update(enabled=True, status=account_pool.STATUS_OK, cooldown_until=0)
+        if args.concurrency:
+            fields["concurrency"] = max(1, args.concurrency)
+        if not update_profile(name, **fields):
+            sys.exit(1)
+        print_profiles()
+    else:
+        login_and_save_state(profile=args.profile, headless=args.headless)
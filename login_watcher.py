@@ -0,0 +1,207 @@
+"""
+Event-driven login detection shared by step1_scraper and login_tool.
+
+Login waits used to poll every two seconds, and every poll serialized the whole
+page with ``page.content()`` to grep for login hint words. Here the browser does
+the watching instead:
+
+- ``probe`` gathers all login signals (login/success/content selectors, hint
+  words, non-HttpOnly login cookies) with a single ``evaluate``, so no HTML
+  crosses the wire.
+- ``LoginWatcher.wait`` parks in ``page.wait_for_function(polling="mutation")``.
+  The predicate is re-run by the page only when the DOM mutates, and it resolves
+  once one of those signals differs from the last snapshot.
+- Main-frame navigations and login API responses mark the cached cookie state
+  dirty, so ``context.cookies()`` is read once per event instead of once per poll.
+
+Pages without ``evaluate`` / ``wait_for_function`` (test fakes) fall back to
+plain ``wait_for_timeout`` polling.
+
+The signals dict passed to ``probe`` / ``LoginWatcher``:
+
+    {"login": [css...], "success": [css...], "content": [css...],
+     "hints": ["扫码登录", ...], "cookies": ["web_session", ...]}
+"""
+
+import time
+import threading
+
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+XHS_URL = "https://www.xiaohongshu.com"
+# Upper bound on one mutation wait; also the safety net for HttpOnly cookie changes.
+WATCH_SLICE_SECONDS = 15
+# A parked mutation wait cannot be interrupted by page events; re-check them this often.
+EVENT_SLICE_SECONDS = 1
+# Playwright's error when a navigation tears down the frame the predicate runs in.
+CONTEXT_DESTROYED_HINTS = ("execution context was destroyed", "because of a navigation")
+# Responses that may set or clear the login cookie.
+LOGIN_EVENT_HINTS = ("/login", "/user/me", "/activate", "/logout")
+
+_STATE_JS = """
+    const any = (sels) => (sels || []).some((s) => {
+        try { return !!document.querySelector(s); } catch (e) { return false; }
+    });
+    const jar = document.cookie.split('; ');
+    const state = {
+        login: any(cfg.login),
+        success: any(cfg.success),
+        content: any(cfg.content),
+        cookie: (cfg.cookies || []).some((name) => jar.some((c) => c.startsWith(name))),
+    };
+"""
+LOGIN_STATE_JS = """
+(cfg) => {%s
+    const text = (document.body && document.body.textContent) || '';
+    state.hint = (cfg.hints || []).some((w) => text.includes(w));
+    return state;
+}
+""" % _STATE_JS
+# Hint words are left out of the change predicate: textContent on every mutation is not cheap.
+LOGIN_CHANGED_JS = """
+(cfg) => {%s
+    return ['login', 'success', 'content', 'cookie'].some((k) => state[k] !== cfg.last[k]);
+}
+""" % _STATE_JS
+
+
+def probe(page, signals):
+    """All login signals of ``page`` in one round-trip, or None if the page cannot evaluate."""
+    try:
+        state = page.evaluate(LOGIN_STATE_JS, signals)
+    except Exception:
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def is_context_destroyed(error):
+    message = str(error).lower()
+    return any(hint in message for hint in CONTEXT_DESTROYED_HINTS)
+
+
+def is_login_event(url, resource_type=""):
+    """True for responses after which the login cookie may have changed."""
+    url = str(url or "").lower()
+    return resource_type == "document" or any(hint in url for hint in LOGIN_EVENT_HINTS)
+
+
+def cookies_have_login(cookies, names):
+    jar = {str(c.get("name", "")).lower() for c in cookies or [] if isinstance(c, dict)}
+    return any(any(cookie.startswith(name) for name in names) for cookie in jar)
+
+
+class LoginWatcher:
+    """Watches one page for login state changes; use as a context manager to detach listeners."""
+
+    def __init__(self, context, page, signals, cookie_url=XHS_URL):
+        self.context = context
+        self.page = page
+        self.signals = signals
+        self.cookie_url = cookie_url
+        self._dirty = threading.Event()
+        self._dirty.set()
+        self._pending = threading.Event()
+        self._cookie = False
+        self._listeners = []
+        for event, handler in (("framenavigated", self._on_navigated), ("response", self._on_response)):
+            try:
+                page.on(event, handler)
+                self._listeners.append((event, handler))
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def close(self):
+        for event, handler in self._listeners:
+            try:
+                self.page.remove_listener(event, handler)
+            except Exception:
+                pass
+        self._listeners = []
+
+    def _on_navigated(self, frame):
+        try:
+            if frame.parent_frame is not None:
+                return
+        except Exception:
+            pass
+        self._mark()
+
+    def _mark(self):
+        self._dirty.set()
+        self._pending.set()
+
+    def _on_response(self, response):
+        try:
+            if is_login_event(response.url, response.request.resource_type):
+                self._mark()
+        except Exception:
+            pass
+
+    def has_login_cookie(self):
+        """Cached ``context.cookies()`` check, refreshed only after a login-relevant event."""
+        if not self._dirty.is_set():
+            return self._cookie
+        self._dirty.clear()
+        if not self.context:
+            self._cookie = False
+            return False
+        try:
+            cookies = self.context.cookies(self.cookie_url)
+        except Exception:
+            try:
+                cookies = self.context.cookies()
+            except Exception:
+                cookies = []
+        self._cookie = cookies_have_login(cookies, self.signals.get("cookies") or ())
+        return self._cookie
+
+    def wait(self, timeout_seconds=WATCH_SLICE_SECONDS, poll_seconds=2):
+        """Block until the page's login signals change or ``timeout_seconds`` pass.
+
+        Returns True when a change (DOM signal, navigation or login response) was
+        seen. The mutation wait is parked in EVENT_SLICE_SECONDS slices so that a
+        navigation or login response (e.g. an HttpOnly cookie set by the QR login)
+        wakes it within a second. A navigation that destroys the predicate's
+        execution context counts as a change; other errors (closed page, ...)
+        propagate.
+        """
+        if self._pending.is_set():
+            self._pending.clear()
+            return True
+        last = probe(self.page, self.signals)
+        if last is None or not hasattr(self.page, "wait_for_function"):
+            self.page.wait_for_timeout(int(poll_seconds * 1000))
+            self._dirty.set()
+            return True
+        arg = dict(self.signals, last=last)
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # HttpOnly cookies are invisible to the page: re-read them once per slice.
+                self._dirty.set()
+                return False
+            try:
+                self.page.wait_for_function(
+                    LOGIN_CHANGED_JS,
+                    arg=arg,
+                    polling="mutation",
+                    timeout=max(1, int(min(EVENT_SLICE_SECONDS, remaining) * 1000)),
+                )
+            except PlaywrightTimeoutError:
+                if self._pending.is_set():
+                    break
+                continue
+            except Exception as e:
+                if not is_context_destroyed(e):
+                    raise
+            break
+        self._pending.clear()
+        self._dirty.set()
+        return True
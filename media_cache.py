@@ -0,0 +1,160 @@
+"""
+Note-ID-keyed media cache for step1_scraper.
+
+``<work_dir>/media_index.json`` maps each XHS note id to the video and meta JSON
+already on disk, plus the video's SHA-256. Re-scraping a known note then only
+refreshes the meta (stats, title, comments) in place and reuses the local video,
+instead of downloading it again and writing a duplicate ``meta_*.json`` that
+step2 would analyze twice.
+
+The hash side of the index catches the same video published under different
+notes: the second copy is replaced with a hard link to the first.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+INDEX_FILENAME = "media_index.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+# Meta keys owned by the first scrape; a refresh never overwrites them.
+STABLE_META_KEYS = ("id", "timestamp")
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_enabled():
+    return os.getenv("MEDIA_CACHE", "1") != "0"
+
+
+class MediaCache:
+    """JSON-backed index ``{"notes": {note_id: entry}, "hashes": {sha256: video_path}}``.
+
+    Every mutation re-reads the index from disk under a lock and writes it back
+    atomically, so concurrent download threads (and separate runs) don't lose entries.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self.index_path = os.path.join(work_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault("notes", {})
+        data.setdefault("hashes", {})
+        return data
+
+    def _save(self, data):
+        os.makedirs(self.work_dir, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def lookup(self, note_id):
+        """Return the entry for ``note_id`` if its meta JSON still exists, else None."""
+        if not note_id or note_id == "unknown":
+            return None
+        with self._lock:
+            entry = self._load()["notes"].get(note_id)
+        if not entry or not os.path.exists(entry.get("meta_path") or ""):
+            return None
+        return dict(entry)
+
+    def entries(self):
+        """All ``{note_id: entry}`` whose meta JSON still exists."""
+        with self._lock:
+            notes = self._load()["notes"]
+        return {note_id: dict(entry) for note_id, entry in notes.items()
+                if os.path.exists(entry.get("meta_path") or "")}
+
+    @staticmethod
+    def cached_video(entry):
+        """Path of the entry's video if it is still on disk with the recorded size."""
+        path = (entry or {}).get("video_path")
+        if not path or not os.path.exists(path):
+            return None
+        size = entry.get("size")
+        if size is not None and os.path.getsize(path) != size:
+            return None
+        return path
+
+    def adopt_video(self, path):
+        """Hash a freshly downloaded video; if the same bytes are already cached elsewhere,
+        replace ``path`` with a hard link to that file. Returns (path, sha256)."""
+        if not os.path.exists(path):
+            return path, None
+        sha = file_sha256(path)
+        with self._lock:
+            existing = self._load()["hashes"].get(sha)
+        if existing and existing != path and os.path.exists(existing):
+            try:
+                tmp = path + ".link"
+                os.link(existing, tmp)
+                os.replace(tmp, path)
+                print(f"♻️ 视频内容与已缓存文件相同，已改为硬链接: {existing}")
+            except OSError:
+                pass
+        return path, sha
+
+    def record(self, note_id, video_path, meta_path, sha256=None):
+        if not note_id or note_id == "unknown":
+            return
+        if video_path and os.path.exists(video_path) and sha256 is None:
+            sha256 = file_sha256(video_path)
+        with self._lock:
+            data = self._load()
+            previous = data["notes"].get(note_id, {})
+            entry = {
+                "video_path": video_path,
+                "meta_path": meta_path,
+                "sha256": sha256,
+                "size": os.path.getsize(video_path) if video_path and os.path.exists(video_path) else None,
+                "first_seen": previous.get("first_seen", int(time.time())),
+                "updated_at": int(time.time()),
+            }
+            data["notes"][note_id] = entry
+            known = data["hashes"].get(sha256)
+            if sha256 and (not known or not os.path.exists(known)):
+                data["hashes"][sha256] = video_path
+            self._save(data)
+
+    def refresh_meta(self, entry, meta_data):
+        """Merge freshly scraped fields into the cached meta JSON and rewrite it in place."""
+        meta_path = entry["meta_path"]
+        with open(meta_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        for key, value in meta_data.items():
+            if key not in STABLE_META_KEYS:
+                cached[key] = value
+        cached["refreshed_at"] = int(time.time())
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cached, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, meta_path)
+        return cached
+
+
+def get_cache(work_dir):
+    """Process-wide MediaCache for ``work_dir``."""
+    key = os.path.abspath(work_dir)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = MediaCache(work_dir)
+        return _caches[key]
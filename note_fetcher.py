@@ -0,0 +1,178 @@
+"""
+Browserless XHS note fetch.
+
+Note pages are server-rendered with the full note in ``window.__INITIAL_STATE__``,
+so for most notes a plain GET is enough: the cookies ``login_tool.py`` saved to
+``<profile>/state.json`` (Playwright ``storage_state`` format) are loaded into a
+pooled session, the HTML is fetched, and the state object is parsed without ever
+starting Chrome.
+
+``fetch_note`` never raises for page-level problems; it returns a ``NoteFetch``
+whose ``reason`` tells step1 why the caller should fall back to Playwright
+(``login_wall``, ``captcha``, ``rate_limited``, ``missing`` or ``error``).
+
+Configuration (environment / .env):
+
+    NOTE_HTTP_FETCH     1 (default) tries the HTTP path first, 0 always uses the browser
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse
+
+from requests.cookies import create_cookie
+
+from http_pool import get_session
+from utils import env_clean
+
+STATE_FILENAME = "state.json"
+XHS_HOSTS = ("xiaohongshu.com", "xhslink.com")
+RATE_LIMITED_STATUSES = (429, 461)
+STATE_MARKER = "window.__INITIAL_STATE__"
+SCRIPT_END = "</script>"
+# JS literals that are not JSON; only replaced outside of strings (see _js_to_json).
+_JS_UNDEFINED = re.compile(r'"(?:[^"\\]|\\.)*"|\bundefined\b')
+DESKTOP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9",
+    "Referer": "https://www.xiaohongshu.com/",
+}
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def http_fetch_enabled():
+    return env_clean("NOTE_HTTP_FETCH", "1") != "0"
+
+
+def is_xhs_url(url):
+    host = (urlparse(str(url or "")).hostname or "").lower()
+    return any(host == h or host.endswith("." + h) for h in XHS_HOSTS)
+
+
+class NoteFetch:
+    """Result of one HTTP note fetch: the raw state note, or the reason it is unusable."""
+
+    def __init__(self, url, status=None, note=None, reason=None, error=None):
+        self.url = url
+        self.status = status
+        self.note = note
+        self.reason = reason
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.note is not None and self.reason is None
+
+
+def load_storage_cookies(session, state_path):
+    """Copy the unexpired cookies of a Playwright ``storage_state`` file into ``session``.
+
+    Returns the number of cookies loaded (0 when the file is missing or unreadable).
+    """
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            cookies = json.load(f).get("cookies") or []
+    except (OSError, ValueError):
+        return 0
+    now = time.time()
+    count = 0
+    for cookie in cookies:
+        expires = cookie.get("expires")
+        if expires not in (None, -1) and 0 < expires < now:
+            continue
+        session.cookies.set_cookie(create_cookie(
+            name=cookie["name"],
+            value=cookie.get("value", ""),
+            domain=cookie.get("domain", ""),
+            path=cookie.get("path", "/"),
+            secure=bool(cookie.get("secure")),
+            expires=int(expires) if expires not in (None, -1) else None,
+            rest={"HttpOnly": None} if cookie.get("httpOnly") else {},
+        ))
+        count += 1
+    return count
+
+
+def session_for(user_data_dir):
+    """Pooled session carrying the cookies of ``<user_data_dir>/state.json``; reloaded when the file changes."""
+    state_path = os.path.join(user_data_dir, STATE_FILENAME)
+    session = get_session(f"xhs:{os.path.abspath(user_data_dir)}", retries=1)
+    try:
+        mtime = os.path.getmtime(state_path)
+    except OSError:
+        mtime = None
+    with _loaded_lock:
+        if _loaded.get(state_path) != mtime:
+            session.cookies.clear()
+            load_storage_cookies(session, state_path)
+            _loaded[state_path] = mtime
+    return session
+
+
+def _js_to_json(text):
+    """``undefined`` is valid in the inline state script but not in JSON."""
+    return _JS_UNDEFINED.sub(lambda m: "null" if m.group(0) == "undefined" else m.group(0), text)
+
+
+def extract_initial_state(html):
+    """Parse ``window.__INITIAL_STATE__ = {...}`` out of the page HTML, or return None."""
+    start = html.find(STATE_MARKER)
+    if start < 0:
+        return None
+    end = html.find(SCRIPT_END, start)
+    body = html[start + len(STATE_MARKER):end if end >= 0 else None]
+    body = body.strip().lstrip("=").strip().rstrip(";").strip()
+    try:
+        return json.loads(_js_to_json(body))
+    except ValueError:
+        return None
+
+
+def note_from_state(state, note_id=None):
+    """``state.note.noteDetailMap[note_id].note`` (or the first entry that has a note)."""
+    detail_map = ((state or {}).get("note") or {}).get("noteDetailMap") or {}
+    entry = detail_map.get(note_id) if note_id else None
+    if not (entry and entry.get("note")):
+        entry = next((v for v in detail_map.values() if isinstance(v, dict) and (v.get("note") or {}).get("noteId")), None)
+    note = (entry or {}).get("note")
+    return note if isinstance(note, dict) and note.get("noteId") else None
+
+
+def _page_reason(final_url, status):
+    url = (final_url or "").lower()
+    if status in RATE_LIMITED_STATUSES:
+        return "rate_limited"
+    if "captcha" in url or "/website-login/verify" in url:
+        return "captcha"
+    if "/login" in url:
+        return "login_wall"
+    return None
+
+
+def fetch_note(url, user_data_dir, note_id=None, timeout=15):
+    """GET a note page with the profile's saved cookies and return a ``NoteFetch``."""
+    try:
+        response = session_for(user_data_dir).get(url, headers=DESKTOP_HEADERS, timeout=timeout, allow_redirects=True)
+    except Exception as e:
+        return NoteFetch(url, reason="error", error=e)
+    result = NoteFetch(response.url, status=response.status_code)
+    result.reason = _page_reason(response.url, response.status_code)
+    if result.reason:
+        return result
+    if response.status_code >= 400:
+        result.reason = "error"
+        return result
+    note = note_from_state(extract_initial_state(response.text), note_id)
+    if note is None:
+        # No SSR state usually means the guest/login shell was served instead of the note.
+        result.reason = "missing"
+        return result
+    result.note = note
+    return result
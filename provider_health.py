@@ -0,0 +1,267 @@
+"""
+Health registry for the LLM provider fallback chain.
+
+``build_provider_chain`` is a static preference order. Before this module, a
+provider that was down or very slow cost every video a full request timeout
+before the next provider was tried. Every provider call now reports back here:
+
+* an EWMA of latency (successful calls) and error rate per provider;
+* a circuit breaker: ``PROVIDER_BREAKER_FAILURES`` consecutive failures open it
+  for ``PROVIDER_BREAKER_COOLDOWN`` seconds, doubling on every re-trip (capped
+  at MAX_COOLDOWN). Once the cool-down passes, one trial call is let through
+  (half-open); success closes the breaker, failure re-opens it;
+* whether each provider/model accepts image input, so the image-then-text retry
+  is paid once instead of on every call (re-checked after IMAGE_RECHECK_DAYS).
+
+``order`` keeps the configured preference but moves degraded providers (error
+rate at or above DEGRADED_ERROR_RATE) and open breakers to the back. With
+``PROVIDER_ROUTING=latency``, healthy providers are also sorted by their latency
+EWMA. State is saved to ``workspace_data/provider_health.json``, so the next run
+does not re-discover a dead provider or a text-only model. Saves merge with the
+file under a lock (``provider_health.json.lock``): ``--workers`` processes keep
+each other's records and pick them up on their next save.
+
+Configuration (environment / .env):
+
+    PROVIDER_BREAKER_FAILURES   consecutive failures before skipping a provider (default 3)
+    PROVIDER_BREAKER_COOLDOWN   first skip period in seconds (default 300)
+    PROVIDER_ROUTING            "health" (default) or "latency"
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from utils import WORK_DIR, env_clean
+
+EWMA_ALPHA = 0.3
+DEFAULT_BREAKER_FAILURES = 3
+DEFAULT_BREAKER_COOLDOWN = 300
+MAX_COOLDOWN = 3600
+DEGRADED_ERROR_RATE = 0.5
+IMAGE_RECHECK_DAYS = 7
+# Statuses on the image attempt that mean "this request shape is not accepted";
+# 429 / 5xx / timeouts say nothing about image support.
+IMAGE_REJECT_STATUSES = (400, 413, 415, 422)
+# ``acquire`` result for the single half-open trial call.
+TRIAL = "trial"
+STATE_FILE = os.path.join(WORK_DIR, "provider_health.json")
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    try:
+        return int(env_clean(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _ewma(previous, value):
+    return value if previous is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Exclusive inter-process lock on ``path`` (no-op where neither fcntl nor msvcrt exists)."""
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _merge_images(mine, theirs):
+    merged = dict(theirs or {})
+    for model, seen in (mine or {}).items():
+        if seen.get("checked_at", 0) >= (merged.get(model) or {}).get("checked_at", 0):
+            merged[model] = seen
+    return merged
+
+
+def _new_record():
+    return {"latency": None, "error_rate": None, "calls": 0, "failures": 0,
+            "opens": 0, "open_until": 0, "images": {}}
+
+
+class ProviderHealth:
+    """Thread-safe per-provider health records; ``acquire`` / ``record`` bracket every call."""
+
+    def __init__(self, state_path=None, failures=None, cooldown=None, routing=None, log=print):
+        self.state_path = state_path
+        self.failures = max(1, failures or _env_int("PROVIDER_BREAKER_FAILURES", DEFAULT_BREAKER_FAILURES))
+        self.cooldown = max(1, cooldown or _env_int("PROVIDER_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN))
+        self.routing = (routing or env_clean("PROVIDER_ROUTING", "health") or "health").lower()
+        self.log = log
+        self._lock = threading.Lock()
+        self._trials = set()
+        self._records = self._load_state()
+
+    def _load_state(self):
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                providers = json.load(f).get("providers", {})
+        except (OSError, ValueError):
+            return {}
+        records = {}
+        for name, saved in providers.items():
+            if isinstance(saved, dict):
+                records[name] = dict(_new_record(), **saved)
+        return records
+
+    def _save_state(self, touched):
+        """Merge with the file under a lock, then write; ``touched`` providers keep this process's record."""
+        if not self.state_path:
+            return
+        try:
+            with _file_lock(self.state_path + ".lock"):
+                for name, theirs in self._load_state().items():
+                    mine = self._records.get(name)
+                    if mine is None or name not in touched:
+                        # Another worker's newer view of a provider this process did not just update.
+                        self._records[name] = theirs
+                    else:
+                        mine["images"] = _merge_images(mine["images"], theirs["images"])
+                tmp = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"providers": self._records, "updated_at": int(time.time())}, f,
+                              indent=2, ensure_ascii=False)
+                os.replace(tmp, self.state_path)
+        except OSError:
+            pass
+
+    def _record(self, provider):
+        record = self._records.get(provider)
+        if record is None:
+            record = self._records[provider] = _new_record()
+        return record
+
+    def _tier(self, record, now):
+        if record["open_until"] > now:
+            return 2
+        if (record["error_rate"] or 0) >= DEGRADED_ERROR_RATE:
+            return 1
+        return 0
+
+    def order(self, chain):
+        """``chain`` reordered: healthy first, then degraded, open breakers last (stable otherwise)."""
+        now = time.time()
+        with self._lock:
+            def key(provider):
+                record = self._records.get(provider) or _new_record()
+                # Providers without a latency sample sort first so they get measured.
+                latency = (record["latency"] or 0) if self.routing == "latency" else 0
+                return self._tier(record, now), latency
+
+            return sorted(chain, key=key)
+
+    def acquire(self, provider):
+        """Truthy if ``provider`` may be called now.
+
+        After a cool-down the single half-open trial is claimed and ``TRIAL`` is
+        returned; hand it back with ``release`` if the call ends without ``record``.
+        """
+        now = time.time()
+        with self._lock:
+            record = self._records.get(provider)
+            if record is None or record["failures"] < self.failures:
+                return True
+            if record["open_until"] > now or provider in self._trials:
+                return False
+            self._trials.add(provider)
+            return TRIAL
+
+    def release(self, provider, claim):
+        """Give back an unused half-open trial (e.g. the call was cancelled)."""
+        if claim == TRIAL:
+            with self._lock:
+                self._trials.discard(provider)
+
+    def record(self, provider, ok, seconds=None):
+        """Feed back one call; failures past the threshold open the breaker."""
+        tripped = None
+        with self._lock:
+            self._trials.discard(provider)
+            record = self._record(provider)
+            record["calls"] += 1
+            record["error_rate"] = round(_ewma(record["error_rate"], 0.0 if ok else 1.0), 4)
+            if ok:
+                if seconds is not None:
+                    record["latency"] = round(_ewma(record["latency"], float(seconds)), 3)
+                record.update(failures=0, opens=0, open_until=0)
+            else:
+                record["failures"] += 1
+                if record["failures"] >= self.failures:
+                    record["opens"] += 1
+                    tripped = min(self.cooldown * 2 ** (record["opens"] - 1), MAX_COOLDOWN)
+                    record["open_until"] = time.time() + tripped
+            self._save_state({provider})
+        if tripped:
+            self.log(f"🔌 {provider} 连续失败 {record['failures']} 次，熔断 {tripped:.0f} 秒（期间直接跳过）")
+
+    def accepts_images(self, provider, model):
+        """True / False from a previous call, or None when unknown (or due for a re-check)."""
+        with self._lock:
+            seen = (self._records.get(provider) or {}).get("images", {}).get(model or "")
+        if not seen or time.time() - seen.get("checked_at", 0) > IMAGE_RECHECK_DAYS * 86400:
+            return None
+        return seen.get("supported")
+
+    def set_image_support(self, provider, model, supported):
+        with self._lock:
+            self._record(provider)["images"][model or ""] = {"supported": bool(supported),
+                                                               "checked_at": int(time.time())}
+            self._save_state({provider})
+
+    def describe(self, provider):
+        """One-line Chinese summary for the startup banner."""
+        now = time.time()
+        with self._lock:
+            record = self._records.get(provider)
+            if not record or not record["calls"]:
+                return "暂无历史"
+            parts = []
+            if record["latency"] is not None:
+                parts.append(f"延迟≈{record['latency']:.1f}s")
+            parts.append(f"错误率 {(record['error_rate'] or 0) * 100:.0f}%")
+            if record["open_until"] > now:
+                parts.append(f"熔断中（剩余 {int(record['open_until'] - now)} 秒）")
+            elif record["failures"] >= self.failures:
+                parts.append("熔断冷却结束，待试探")
+            return "，".join(parts)
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._records))
+
+
+def get_health():
+    """Process-wide registry persisted to ``workspace_data/provider_health.json``."""
+    pid = os.getpid()
+    with _registries_lock:
+        if pid not in _registries:
+            _registries[pid] = ProviderHealth(state_path=STATE_FILE)
+        return _registries[pid]
@@ -8,13 +8,15 @@ import sys
 import json
 import re
 import glob
-import ssl
-import urllib.request
 from datetime import datetime
+import urllib3
 from dotenv import load_dotenv
 
+from http_pool import get_session
+
 # 加载环境变量
 load_dotenv('.env.local')
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 API_KEY = os.getenv("NOTION_TOKEN", "")
 CONTENT_DB = os.getenv("NOTION_DATABASE_ID", "")
@@ -29,15 +31,12 @@ def make_request(method, endpoint, data=None):
     }
     
     try:
-        context = ssl._create_unverified_context()
-        if data:
-            req_data = json.dumps(data).encode('utf-8')
-            request = urllib.request.Request(url, data=req_data, headers=headers, method=method)
-        else:
-            request = urllib.request.Request(url, headers=headers, method=method)
-        
-        with urllib.request.urlopen(request, context=context) as response:
-            return json.loads(response.read().decode('utf-8'))
+        # 沿用原先不校验证书的行为，单独命名一个会话
+        session = get_session("notion", verify=False)
+        req_data = json.dumps(data).encode('utf-8') if data else None
+        response = session.request(method, url, data=req_data, headers=headers)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         print(f"API错误: {str(e)[:200]}")
         return None
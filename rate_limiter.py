@@ -0,0 +1,258 @@
+"""
+Adaptive per-domain rate scheduler.
+
+Replaces the fixed random sleeps in step3_batch and the profile scraper with one
+token bucket per platform (xiaohongshu, douyin, bilibili, youtube, or the bare
+host for anything else). Each bucket adapts AIMD-style:
+
+* every clean page adds a fixed step to the request rate, up to the domain's
+  ceiling (``min_interval``);
+* a risk signal cuts the rate multiplicatively and, for hard signals, pauses the
+  domain for a cool-down. Hard signals are login walls, captchas and 429/461
+  responses. Empty stats are a soft signal.
+
+Learned intervals are saved to ``workspace_data/rate_state.json``, so the next
+batch starts near the last known-safe pace instead of at the worst case.
+
+Per-domain limits can be overridden with
+``RATE_LIMITS="xiaohongshu=5/2/60,douyin=4/1.5/60"`` (start/min/max seconds between requests).
+"""
+
+import os
+import json
+import time
+import atexit
+import random
+import threading
+from urllib.parse import urlparse
+
+from utils import WORK_DIR, env_clean
+
+DOMAIN_ALIASES = {
+    "xiaohongshu": ("xiaohongshu.com", "xhslink.com", "xhscdn.com"),
+    "douyin": ("douyin.com", "iesdouyin.com", "douyinvod.com"),
+    "bilibili": ("bilibili.com", "b23.tv", "bilivideo.com"),
+    "youtube": ("youtube.com", "youtu.be", "googlevideo.com"),
+}
+# (start, min, max) seconds between requests
+DEFAULT_LIMITS = {
+    "xiaohongshu": (5.0, 2.0, 60.0),
+    "douyin": (4.0, 1.5, 60.0),
+    "bilibili": (2.0, 0.5, 30.0),
+    "youtube": (1.0, 0.2, 30.0),
+    "default": (3.0, 1.0, 30.0),
+}
+HARD_SIGNALS = ("login_wall", "captcha", "rate_limited")
+SOFT_SIGNALS = ("empty",)
+HARD_DECREASE = 0.5
+SOFT_DECREASE = 0.75
+# Clean responses needed to climb from the start rate to the ceiling.
+INCREASE_STEPS = 10
+COOLDOWN_INTERVALS = 3
+JITTER = 0.2
+STATE_FILE = os.path.join(WORK_DIR, "rate_state.json")
+# Clean responses nudge the rate on every note; write them out at most this often.
+SAVE_INTERVAL = 5.0
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def domain_key(url_or_key):
+    """Map a URL (or an existing key) to its bucket name."""
+    value = str(url_or_key or "").strip().lower()
+    host = urlparse(value).hostname if "://" in value else value
+    host = host or value
+    for key, suffixes in DOMAIN_ALIASES.items():
+        if host == key or any(host == s or host.endswith("." + s) for s in suffixes):
+            return key
+    return host or "default"
+
+
+def parse_limits(value):
+    """Parse ``domain=start/min/max,...`` into ``{domain: (start, min, max)}``."""
+    limits = {}
+    for item in (value or "").split(","):
+        name, _, spec = item.partition("=")
+        parts = spec.split("/")
+        if not name.strip() or len(parts) != 3:
+            continue
+        try:
+            start, low, high = (float(p) for p in parts)
+        except ValueError:
+            continue
+        low, high = min(low, high), max(low, high)
+        limits[name.strip().lower()] = (min(max(start, low), high), low, high)
+    return limits
+
+
+class _Bucket:
+    def __init__(self, start, low, high):
+        self.min_interval = low
+        self.max_interval = high
+        self.rate = 1.0 / start
+        self.step = max(0.0, (1.0 / low - 1.0 / start) / INCREASE_STEPS)
+        # Start full so the first request never waits.
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+        self.clean = 0
+        self.penalties = 0
+
+    @property
+    def interval(self):
+        return 1.0 / self.rate
+
+    def refill(self, now):
+        self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def clamp(self):
+        self.rate = min(1.0 / self.min_interval, max(1.0 / self.max_interval, self.rate))
+
+
+class AdaptiveRateLimiter:
+    """Thread-safe token buckets keyed by domain; ``reserve`` hands out staggered slots."""
+
+    def __init__(self, limits=None, state_path=None, jitter=JITTER, log=print):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(parse_limits(env_clean("RATE_LIMITS", "")) if limits is None else limits)
+        self.state_path = state_path
+        self.jitter = jitter
+        self.log = log
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._learned = self._load_state()
+        self._dirty = False
+        self._saved_at = 0.0
+        if state_path:
+            atexit.register(self.flush)
+
+    def _load_state(self):
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("intervals", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, force=True):
+        """Write learned intervals; unforced saves are throttled to one per SAVE_INTERVAL."""
+        if not self.state_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at < SAVE_INTERVAL:
+            self._dirty = True
+            return
+        self._dirty = False
+        self._saved_at = now
+        try:
+            intervals = dict(self._learned)
+            intervals.update({k: round(b.interval, 3) for k, b in self._buckets.items()})
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"intervals": intervals, "updated_at": int(time.time())}, f, indent=2)
+            os.replace(tmp, self.state_path)
+        except OSError:
+            pass
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            start, low, high = self.limits.get(key, self.limits["default"])
+            learned = self._learned.get(key)
+            if learned:
+                start = min(max(float(learned), low), high)
+            bucket = self._buckets[key] = _Bucket(start, low, high)
+        return bucket
+
+    def interval(self, url_or_key):
+        with self._lock:
+            return self._bucket(domain_key(url_or_key)).interval
+
+    def reserve(self, url_or_key):
+        """Take one token and return how many seconds the caller should wait before its request."""
+        key = domain_key(url_or_key)
+        with self._lock:
+            bucket = self._bucket(key)
+            now = time.monotonic()
+            bucket.refill(now)
+            bucket.tokens -= 1.0
+            # Negative tokens are queued reservations: each one waits a further interval.
+            wait = max(0.0, -bucket.tokens * bucket.interval, bucket.cooldown_until - now)
+        if wait and self.jitter:
+            wait *= random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+        return wait
+
+    def acquire(self, url_or_key, label=None):
+        """Blocking ``reserve``: sleeps until the domain allows the next request."""
+        wait = self.reserve(url_or_key)
+        if wait >= 1 and label is not False:
+            self.log(f"☕️ 限速等待 {wait:.1f} 秒（{domain_key(url_or_key)}，当前间隔 {self.interval(url_or_key):.1f}s）")
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, url_or_key):
+        import asyncio
+
+        wait = self.reserve(url_or_key)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def report(self, url_or_key, outcome):
+        """Feed back the result of a request: "ok", "empty", "login_wall", "captcha" or "rate_limited".
+
+        ``None`` (no signal, e.g. an unrelated error) leaves the bucket unchanged.
+        """
+        if not outcome:
+            return
+        key = domain_key(url_or_key)
+        with self._lock:
+            bucket = self._bucket(key)
+            before = bucket.interval
+            if outcome == "ok":
+                bucket.clean += 1
+                bucket.rate += bucket.step
+            elif outcome in HARD_SIGNALS:
+                bucket.clean = 0
+                bucket.penalties += 1
+                bucket.rate *= HARD_DECREASE
+                bucket.clamp()
+                bucket.cooldown_until = time.monotonic() + bucket.interval * COOLDOWN_INTERVALS
+                # Drop banked tokens so the pause actually applies.
+                bucket.tokens = min(bucket.tokens, 0.0)
+            elif outcome in SOFT_SIGNALS:
+                bucket.clean = 0
+                bucket.penalties += 1
+                bucket.rate *= SOFT_DECREASE
+            bucket.clamp()
+            after = bucket.interval
+            if outcome != "ok":
+                self._save_state()
+            elif after != before:
+                self._save_state(force=False)
+        if outcome != "ok":
+            self.log(f"🐢 {key} 触发风控信号 [{outcome}]，请求间隔 {before:.1f}s → {after:.1f}s")
+
+    def flush(self):
+        """Persist intervals still pending from throttled saves."""
+        with self._lock:
+            if self._dirty:
+                self._save_state()
+
+    def snapshot(self):
+        with self._lock:
+            return {k: {"interval": round(b.interval, 2), "clean": b.clean, "penalties": b.penalties}
+                    for k, b in self._buckets.items()}
+
+
+def get_limiter():
+    """Process-wide limiter persisted to ``workspace_data/rate_state.json``."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveRateLimiter(state_path=STATE_FILE)
+        return _limiter
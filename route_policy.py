@@ -0,0 +1,202 @@
+"""
+Request-blocking route profile for Playwright scraping sessions.
+
+Note pages pull in dozens of images, web fonts, tracker beacons and recommendation
+feeds that the scraper never looks at. ``RoutePolicy`` installs ``page.route``
+handlers scoped by URL regex, so the browser aborts those requests before they
+hit the network and Python only runs for URLs that actually match, instead of a
+``page.on("response")`` callback firing for every single response.
+
+The same policy carries the video sniffer: only ``sns-video`` / ``spectrum`` CDN
+URLs reach it. It records the first stream URL into the caller's ``sniffed``
+dict and (by default) aborts it, since step1 re-downloads the video itself.
+
+Configuration (environment / .env):
+
+    SCRAPE_BLOCK            1 (default) enables blocking, 0 only keeps the video sniffer
+    SCRAPE_BLOCK_RESOURCES  categories to abort, default "image,font,tracker,feed"
+    SCRAPE_BLOCK_EXTRA      extra comma-separated URL substrings to abort (e.g. domains)
+    SCRAPE_ABORT_VIDEO      1 (default) aborts the sniffed stream in the browser
+"""
+
+import re
+
+from utils import env_clean
+
+BLOCK_CATEGORIES = {
+    "image": (
+        r"//(sns-webpic[\w-]*|sns-img[\w-]*|sns-avatar[\w-]*|picasso-static)\.[\w.]+/"
+        r"|\.(png|jpe?g|gif|webp|avif|svg|ico)(\?|$)"
+    ),
+    "font": r"\.(woff2?|ttf|otf|eot)(\?|$)",
+    "tracker": (
+        r"//(t2|apm-fe|apm-track|lng)\.xiaohongshu\.com/"
+        r"|google-analytics\.com|googletagmanager\.com|hm\.baidu\.com"
+    ),
+    "feed": r"/api/sns/web/v1/(homefeed|note/related)",
+}
+DEFAULT_BLOCK_RESOURCES = "image,font,tracker,feed"
+VIDEO_STREAM_PATTERN = re.compile(r"sns-video|spectrum", re.IGNORECASE)
+
+# Rough average transfer size per aborted request, used for the savings estimate.
+ESTIMATED_BYTES = {
+    "image": 80 * 1024,
+    "font": 50 * 1024,
+    "tracker": 1024,
+    "feed": 30 * 1024,
+    "extra": 10 * 1024,
+    "video": 2 * 1024 * 1024,
+}
+
+
+def blocking_enabled():
+    return env_clean("SCRAPE_BLOCK", "1") != "0"
+
+
+def _category_patterns(resources=None, extra=None):
+    resources = resources if resources is not None else env_clean("SCRAPE_BLOCK_RESOURCES", DEFAULT_BLOCK_RESOURCES)
+    extra = extra if extra is not None else env_clean("SCRAPE_BLOCK_EXTRA", "")
+    patterns = {}
+    for name in (r.strip().lower() for r in (resources or "").split(",")):
+        if name in BLOCK_CATEGORIES:
+            patterns[name] = re.compile(BLOCK_CATEGORIES[name], re.IGNORECASE)
+    fragments = [re.escape(e.strip()) for e in (extra or "").split(",") if e.strip()]
+    if fragments:
+        patterns["extra"] = re.compile("|".join(fragments), re.IGNORECASE)
+    return patterns
+
+
+def is_video_stream_url(url, resource_type=None):
+    """True for the note's real mp4 stream on the XHS video CDN."""
+    if not url or not VIDEO_STREAM_PATTERN.search(url):
+        return False
+    return resource_type in (None, "media") or ".mp4" in url
+
+
+class RoutePolicy:
+    """Per-page route handlers: abort non-essential requests and sniff the video stream.
+
+    ``sniffed`` is the dict the extractor reads (``{"url": ...}``); profile mode
+    swaps it per note with ``track()``. ``stats`` counts aborted requests per
+    category.
+    """
+
+    def __init__(self, sniffed=None, block=None, resources=None, extra=None, abort_video=None, log=print):
+        self.sniffed = sniffed if sniffed is not None else {"url": None}
+        self.block = blocking_enabled() if block is None else block
+        self.patterns = _category_patterns(resources, extra) if self.block else {}
+        self.abort_video = (env_clean("SCRAPE_ABORT_VIDEO", "1") != "0") if abort_video is None else abort_video
+        self.stats = {}
+        self.log = log
+        combined = "|".join(f"(?:{p.pattern})" for p in self.patterns.values())
+        self.block_pattern = re.compile(combined, re.IGNORECASE) if combined else None
+
+    def track(self, sniffed):
+        """Point the sniffer at a fresh ``{"url": None}`` dict (one per note)."""
+        self.sniffed = sniffed
+        return sniffed
+
+    def classify(self, url):
+        for name, pattern in self.patterns.items():
+            if pattern.search(url):
+                return name
+        return None
+
+    def _count(self, category):
+        self.stats[category] = self.stats.get(category, 0) + 1
+
+    def _on_video(self, request):
+        """Returns True when the stream request should be aborted."""
+        if not is_video_stream_url(request.url, request.resource_type):
+            return False
+        if not self.sniffed.get("url"):
+            self.sniffed["url"] = request.url
+            self.log(f"🕵️ 嗅探到真实视频流: {request.url[:40]}...")
+        if self.abort_video:
+            self._count("video")
+            return True
+        return False
+
+    # --- sync API ---
+
+    def _handle_block(self, route, request):
+        category = self.classify(request.url)
+        if category and request.resource_type != "document":
+            self._count(category)
+            route.abort()
+        else:
+            route.continue_()
+
+    def _handle_video(self, route, request):
+        if self._on_video(request):
+            route.abort()
+        else:
+            # Not a stream (or not aborting): let the blocking route decide.
+            route.fallback()
+
+    def install(self, page):
+        # Routes registered later take precedence, so the video sniffer is added last.
+        if self.block_pattern is not None:
+            page.route(self.block_pattern, self._handle_block)
+        page.route(VIDEO_STREAM_PATTERN, self._handle_video)
+        return self
+
+    # --- async API ---
+
+    async def _handle_block_async(self, route, request):
+        category = self.classify(request.url)
+        if category and request.resource_type != "document":
+            self._count(category)
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _handle_video_async(self, route, request):
+        if self._on_video(request):
+            await route.abort()
+        else:
+            await route.fallback()
+
+    async def install_async(self, page):
+        if self.block_pattern is not None:
+            await page.route(self.block_pattern, self._handle_block_async)
+        await page.route(VIDEO_STREAM_PATTERN, self._handle_video_async)
+        return self
+
+    # --- reporting ---
+
+    def blocked_count(self):
+        return sum(self.stats.values())
+
+    def estimated_saved_bytes(self):
+        return sum(ESTIMATED_BYTES.get(name, 0) * count for name, count in self.stats.items())
+
+    def summary(self):
+        return {
+            "blocked": dict(self.stats),
+            "blocked_total": self.blocked_count(),
+            "estimated_saved_bytes": self.estimated_saved_bytes(),
+        }
+
+    def report(self, label=""):
+        return report_summary(self.summary(), label, self.log)
+
+
+def merge_summaries(summaries):
+    """Add up ``RoutePolicy.summary()`` dicts from several tabs."""
+    total = {"blocked": {}, "blocked_total": 0, "estimated_saved_bytes": 0}
+    for summary in summaries:
+        for name, count in summary.get("blocked", {}).items():
+            total["blocked"][name] = total["blocked"].get(name, 0) + count
+        total["blocked_total"] += summary.get("blocked_total", 0)
+        total["estimated_saved_bytes"] += summary.get("estimated_saved_bytes", 0)
+    return total
+
+
+def report_summary(summary, label="", log=print):
+    """Print blocked request counts and the estimated bytes saved."""
+    if summary.get("blocked_total"):
+        detail = " / ".join(f"{name} {count}" for name, count in sorted(summary["blocked"].items()))
+        saved_mb = summary["estimated_saved_bytes"] / (1024 * 1024)
+        log(f"🛡️ {label}已拦截 {summary['blocked_total']} 个请求（{detail}），估算节省流量 ~{saved_mb:.1f} MB")
+    return summary
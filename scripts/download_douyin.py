@@ -5,18 +5,45 @@
 
 使用方法:
     python download_douyin.py <抖音链接> <输出路径>
-    
+    python download_douyin.py --batch <链接文件> <输出目录> [--workers N]
+
 示例:
     python download_douyin.py "https://v.douyin.com/xxxxx" ./video.mp4
     python download_douyin.py "https://www.douyin.com/video/xxxxx" ./video.mp4
+    python download_douyin.py --batch urls.txt ./videos --workers 4
+
+页面以流式读取：读到 RENDER_DATA 所在 script 的结束标签就断开连接，不再把整页 HTML 留在内存里。
+批量模式下短链接并发解析，视频并发下载。
 """
 
-import requests
 import re
 import json
 import sys
 import os
-from urllib.parse import unquote, urlparse
+import time
+import asyncio
+import argparse
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from downloader import download_file
+from http_pool import get_session
+
+MOBILE_USER_AGENT = 'Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.3 Mobile/15E148 Safari/604.1'
+# 页面数据所在的 script：(起始标记, 是否 URL 编码)
+RENDER_DATA_MARKERS = [
+    ('<script id="RENDER_DATA" type="application/json">', True),
+    ('window._ROUTER_DATA', False),
+    ('window._SSR_DATA', False),
+    ('window._SSR_HYDRATED_DATA', False),
+]
+SCRIPT_END = '</script>'
+# 页面读取上限：找不到数据时不会无限读下去
+MAX_PAGE_BYTES = 8 * 1024 * 1024
+PAGE_CHUNK_SIZE = 64 * 1024
+VIDEO_CHUNK_SIZE = 1024 * 1024
+# 进度输出节流：最多每隔这么多秒打印一次
+PROGRESS_INTERVAL = 1.0
 
 
 def is_douyin_url(url: str) -> bool:
@@ -39,60 +66,157 @@ def extract_video_id(url: str) -> str:
         r'modal_id=(\d+)',
         r'share/video/(\d+)',
     ]
-    
+
     for pattern in patterns:
         match = re.search(pattern, url)
         if match:
             return match.group(1)
-    
+
     # 如果是短链接，返回None，需要获取重定向后的URL
     return None
 
 
-def get_redirect_url(short_url: str) -> tuple:
-    """获取重定向后的完整URL"""
+class RenderDataScanner:
+    """增量扫描页面文本：找到数据 script 的起始标记后，读到 </script> 即返回其内容。
+
+    feed() 每次接收一段文本，只在新数据（加上跨块边界的少量尾巴）上查找标记。
+    """
+
+    def __init__(self, markers=RENDER_DATA_MARKERS):
+        self.markers = markers
+        self.buffer = ''
+        self.scanned = 0
+        self.in_script = False
+        self.encoded = False
+        self.overlap = max(len(m) for m, _ in markers) + len(SCRIPT_END)
+
+    def feed(self, text):
+        """返回 (原始数据字符串, 是否 URL 编码)；还没读完时返回 None。"""
+        self.buffer += text
+        if not self.in_script:
+            hits = []
+            for marker, encoded in self.markers:
+                index = self.buffer.find(marker, self.scanned)
+                if index >= 0:
+                    hits.append((index, marker, encoded))
+            if not hits:
+                # 只保留可能跨块的尾巴，已扫过的页面内容直接丢弃
+                self.buffer = self.buffer[-self.overlap:]
+                self.scanned = 0
+                return None
+            index, marker, self.encoded = min(hits)
+            self.buffer = self.buffer[index + len(marker):]
+            self.in_script = True
+            self.scanned = 0
+        end = self.buffer.find(SCRIPT_END, self.scanned)
+        if end < 0:
+            self.scanned = max(0, len(self.buffer) - len(SCRIPT_END))
+            return None
+        return self.buffer[:end], self.encoded
+
+
+def parse_render_data(raw, encoded=False):
+    """把 script 内容解析为 JSON：RENDER_DATA 需 URL 解码，window.X = {...}; 需去掉赋值外壳。"""
+    text = raw.strip()
+    if encoded or text.startswith('%7B'):
+        text = unquote(text)
+    if not text.startswith('{'):
+        text = text.lstrip('= \t\r\n')
+    text = text.rstrip('; \t\r\n')
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def extract_render_data(html: str) -> dict:
+    """从HTML中提取RENDER_DATA"""
+    found = RenderDataScanner().feed(html)
+    return parse_render_data(*found) if found else None
+
+
+def fetch_render_data(short_url: str):
+    """流式请求页面（跟随重定向），读到数据 script 结束即断开。
+
+    返回 (最终URL, User-Agent, RENDER_DATA)；失败时返回 (None, None, None)。
+    """
     headers = {
-        'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 13_2_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.3 Mobile/15E148 Safari/604.1',
+        'User-Agent': MOBILE_USER_AGENT,
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
         'Accept-Language': 'zh-CN,zh;q=0.9',
     }
 
     try:
-        response = requests.get(short_url, headers=headers, allow_redirects=True, timeout=10)
-        return response.url, headers['User-Agent'], response.text
+        response = get_session().get(short_url, headers=headers, allow_redirects=True, timeout=10, stream=True)
     except Exception as e:
         print(f"✗ 获取重定向URL失败: {e}")
         return None, None, None
 
+    scanner = RenderDataScanner()
+    found = None
+    read = 0
+    try:
+        response.encoding = response.encoding or 'utf-8'
+        for text in response.iter_content(chunk_size=PAGE_CHUNK_SIZE, decode_unicode=True):
+            if not text:
+                continue
+            read += len(text)
+            found = scanner.feed(text)
+            if found or read > MAX_PAGE_BYTES:
+                break
+    except Exception as e:
+        print(f"✗ 读取页面失败: {e}")
+    finally:
+        response.close()
+
+    if not found:
+        return response.url, headers['User-Agent'], None
+    return response.url, headers['User-Agent'], parse_render_data(*found)
+
+
+def _first_url(value):
+    """url_list / playAddr 的首个地址（字符串列表或 [{"src": ...}]）。"""
+    if isinstance(value, dict):
+        value = value.get('url_list')
+    if not isinstance(value, list):
+        return None
+    for item in value:
+        url = item.get('src') if isinstance(item, dict) else item
+        if isinstance(url, str) and url:
+            return 'https:' + url if url.startswith('//') else url
+    return None
 
-def extract_render_data(html: str) -> dict:
-    """从HTML中提取RENDER_DATA"""
-    # 尝试多种可能的模式
-    patterns = [
-        r'<script id="RENDER_DATA" type="application/json">([^<]+)</script>',
-        r'window\._ROUTER_DATA\s*=\s*(\{.+?\});?\s*</script>',
-        r'window\._SSR_DATA\s*=\s*(\{.+?\});?\s*</script>',
-        r'window\._SSR_HYDRATED_DATA\s*=\s*(\{.+?\});?\s*</script>',
-    ]
 
-    for pattern in patterns:
-        matches = re.findall(pattern, html, re.DOTALL)
-        if matches:
-            data_str = matches[0]
-            # URL解码
-            if '%' in data_str:
-                data_str = unquote(data_str)
-            try:
-                return json.loads(data_str)
-            except json.JSONDecodeError:
-                continue
-    
+# 遍历 JSON 树时按优先级查找的键：无水印播放地址优先，下载地址兜底
+VIDEO_URL_KEYS = ('play_addr', 'playAddr', 'download_addr')
+
+
+def find_video_url(data):
+    """直接遍历 JSON 树找播放地址，找到 play_addr 即返回。"""
+    found = {}
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key in VIDEO_URL_KEYS:
+                if key in node and key not in found:
+                    url = _first_url(node[key])
+                    if url:
+                        found[key] = url
+                        if key == VIDEO_URL_KEYS[0]:
+                            return url
+            stack.extend(v for v in reversed(list(node.values())) if isinstance(v, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(v for v in reversed(node) if isinstance(v, (dict, list)))
+    for key in VIDEO_URL_KEYS:
+        if key in found:
+            return found[key]
     return None
 
 
 def extract_video_url(data: dict) -> str:
     """从RENDER_DATA中提取视频URL"""
-    
+
     def get_nested(obj, path):
         """安全地获取嵌套字典/列表值"""
         current = obj
@@ -116,33 +240,45 @@ def extract_video_url(data: dict) -> str:
         ['aweme_detail', 'video', 'play_addr', 'url_list'],
     ]
 
+    video_url = None
     for path in possible_paths:
-        url_list = get_nested(data, path)
-        if url_list and isinstance(url_list, list) and len(url_list) > 0:
-            video_url = url_list[0]
-            # 替换playwm为play获取无水印版本
-            video_url = video_url.replace('playwm', 'play')
-            return video_url
-
-    # 如果路径查找失败，尝试正则搜索
-    json_str = json.dumps(data)
-    play_patterns = [
-        r'"play_addr":\s*\{[^}]*"url_list":\s*\["([^"]+)"',
-        r'"playAddr":\s*\["([^"]+)"',
-        r'"download_addr":\s*\{[^}]*"url_list":\s*\["([^"]+)"',
-    ]
+        video_url = _first_url(get_nested(data, path))
+        if video_url:
+            break
 
-    for pattern in play_patterns:
-        matches = re.findall(pattern, json_str)
-        if matches:
-            video_url = matches[0].replace('playwm', 'play')
-            return video_url
+    # 如果路径查找失败，遍历整棵树查找
+    if not video_url:
+        video_url = find_video_url(data)
 
-    return None
+    # 替换playwm为play获取无水印版本
+    return video_url.replace('playwm', 'play') if video_url else None
+
+
+def throttled_progress(label='', interval=PROGRESS_INTERVAL):
+    """下载进度回调：按时间节流，下载完成时再打印一次。"""
+    state = {'last': 0.0}
+    inline = not label
 
+    def _progress(downloaded, total_size):
+        if not total_size:
+            return
+        now = time.monotonic()
+        done = downloaded >= total_size
+        if not done and now - state['last'] < interval:
+            return
+        state['last'] = now
+        percent = (downloaded / total_size) * 100
+        text = f"进度: {percent:.1f}% ({downloaded:,}/{total_size:,} bytes)"
+        if inline:
+            print(f"\r{text}", end='', flush=True)
+        else:
+            print(f"   {label} {text}", flush=True)
 
-def download_video(video_url: str, output_path: str, user_agent: str) -> bool:
-    """下载视频"""
+    return _progress
+
+
+def download_video(video_url: str, output_path: str, user_agent: str, label: str = '') -> bool:
+    """下载视频（.part 断点续传，完成后原子改名）"""
     headers = {
         'User-Agent': user_agent,
         'Referer': 'https://www.douyin.com/',
@@ -151,40 +287,35 @@ def download_video(video_url: str, output_path: str, user_agent: str) -> bool:
     }
 
     try:
-        response = requests.get(video_url, headers=headers, stream=True, timeout=60)
-
-        if response.status_code not in [200, 206]:
-            print(f"✗ 下载失败，状态码: {response.status_code}")
+        saved = download_file(
+            video_url,
+            output_path,
+            headers=headers,
+            timeout=60,
+            chunk_size=VIDEO_CHUNK_SIZE,
+            progress=throttled_progress(label),
+            segments=4,
+        )
+        if not label:
+            print()  # 换行
+        if not saved:
+            print(f"✗ {label}下载失败")
             return False
-
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
-
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        print(f"\r进度: {percent:.1f}% ({downloaded:,}/{total_size:,} bytes)", end='', flush=True)
-
-        print()  # 换行
         return True
 
     except Exception as e:
-        print(f"✗ 下载视频时出错: {e}")
+        print(f"✗ {label}下载视频时出错: {e}")
         return False
 
 
 def download_douyin_video(url: str, output_path: str) -> bool:
     """
     下载抖音视频的主函数
-    
+
     Args:
         url: 抖音视频链接（支持短链接和长链接）
         output_path: 输出文件路径
-        
+
     Returns:
         bool: 下载是否成功
     """
@@ -193,23 +324,18 @@ def download_douyin_video(url: str, output_path: str) -> bool:
     print(f"   输出: {output_path}")
     print()
 
-    # 步骤1: 获取重定向URL和页面内容
-    print("步骤 1/4: 获取页面信息...")
-    full_url, user_agent, html = get_redirect_url(url)
+    # 步骤1-2: 获取页面并提取RENDER_DATA（流式读取，读到数据即停止）
+    print("步骤 1/3: 获取页面并提取视频数据...")
+    full_url, user_agent, render_data = fetch_render_data(url)
     if not full_url:
         return False
-    print(f"✓ 获取到页面 ({len(html):,} 字符)")
-
-    # 步骤2: 提取RENDER_DATA
-    print("\n步骤 2/4: 提取视频数据...")
-    render_data = extract_render_data(html)
     if not render_data:
         print("✗ 无法提取视频数据")
         return False
     print("✓ 提取到视频数据")
 
     # 步骤3: 提取视频URL
-    print("\n步骤 3/4: 解析视频地址...")
+    print("\n步骤 2/3: 解析视频地址...")
     video_url = extract_video_url(render_data)
     if not video_url:
         print("✗ 无法获取视频下载地址")
@@ -217,9 +343,9 @@ def download_douyin_video(url: str, output_path: str) -> bool:
     print(f"✓ 获取到视频地址")
 
     # 步骤4: 下载视频
-    print("\n步骤 4/4: 下载视频...")
+    print("\n步骤 3/3: 下载视频...")
     success = download_video(video_url, output_path, user_agent)
-    
+
     if success:
         file_size = os.path.getsize(output_path)
         print(f"✓ 下载完成: {file_size:,} bytes")
@@ -228,21 +354,74 @@ def download_douyin_video(url: str, output_path: str) -> bool:
         return False
 
 
+async def download_douyin_batch(urls, output_dir, workers=4):
+    """批量下载：并发解析页面（每条只读到数据为止），再以最多 workers 个并发下载视频。
+
+    返回与 urls 对齐的结果列表：成功为输出路径，失败为 None。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(max(1, workers))
+    total = len(urls)
+
+    async def _one(index, url):
+        label = f"[{index + 1}/{total}]"
+        async with semaphore:
+            full_url, user_agent, render_data = await asyncio.to_thread(fetch_render_data, url)
+            video_url = extract_video_url(render_data) if render_data else None
+            if not video_url:
+                print(f"✗ {label} 无法解析视频地址: {url}")
+                return None
+            video_id = extract_video_id(full_url or url) or extract_video_id(url) or f"{index + 1:03d}"
+            output_path = os.path.join(output_dir, f"douyin_{video_id}.mp4")
+            print(f"📥 {label} {video_id} 开始下载")
+            ok = await asyncio.to_thread(download_video, video_url, output_path, user_agent, label)
+        if ok:
+            print(f"✓ {label} 下载完成: {output_path} ({os.path.getsize(output_path):,} bytes)")
+            return output_path
+        return None
+
+    return await asyncio.gather(*[_one(i, u) for i, u in enumerate(urls)])
+
+
+def read_url_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
 def main():
-    if len(sys.argv) < 3:
+    parser = argparse.ArgumentParser(description="抖音视频下载（无水印），支持批量")
+    parser.add_argument("url", nargs="?", help="抖音链接（单条模式）")
+    parser.add_argument("output", nargs="?", help="输出路径（单条模式）/ 输出目录（批量模式）")
+    parser.add_argument("--batch", metavar="FILE", help="链接文件，每行一个链接（# 开头为注释）")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("DOUYIN_WORKERS", "4")),
+                        help="批量模式并发数（默认: 4）")
+    args = parser.parse_args()
+
+    if args.batch:
+        output_dir = args.output or args.url or "."
+        urls = read_url_file(args.batch)
+        invalid = [u for u in urls if not is_douyin_url(u)]
+        for u in invalid:
+            print(f"✗ 不是有效的抖音链接，跳过: {u}")
+        urls = [u for u in urls if is_douyin_url(u)]
+        print(f"🎬 批量下载抖音视频: {len(urls)} 条，并发 {args.workers}，输出目录 {output_dir}")
+        results = asyncio.run(download_douyin_batch(urls, output_dir, workers=args.workers))
+        ok = sum(1 for r in results if r)
+        print(f"\n🎉 批量下载结束：成功 {ok}/{len(urls)}")
+        sys.exit(0 if ok == len(urls) and not invalid else 1)
+
+    if not args.url or not args.output:
         print("用法: python download_douyin.py <抖音链接> <输出路径>")
+        print("      python download_douyin.py --batch <链接文件> <输出目录> [--workers N]")
         print("示例: python download_douyin.py 'https://v.douyin.com/xxxxx' ./video.mp4")
         sys.exit(1)
 
-    url = sys.argv[1]
-    output_path = sys.argv[2]
-
     # 检查是否为抖音链接
-    if not is_douyin_url(url):
-        print(f"✗ 不是有效的抖音链接: {url}")
+    if not is_douyin_url(args.url):
+        print(f"✗ 不是有效的抖音链接: {args.url}")
         sys.exit(1)
 
-    success = download_douyin_video(url, output_path)
+    success = download_douyin_video(args.url, args.output)
     sys.exit(0 if success else 1)
 
 
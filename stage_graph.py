@@ -0,0 +1,78 @@
+"""
+Tiny dependency-graph executor for the per-video analysis stages.
+
+Stages are plain callables registered with the names of the stages they
+depend on; each receives its dependencies' results as keyword arguments.
+A stage is started on a thread pool as soon as all of its dependencies
+have finished, so independent work (cover fetch, frame extraction, ASR)
+overlaps and a downstream stage (the LLM call) starts the moment its own
+inputs are ready rather than after every earlier stage.
+
+A stage that raises is recorded in ``errors``; stages depending on it are
+skipped (listed in ``skipped``) while unrelated branches keep running.
+
+    graph = StageGraph(max_workers=3)
+    graph.add("cover", fetch_cover)
+    graph.add("transcript", extract)
+    graph.add("analysis", analyze, deps=("cover", "transcript"))
+    results = graph.run()
+
+``max_workers=1`` runs the stages one at a time in registration order.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class StageGraph:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._stages = {}
+        self.results = {}
+        self.errors = {}
+        self.skipped = []
+        self.seconds = {}
+
+    def add(self, name, fn, deps=()):
+        if name in self._stages:
+            raise ValueError(f"duplicate stage: {name}")
+        missing = [d for d in deps if d not in self._stages]
+        if missing:
+            # Registering in dependency order also rules out cycles.
+            raise ValueError(f"stage {name} depends on unknown stages: {missing}")
+        self._stages[name] = (fn, tuple(deps))
+        return self
+
+    def _call(self, name):
+        fn, deps = self._stages[name]
+        started = time.time()
+        try:
+            return fn(**{d: self.results[d] for d in deps})
+        finally:
+            self.seconds[name] = round(time.time() - started, 2)
+
+    def run(self):
+        """Run every stage; returns ``results`` (name -> return value of finished stages)."""
+        pending = list(self._stages)
+        workers = self.max_workers or len(pending) or 1
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage") as pool:
+            running = {}
+            while pending or running:
+                for name in list(pending):
+                    deps = self._stages[name][1]
+                    if any(d in self.errors or d in self.skipped for d in deps):
+                        pending.remove(name)
+                        self.skipped.append(name)
+                    elif all(d in self.results for d in deps) and len(running) < workers:
+                        pending.remove(name)
+                        running[pool.submit(self._call, name)] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        self.errors[name] = e
+        return self.results
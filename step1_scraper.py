@@ -3,16 +3,28 @@ import sys
 import json
 import time
 import re
-import random
 import argparse
-import subprocess
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from urllib.parse import urljoin
+import asyncio
+import threading
+import contextlib
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, quote
 from datetime import datetime
 from playwright.sync_api import sync_playwright
-
+from playwright.async_api import async_playwright
+
+import account_pool
+import browser_daemon
+import crawl_state
+import login_watcher
+import media_cache
+import note_fetcher
+import rate_limiter
+import route_policy
+import ytdlp_engine
+from downloader import download_file
+from http_pool import get_session
 from utils import validate_url
 
 # 确保工作目录存在
@@ -36,22 +48,160 @@ LOGIN_HINT_WORDS = [
 ]
 
 PROFILE_URL_HINTS = ["/user/profile/", "www.xiaohongshu.com/user/"]
+# 达人主页笔记发现方式：feed = 监听 user_posted 接口分页（默认），scroll = 滚动读取卡片链接
+PROFILE_DISCOVERY = os.getenv("PROFILE_DISCOVERY", "feed").strip().lower()
+FEED_API_PATH = "/api/sns/web/v1/user_posted"
+FEED_API_URL = "https://edith.xiaohongshu.com" + FEED_API_PATH
+# user_posted 报错码对应的限速信号（-100 登录失效，300012/300013 访问频次异常，461 风控拦截）；其余报错按 empty 处理
+FEED_ERROR_OUTCOMES = {-100: "login_wall", 300012: "rate_limited", 300013: "rate_limited", 461: "rate_limited"}
+# 连续多少秒没有新的接口分页即认为到底
+FEED_IDLE_SECONDS = float(os.getenv("FEED_IDLE_SECONDS", "6"))
+FEED_SCROLL_JS = "() => window.scrollTo(0, document.body.scrollHeight)"
+# 触发限速退避的响应码（461 为小红书风控拦截）
+RATE_LIMITED_STATUSES = (429, 461)
 LOGIN_COOKIE_PREFIXES = ("web_session",)
 DEFAULT_LOGIN_WAIT_SECONDS = int(os.getenv("LOGIN_WAIT_SECONDS", "300"))
 STRICT_LOGIN_REQUIRED = os.getenv("STRICT_LOGIN_REQUIRED", "1") != "0"
+# 无界面模式（SCRAPE_HEADLESS=1）下登录失效不等待扫码，改为告警；可选 webhook 接收 {"text", "account", "url"}
+LOGIN_ALERT_WEBHOOK = os.getenv("LOGIN_ALERT_WEBHOOK", "").strip()
 LOGIN_SUCCESS_SELECTORS = [
     '[href*="/user/profile"]',
     '.user-side-bar',
     '.author-wrapper',
 ]
+# 登录检测信号：由 login_watcher 在页面内一次性求值，并用 DOM 变更驱动等待
+LOGIN_SIGNALS = {
+    "login": LOGIN_PAGE_SELECTORS,
+    "success": LOGIN_SUCCESS_SELECTORS,
+    "content": ["video", "#detail-desc"],
+    "hints": LOGIN_HINT_WORDS,
+    "cookies": list(LOGIN_COOKIE_PREFIXES),
+}
+# 达人主页并发抓取的标签页数量（1 = 原有串行点击模式）
+DEFAULT_PROFILE_CONCURRENCY = int(os.getenv("PROFILE_CONCURRENCY", "1"))
+
+# 后台下载队列：并发下载线程数，以及允许“已抓取未下载完”的最大积压条数
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "2"))
+# 数据刷新模式：只取互动数、不下载视频，可以开更多标签页
+STATS_REFRESH_CONCURRENCY = int(os.getenv("STATS_REFRESH_CONCURRENCY", "8"))
+STATS_READY_TIMEOUT = float(os.getenv("STATS_READY_TIMEOUT", "8"))
+STATS_FEED_MAX_ITEMS = int(os.getenv("STATS_FEED_MAX_ITEMS", "300"))
+DOWNLOAD_MAX_PENDING = int(os.getenv("DOWNLOAD_MAX_PENDING", "4"))
+# 大文件（CDN 支持 Range 时）分段并行下载的连接数，1 = 单连接
+DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
+
+BROWSER_VIEWPORT = {'width': 1280, 'height': 800}
+BROWSER_ARGS = ['--no-sandbox', '--disable-blink-features=AutomationControlled']
+WEBDRIVER_INIT_SCRIPT = "Object.defineProperty(navigator, 'webdriver', { get: () => undefined })"
+# 笔记页就绪等待：事件驱动，最长 NOTE_READY_TIMEOUT 秒；LEGACY 为旧版固定等待时长（用于统计节省时间）
+NOTE_READY_TIMEOUT = float(os.getenv("NOTE_READY_TIMEOUT", "10"))
+LEGACY_NOTE_WAIT_SECONDS = 4.0
+NOTE_DOM_READY_JS = """
+() => {
+    if (document.querySelectorAll('.interact-container .count').length >= 3
+        && !!document.querySelector('#detail-desc')) return true;
+    // 布局里没有 .count 节点时，SSR 初始状态里的互动数据同样可用
+    try {
+        const map = window.__INITIAL_STATE__.note.noteDetailMap || {};
+        return Object.values(map).some((v) => v && v.note && v.note.interactInfo);
+    } catch (e) {
+        return false;
+    }
+}
+"""
+NOTE_VIDEO_HINT_JS = """
+() => {
+    const video = document.querySelector('video');
+    if (video && video.src && !video.src.startsWith('blob:')) return true;
+    const state = window.__INITIAL_STATE__;
+    try {
+        return !!state && JSON.stringify(state.note || {}).includes('masterUrl');
+    } catch (e) {
+        return false;
+    }
+}
+"""
+NOTE_SIGNALS_JS = """
+() => ({ dom: !!(%s)(), video: !!(%s)() })
+""" % (NOTE_DOM_READY_JS.strip(), NOTE_VIDEO_HINT_JS.strip())
+# DOM 与视频信号同时满足才返回；参数为 Python 侧是否已嗅探到视频地址
+NOTE_READY_JS = """
+(sniffed) => {
+    const s = (%s)();
+    return s.dom && (sniffed || s.video) ? s : false;
+}
+""" % NOTE_SIGNALS_JS.strip()
+# 同步版分片等待的单片时长：嗅探回调写入的视频地址最迟在一片后生效
+NOTE_READY_SLICE = 0.5
+# 单次 IPC 抽取笔记全部字段：优先 SSR 初始状态 (__INITIAL_STATE__)，DOM 兜底
+NOTE_EXTRACT_JS = """
+(noteId) => {
+    const pick = (note) => note && JSON.parse(JSON.stringify({
+        noteId: note.noteId, title: note.title, desc: note.desc, type: note.type, time: note.time,
+        user: note.user ? { nickname: note.user.nickname, userId: note.user.userId } : null,
+        interactInfo: note.interactInfo || null,
+        imageList: (note.imageList || []).slice(0, 1),
+        video: note.video ? { media: note.video.media } : null,
+    }));
+    let stateNote = null;
+    try {
+        const map = (window.__INITIAL_STATE__ && window.__INITIAL_STATE__.note
+            && window.__INITIAL_STATE__.note.noteDetailMap) || {};
+        const entry = map[noteId] || Object.values(map).find(v => v && v.note && v.note.noteId);
+        stateNote = pick(entry && entry.note);
+    } catch (e) {
+        stateNote = null;
+    }
 
-def get_robust_session():
-    session = requests.Session()
-    retry = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+    const text = (sel) => {
+        const el = document.querySelector(sel);
+        return el ? el.innerText : "";
+    };
+    const og = document.querySelector('meta[property="og:image"]');
+    const video = document.querySelector('video');
+    const counts = Array.from(document.querySelectorAll('.interact-container .count'), el => el.innerText);
+    const dom = {
+        title: document.title,
+        counts: counts,
+        desc: text('#detail-desc'),
+        author: text('.username'),
+        comments: Array.from(document.querySelectorAll('.comment-item .content'), el => el.innerText).slice(0, 5),
+        cover_url: og ? og.getAttribute('content') : "",
+        video_src: video ? (video.getAttribute('src') || "") : "",
+        stats_text: counts.length >= 3 ? "" : text('.interact-container') || text('.engage-bar'),
+        script_video: "",
+    };
+    if (!stateNote || !stateNote.video) {
+        // 只回传命中的片段，避免把整段脚本序列化回 Python
+        for (const script of document.scripts) {
+            const body = script.textContent || "";
+            const hit = body.match(/"masterUrl":"http[^"]+"/) || body.match(/https?:\\/\\/[^"\\\\]+?\\.mp4[^"\\\\]*/);
+            if (hit) {
+                dom.script_video = hit[0];
+                break;
+            }
+        }
+    }
+    return { state_note: stateNote, dom: dom };
+}
+"""
+NOTE_LINKS_JS = """
+() => Array.from(document.querySelectorAll('a[href*="/explore/"]'), a => a.getAttribute('href'))
+"""
+
+_timestamp_lock = threading.Lock()
+_last_timestamp = 0
+
+
+def _new_timestamp():
+    """生成毫秒时间戳；并发标签页同一毫秒落盘时自动顺延，避免文件名冲突。"""
+    global _last_timestamp
+    with _timestamp_lock:
+        ts = int(datetime.now().timestamp() * 1000)
+        if ts <= _last_timestamp:
+            ts = _last_timestamp + 1
+        _last_timestamp = ts
+        return ts
 
 def download_video(url, filename):
     if not url or url.startswith("blob:"):
@@ -63,68 +213,41 @@ def download_video(url, filename):
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
             "Referer": "https://www.xiaohongshu.com/"
         }
-        print(f"📥 正在请求视频流 (含重试机制): {url[:50]}...")
-        
-        session = get_robust_session()
-        response = session.get(url, headers=headers, stream=True, timeout=120)
-        
-        if response.status_code == 200:
-            save_path = os.path.join(WORK_DIR, filename)
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024*1024):
-                    if chunk: f.write(chunk)
-            
-            if os.path.getsize(save_path) < 1024:
-                print("⚠️ 下载文件过小，可能已损坏")
-                return None
-                
+        print(f"📥 正在请求视频流 (含断点续传): {url[:50]}...")
+
+        save_path = download_file(
+            url,
+            os.path.join(WORK_DIR, filename),
+            headers=headers,
+            session=get_session(),
+            timeout=120,
+            min_size=1024,
+            segments=DOWNLOAD_SEGMENTS,
+        )
+        if save_path:
             print(f"✅ 视频下载完成: {save_path}")
             return save_path
-        else:
-            print(f"⚠️ 下载失败，状态码: {response.status_code}")
     except Exception as e:
         print(f"⚠️ 下载流出错: {e}")
     return None
 
 
 def download_video_with_ytdlp(note_url, timestamp):
-    """兜底下载：直接使用 yt-dlp 下载笔记视频。"""
+    """兜底下载：进程内常驻 yt-dlp 实例，同一时间段内的多条兜底请求合并为一批下载。"""
     if not validate_url(note_url):
         print(f"❌ URL 校验失败（仅允许 http/https）: {note_url}")
         return None
-    template = os.path.join(WORK_DIR, f"video_{timestamp}.%(ext)s")
-    cmd = [
-        "yt-dlp",
-        "-f",
-        "bv*[height<=1080]+ba/b[height<=1080]/b",
-        "--merge-output-format",
-        "mp4",
-        "-o",
-        template,
-        note_url,
-    ]
     try:
         print(f"🛟 [Fallback] 使用 yt-dlp 兜底下载: {note_url[:80]}...")
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        if proc.returncode != 0:
-            msg = (proc.stderr or proc.stdout or "").strip()
-            print(f"⚠️ yt-dlp 兜底下载失败: {msg[:300]}")
-            return None
-        # 优先 mp4，其次匹配同前缀文件
-        mp4_path = os.path.join(WORK_DIR, f"video_{timestamp}.mp4")
-        if os.path.exists(mp4_path):
-            return mp4_path
-        prefix = os.path.join(WORK_DIR, f"video_{timestamp}.")
-        candidates = [
-            os.path.join(WORK_DIR, f)
-            for f in os.listdir(WORK_DIR)
-            if f.startswith(f"video_{timestamp}.")
-        ]
-        return candidates[0] if candidates else None
+        return ytdlp_engine.get_engine(WORK_DIR).download(note_url, timestamp)
     except Exception as e:
-        print(f"⚠️ yt-dlp 兜底下载异常: {e}")
+        print(f"⚠️ yt-dlp 兜底下载失败: {str(e)[:300]}")
         return None
 
+def _cookies_have_login(cookies):
+    return login_watcher.cookies_have_login(cookies, LOGIN_COOKIE_PREFIXES)
+
+
 def _has_login_cookie(context):
     if not context:
         return False
@@ -135,8 +258,7 @@ def _has_login_cookie(context):
             cookies = context.cookies()
         except Exception:
             cookies = []
-    names = {str(c.get("name", "")).lower() for c in cookies if isinstance(c, dict)}
-    return any(any(name.startswith(prefix) for prefix in LOGIN_COOKIE_PREFIXES) for name in names)
+    return _cookies_have_login(cookies)
 
 
 def _has_note_content(page):
@@ -163,21 +285,38 @@ def _has_login_success_marker(page):
     return False
 
 
-def page_requires_login(page, context=None):
-    """判断页面是否处于登录态缺失场景。"""
+_login_alerted = set()
+_login_alert_lock = threading.Lock()
+
+
+def _alert_login_expired(page_url=""):
+    """无界面模式下登录态失效：提醒运维重新登录（同一账号每个进程只提醒一次）。"""
+    lease = account_pool.current_lease()
+    name = lease.name if lease is not None else account_pool.DEFAULT_PROFILE
+    with _login_alert_lock:
+        if name in _login_alerted:
+            return
+        _login_alerted.add(name)
+    command = "python login_tool.py --headless"
+    if name != account_pool.DEFAULT_PROFILE:
+        command += f" --profile {name}"
+    message = f"小红书登录态已失效（账号 {name}），无界面模式无法扫码，请运行: {command}"
+    print(f"🚨 {message}")
+    if not LOGIN_ALERT_WEBHOOK:
+        return
     try:
-        if page.is_closed():
-            return False
-    except Exception:
-        return False
+        get_session("alert", retries=1).post(
+            LOGIN_ALERT_WEBHOOK, json={"text": message, "account": name, "url": page_url}, timeout=10
+        )
+    except Exception as e:
+        print(f"⚠️ 登录失效告警发送失败: {e}")
 
-    signal_score = 0
-    try:
-        url = (page.url or "").lower()
-        if "/login" in url:
-            signal_score += 2
-    except Exception:
-        pass
+
+def _login_state(page):
+    """一次 evaluate 在页面内取齐登录信号；页面不支持 evaluate 时退回逐项查询。"""
+    state = login_watcher.probe(page, LOGIN_SIGNALS)
+    if state is not None:
+        return state
 
     has_login_selector = False
     for selector in LOGIN_PAGE_SELECTORS:
@@ -195,16 +334,40 @@ def page_requires_login(page, context=None):
             has_login_hint = True
     except Exception:
         pass
+    return {
+        "login": has_login_selector,
+        "hint": has_login_hint,
+        "success": _has_login_success_marker(page),
+        "content": _has_note_content(page),
+    }
+
 
-    if has_login_selector:
+def page_requires_login(page, context=None):
+    """判断页面是否处于登录态缺失场景。"""
+    try:
+        if page.is_closed():
+            return False
+    except Exception:
+        return False
+
+    signal_score = 0
+    try:
+        url = (page.url or "").lower()
+        if "/login" in url:
+            signal_score += 2
+    except Exception:
+        pass
+
+    state = _login_state(page)
+    if state["login"]:
         signal_score += 1
-    if has_login_hint:
+    if state["hint"]:
         signal_score += 1
-    if signal_score >= 2 and not _has_login_success_marker(page):
+    if signal_score >= 2 and not state["success"]:
         return True
 
     # 既没有明确登录页信号，又有登录成功/内容信号时，不视为需要登录
-    if _has_login_success_marker(page) or _has_note_content(page):
+    if state["success"] or state["content"]:
         return False
 
     # 无明显信号时交给严格模式策略（在 wait_for_login_if_needed 里处理）
@@ -226,6 +389,14 @@ def wait_for_login_if_needed(page, context=None, timeout_seconds=None, poll_seco
     has_cookie = _has_login_cookie(context)
     requires_login = page_requires_login(page, context=context)
 
+    if browser_daemon.headless_requested():
+        # 无界面时没人能扫码：先看登录态，确实需要登录才告警并返回，由调用方上报 login_wall；
+        # force_wait 在这里只表示“没有登录 cookie 就不放行”，已登录的会话照常继续
+        if requires_login or (not has_cookie and (force_wait or STRICT_LOGIN_REQUIRED)):
+            _alert_login_expired(page.url)
+            return False
+        return True
+
     # 默认严格模式：没有登录态就先等待，避免页面刚开就关闭，用户来不及扫码。
     if force_wait:
         print(
@@ -240,43 +411,46 @@ def wait_for_login_if_needed(page, context=None, timeout_seconds=None, poll_seco
     else:
         print("🔐 检测到需要登录，请在浏览器中扫码完成登录，脚本将自动继续...")
 
-    deadline = time.time() + timeout_seconds
-    while time.time() < deadline:
-        try:
-            if page.is_closed():
-                print("⚠️ 页面已关闭，结束登录等待。")
+    # 等待由 DOM 变更 / 导航 / 登录接口响应唤醒，而不是每 2 秒序列化整页 HTML
+    with login_watcher.LoginWatcher(context, page, LOGIN_SIGNALS) as watcher:
+        deadline = time.time() + timeout_seconds
+        while time.time() < deadline:
+            try:
+                if page.is_closed():
+                    print("⚠️ 页面已关闭，结束登录等待。")
+                    return False
+            except Exception:
                 return False
-        except Exception:
-            return False
 
-        has_cookie = _has_login_cookie(context)
-        requires_login = page_requires_login(page, context=context)
+            has_cookie = watcher.has_login_cookie()
+            requires_login = page_requires_login(page, context=context)
 
-        # 严格模式下，优先等到可用登录态；非严格模式按页面状态放行。
-        if has_cookie and (not requires_login or _has_note_content(page) or _has_login_success_marker(page)):
-            print("✅ 检测到登录完成，继续执行抓取。")
-            try:
-                page.wait_for_load_state("domcontentloaded", timeout=5000)
-            except Exception:
-                pass
-            return True
+            # 严格模式下，优先等到可用登录态；非严格模式按页面状态放行。
+            if has_cookie and (not requires_login or _has_note_content(page) or _has_login_success_marker(page)):
+                print("✅ 检测到登录完成，继续执行抓取。")
+                try:
+                    page.wait_for_load_state("domcontentloaded", timeout=5000)
+                except Exception:
+                    pass
+                return True
 
-        if not force_wait and not STRICT_LOGIN_REQUIRED and not requires_login:
-            return True
+            if not force_wait and not STRICT_LOGIN_REQUIRED and not requires_login:
+                return True
 
-        try:
-            page.wait_for_timeout(int(poll_seconds * 1000))
-        except KeyboardInterrupt:
-            print("\n⚠️ 用户中断登录等待。")
-            return False
-        except Exception:
             try:
-                if page.is_closed():
-                    print("⚠️ 页面/浏览器已关闭，结束登录等待。")
-                    return False
-            except Exception:
+                remaining = deadline - time.time()
+                watcher.wait(min(login_watcher.WATCH_SLICE_SECONDS, max(remaining, 0)), poll_seconds)
+            except KeyboardInterrupt:
+                print("\n⚠️ 用户中断登录等待。")
                 return False
-            time.sleep(poll_seconds)
+            except Exception:
+                try:
+                    if page.is_closed():
+                        print("⚠️ 页面/浏览器已关闭，结束登录等待。")
+                        return False
+                except Exception:
+                    return False
+                time.sleep(poll_seconds)
 
     if STRICT_LOGIN_REQUIRED and not _has_login_cookie(context):
         print("⚠️ 登录等待超时，仍未检测到登录态。")
@@ -299,168 +473,589 @@ def _extract_note_id(url):
     return match.group(1) if match else "unknown"
 
 
-def _extract_stats_from_page(page):
+def _stats_from_html(content):
+    """从页面文本提取互动数；一项都没匹配到时返回 None（区别于真实的 0）。"""
     stats = {'likes': '0', 'collects': '0', 'comments': '0'}
-    try:
-        counts = page.query_selector_all(".interact-container .count")
+    likes_match = re.search(r'(?:点赞|赞)\s*([\d\.w万k]+)', content)
+    collects_match = re.search(r'(?:收藏|藏)\s*([\d\.w万k]+)', content)
+    comments_match = re.search(r'(?:评论|评)\s*([\d\.w万k]+)', content)
+    if likes_match:
+        stats['likes'] = likes_match.group(1)
+    if collects_match:
+        stats['collects'] = collects_match.group(1)
+    if comments_match:
+        stats['comments'] = comments_match.group(1)
+    if not (likes_match or collects_match or comments_match):
+        return None
+    return stats
+
+
+def _video_url_from_html(content):
+    matches = re.findall(r'"masterUrl":"(http[^"]+)"', content)
+    if matches:
+        url = matches[0].encode('utf-8').decode('unicode_escape')
+        print(f"🔍 源码提取成功: {url[:40]}...")
+        return url
+    # 兜底提取页面中直出的 mp4 资源
+    mp4_matches = re.findall(r'(https?://[^"\\]+?\.mp4[^"\\]*)', content)
+    if mp4_matches:
+        print(f"🔍 源码兜底提取 mp4 成功: {mp4_matches[0][:40]}...")
+        return mp4_matches[0]
+    return None
+
+
+def _master_url_from_state_note(note):
+    streams = ((note.get("video") or {}).get("media") or {}).get("stream") or {}
+    for codec in ("h264", "h265", "av1", "h266"):
+        for item in streams.get(codec) or []:
+            if isinstance(item, dict) and item.get("masterUrl"):
+                return item["masterUrl"]
+    return None
+
+
+def _fields_from_state_note(note):
+    """把 __INITIAL_STATE__.note.noteDetailMap[id].note 归一为 meta 字段（缺失的键不返回）。"""
+    if not isinstance(note, dict):
+        return {}
+    fields = {}
+    if note.get("title"):
+        fields["title"] = note["title"]
+    if note.get("desc"):
+        fields["desc"] = note["desc"]
+    nickname = (note.get("user") or {}).get("nickname")
+    if nickname:
+        fields["author"] = nickname
+    interact = note.get("interactInfo") or {}
+    if any(interact.get(k) is not None for k in ("likedCount", "collectedCount", "commentCount")):
+        fields["stats"] = {
+            "likes": str(interact.get("likedCount") or "0"),
+            "collects": str(interact.get("collectedCount") or "0"),
+            "comments": str(interact.get("commentCount") or "0"),
+        }
+    images = note.get("imageList") or []
+    if images and isinstance(images[0], dict):
+        cover = images[0].get("urlDefault") or images[0].get("urlPre")
+        if cover:
+            fields["cover_url"] = cover
+    master = _master_url_from_state_note(note)
+    if master:
+        fields["video_url"] = master
+    if note.get("time"):
+        try:
+            fields["pub_time"] = datetime.fromtimestamp(int(note["time"]) / 1000).strftime('%Y-%m-%d %H:%M')
+        except Exception:
+            pass
+    return fields
+
+
+def _parse_note_payload(payload, sniffed_url=None):
+    """合并 NOTE_EXTRACT_JS 的返回：SSR 初始状态优先，DOM 兜底。"""
+    payload = payload or {}
+    dom = payload.get("dom") or {}
+    fields = _fields_from_state_note(payload.get("state_note"))
+    source = "state" if fields else "dom"
+
+    if "stats" not in fields:
+        counts = dom.get("counts") or []
         if len(counts) >= 3:
-            stats['likes'] = counts[0].inner_text()
-            stats['collects'] = counts[1].inner_text()
-            stats['comments'] = counts[2].inner_text()
+            fields["stats"] = {'likes': counts[0], 'collects': counts[1], 'comments': counts[2]}
         else:
-            content = page.content()
-            likes_match = re.search(r'(?:点赞|赞)\s*([\d\.w万k]+)', content)
-            collects_match = re.search(r'(?:收藏|藏)\s*([\d\.w万k]+)', content)
-            comments_match = re.search(r'(?:评论|评)\s*([\d\.w万k]+)', content)
-            if likes_match:
-                stats['likes'] = likes_match.group(1)
-            if collects_match:
-                stats['collects'] = collects_match.group(1)
-            if comments_match:
-                stats['comments'] = comments_match.group(1)
-    except Exception as e:
-        print(f"⚠️ 抓取互动数据微瑕: {e}")
-    return stats
+            stats = _stats_from_html(dom.get("stats_text") or "")
+            # 页面上根本没有互动数据：仍给出 0 供展示，但标记为缺失（限速器视为 empty 信号）
+            fields["stats_missing"] = stats is None
+            fields["stats"] = stats or {'likes': '0', 'collects': '0', 'comments': '0'}
+
+    video_url = sniffed_url or fields.get("video_url")
+    if not video_url and dom.get("script_video"):
+        video_url = _video_url_from_html(dom["script_video"])
+    if not video_url:
+        src = dom.get("video_src") or ""
+        if src and not src.startswith("blob:"):
+            video_url = src
+    fields["video_url"] = video_url
+
+    fields.setdefault("title", dom.get("title") or "")
+    fields.setdefault("desc", dom.get("desc") or "")
+    fields.setdefault("cover_url", dom.get("cover_url") or "")
+    fields["author"] = (fields.get("author") or dom.get("author") or "Unknown").replace("关注", "").strip()
+    fields["top_comments"] = "\n".join(dom.get("comments") or [])
+    fields["source"] = source
+    return fields
+
+
+def _build_note_meta(note_id, note_url, fields, local_video_path, timestamp, ready=None):
+    meta_data = {
+        "id": note_id,
+        "url": note_url,
+        "title": fields.get("title", ""),
+        "author": fields.get("author", "Unknown"),
+        "desc": fields.get("desc", ""),
+        "stats": fields.get("stats", {'likes': '0', 'collects': '0', 'comments': '0'}),
+        "top_comments": fields.get("top_comments", ""),
+        "cover_url": fields.get("cover_url", ""),
+        "local_video_path": local_video_path,
+        "timestamp": timestamp,
+    }
+    if fields.get("pub_time"):
+        meta_data["pub_time"] = fields["pub_time"]
+    if ready is not None:
+        meta_data["ready_wait"] = ready
+    return meta_data
 
 
-def _resolve_video_url(page, sniffed_url=None):
-    final_download_url = sniffed_url
-    if not final_download_url:
+def _download_note_video(final_download_url, note_url, timestamp):
+    """下载笔记视频：优先页面提流地址，失败时使用 yt-dlp 兜底。"""
+    local_video_path = None
+    if final_download_url:
+        print(f"📥 [Video] 准备下载...")
+        local_video_path = download_video(final_download_url, f"video_{timestamp}.mp4")
+
+    # 页面提流失败时，使用 yt-dlp 兜底
+    if not local_video_path:
+        local_video_path = download_video_with_ytdlp(note_url, timestamp)
+    return local_video_path
+
+
+def _save_note_meta(meta_data):
+    json_filename = f"meta_{meta_data['timestamp']}.json"
+    json_path = os.path.join(WORK_DIR, json_filename)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(meta_data, f, ensure_ascii=False, indent=2)
+    print(f"✅ 元数据保存完成: {json_filename}")
+    return json_path
+
+
+def _store_note(meta_data, video_url):
+    """下载视频并落盘 meta，返回 meta 路径。
+
+    已缓存的笔记（按 note id 命中 media_index.json）只刷新原 meta 中的互动数据，
+    复用本地视频，不再生成新的 meta_*.json；视频被清理过时按原文件名重新下载。
+    """
+    note_id = meta_data.get("id")
+    cache = media_cache.get_cache(WORK_DIR) if media_cache.cache_enabled() else None
+    entry = cache.lookup(note_id) if cache else None
+
+    if entry:
+        local_video_path = cache.cached_video(entry)
+        if local_video_path:
+            print(f"♻️ [{note_id}] 已缓存，复用本地视频，仅刷新元数据")
+        else:
+            print(f"♻️ [{note_id}] 已缓存但视频文件缺失，重新下载")
+            cached_ts = os.path.basename(entry["meta_path"])[len("meta_"):-len(".json")]
+            local_video_path = _download_note_video(video_url, meta_data["url"], cached_ts)
+            if not local_video_path:
+                raise Exception(f"❌ 视频下载失败: {meta_data['url']}")
+        meta_data["local_video_path"] = local_video_path
+        cache.refresh_meta(entry, meta_data)
+        reused = local_video_path == entry.get("video_path")
+        cache.record(note_id, local_video_path, entry["meta_path"], sha256=entry.get("sha256") if reused else None)
+        print(f"✅ 元数据已刷新: {os.path.basename(entry['meta_path'])}")
+        return entry["meta_path"]
+
+    local_video_path = _download_note_video(video_url, meta_data["url"], meta_data["timestamp"])
+    if not local_video_path:
+        raise Exception(f"❌ 视频下载失败: {meta_data['url']}")
+    sha256 = None
+    if cache:
+        local_video_path, sha256 = cache.adopt_video(local_video_path)
+    meta_data["local_video_path"] = local_video_path
+    json_path = _save_note_meta(meta_data)
+    if cache:
+        cache.record(note_id, local_video_path, json_path, sha256=sha256)
+    return json_path
+
+
+class DownloadQueue:
+    """后台视频下载队列：浏览器循环只负责提交，下载完成后才落盘 meta JSON。
+
+    提交数超过 max_pending 时 submit 会阻塞，防止浏览器跑得太远、积压过多未下载任务。
+    每个任务完成后向 results 放入 (note_id, json_path, error)。
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        workers = max(1, workers or DOWNLOAD_WORKERS)
+        max_pending = max(workers, max_pending or DOWNLOAD_MAX_PENDING)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-download")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self.results = queue.Queue()
+
+    def submit(self, meta_data, video_url):
+        self._slots.acquire()
         try:
-            content = page.content()
-            matches = re.findall(r'"masterUrl":"(http[^"]+)"', content)
-            if matches:
-                final_download_url = matches[0].encode('utf-8').decode('unicode_escape')
-                print(f"🔍 源码提取成功: {final_download_url[:40]}...")
-            if not final_download_url:
-                # 兜底提取页面中直出的 mp4 资源
-                mp4_matches = re.findall(r'(https?://[^"\\]+?\.mp4[^"\\]*)', content)
-                if mp4_matches:
-                    final_download_url = mp4_matches[0]
-                    print(f"🔍 源码兜底提取 mp4 成功: {final_download_url[:40]}...")
+            future = self._executor.submit(self._run, meta_data, video_url)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _f: self._slots.release())
+        self._futures.append(future)
+        return future
+
+    def _run(self, meta_data, video_url):
+        try:
+            json_path = _store_note(meta_data, video_url)
         except Exception as e:
-            print(f"⚠️ 源码提取失败: {e}")
-    if not final_download_url:
+            self.results.put((meta_data.get("id"), None, e))
+            raise
+        self.results.put((meta_data.get("id"), json_path, None))
+        return json_path
+
+    def pending(self):
+        return sum(1 for f in self._futures if not f.done())
+
+    def close(self):
+        """等待全部下载结束，按提交顺序返回成功落盘的 meta 路径。"""
+        self._executor.shutdown(wait=True)
+        paths = []
+        for future in self._futures:
+            if future.exception() is None and future.result():
+                paths.append(future.result())
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+        return False
+
+
+def _ready_report(started, signals, timed_out):
+    waited = round(time.monotonic() - started, 2)
+    report = {
+        "waited_s": waited,
+        "saved_s": round(LEGACY_NOTE_WAIT_SECONDS - waited, 2),
+        "signals": signals,
+        "timed_out": timed_out,
+    }
+    if timed_out:
+        missing = [k for k, ok in signals.items() if not ok]
+        print(f"⏱️ 就绪等待超时 ({waited}s)，未就绪信号: {missing}")
+    else:
+        print(f"⚡ 页面就绪用时 {waited}s（较固定等待节省 {report['saved_s']}s）")
+    return report
+
+
+def _wait_for_note_ready(page, sniffed, timeout=None):
+    """等待笔记页就绪：互动计数 + 正文（DOM）与视频流地址（嗅探/源码），整体受 timeout 约束。
+
+    快页面立即返回；返回的报告包含实际等待与相对旧版固定等待节省的秒数。
+    """
+    timeout = NOTE_READY_TIMEOUT if timeout is None else timeout
+    started = time.monotonic()
+    deadline = started + timeout
+    signals = {"dom": False, "video": False}
+
+    # 一个谓词同时等 DOM 与视频信号（与异步版一致），不再先把 DOM 等满 timeout
+    while True:
+        sniffed_ready = bool(sniffed and sniffed.get("url"))
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        slice_started = time.monotonic()
         try:
-            video_element = page.query_selector('video')
-            if video_element:
-                src = video_element.get_attribute("src")
-                if src and not src.startswith("blob:"):
-                    final_download_url = src
+            page.wait_for_function(NOTE_READY_JS, arg=sniffed_ready, polling=100,
+                                   timeout=max(1, int(min(NOTE_READY_SLICE, remaining) * 1000)))
+            signals = {"dom": True, "video": True}
+            break
         except Exception:
             pass
-    return final_download_url
-
+        if time.monotonic() - slice_started < 0.05:
+            # 立即失败（页面跳转中等）时避免空转；同时让出事件循环，嗅探回调才有机会写入 sniffed
+            try:
+                page.wait_for_timeout(100)
+            except Exception:
+                time.sleep(0.1)
 
-def _extract_note_meta(page, source_url, sniffed_video_url=None):
-    note_url = page.url if page.url else source_url
-    note_id = _extract_note_id(note_url)
-    timestamp = int(datetime.now().timestamp() * 1000)
+    if not all(signals.values()):
+        try:
+            state = page.evaluate(NOTE_SIGNALS_JS)
+        except Exception:
+            state = None
+        if isinstance(state, dict):
+            signals = {"dom": bool(state.get("dom")), "video": bool(state.get("video"))}
+        signals["video"] = signals["video"] or bool(sniffed and sniffed.get("url"))
 
-    print("⏳ 缓冲 3 秒以确保互动数据加载...")
-    time.sleep(3)
+    # 轻滚一下触发评论区懒加载，不再额外等待
     try:
         page.mouse.wheel(0, 500)
     except Exception:
         pass
-    time.sleep(1)
+    return _ready_report(started, signals, timed_out=not all(signals.values()))
 
-    stats = _extract_stats_from_page(page)
-    print(f"📊 抓取到数据：赞({stats['likes']}) 藏({stats['collects']}) 评({stats['comments']})")
 
-    final_download_url = _resolve_video_url(page, sniffed_video_url)
-    if not final_download_url:
-        raise Exception("❌ 未能找到有效的视频地址")
+async def _wait_for_note_ready_async(page, sniffed, timeout=None):
+    """_wait_for_note_ready 的异步版本。"""
+    timeout = NOTE_READY_TIMEOUT if timeout is None else timeout
+    started = time.monotonic()
+    deadline = started + timeout
+    signals = {"dom": False, "video": bool(sniffed and sniffed.get("url"))}
 
-    title = page.title()
-    desc = ""
-    try:
-        desc_element = page.query_selector("#detail-desc")
-        if desc_element:
-            desc = desc_element.inner_text()
-    except Exception:
-        pass
+    async def _wait_dom():
+        try:
+            await page.wait_for_function(NOTE_DOM_READY_JS, timeout=int(timeout * 1000), polling=100)
+            signals["dom"] = True
+        except Exception:
+            pass
+
+    async def _wait_video():
+        while not (sniffed and sniffed.get("url")):
+            try:
+                if await page.evaluate(NOTE_VIDEO_HINT_JS):
+                    break
+            except Exception:
+                pass
+            if time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(0.1)
+        signals["video"] = True
 
-    author = "Unknown"
+    await asyncio.gather(_wait_dom(), _wait_video())
     try:
-        author_elem = page.query_selector(".username")
-        if author_elem:
-            author = author_elem.inner_text().strip()
+        await page.mouse.wheel(0, 500)
     except Exception:
         pass
-    author = author.replace("关注", "").strip()
+    return _ready_report(started, signals, timed_out=not all(signals.values()))
+
 
-    comments_list = []
+def _extract_note_fields(page, note_id, sniffed=None):
+    """一次 page.evaluate 取回全部字段（SSR 状态 + DOM），在 Python 侧解析。"""
     try:
-        comment_elements = page.query_selector_all(".comment-item .content")
-        for el in comment_elements[:5]:
-            comments_list.append(el.inner_text())
-    except Exception:
-        pass
+        payload = page.evaluate(NOTE_EXTRACT_JS, note_id)
+    except Exception as e:
+        print(f"⚠️ 页面字段抽取失败: {e}")
+        payload = {}
+    return _parse_note_payload(payload, (sniffed or {}).get("url"))
+
+
+def _rate_outcome(page_url="", status=None, fields=None, logged_in=True):
+    """把一次笔记访问归类为限速信号（见 rate_limiter.AdaptiveRateLimiter.report），无信号返回 None。"""
+    url = (page_url or "").lower()
+    if status in RATE_LIMITED_STATUSES:
+        return "rate_limited"
+    if "captcha" in url or "/website-login/verify" in url:
+        return "captcha"
+    if not logged_in or "/login" in url:
+        return "login_wall"
+    if fields is None:
+        return None
+    # 新发布的笔记互动数本来就可能全是 0；只有完全取不到互动数据才算 empty
+    if fields.get("stats_missing") or not fields.get("stats"):
+        return "empty"
+    return "ok"
 
-    cover_url = ""
+
+def _report_rate(note_url, page, fields=None, nav=None):
+    """每条笔记只上报一次限速信号；nav 记录 goto 状态码与登录等待结果。"""
+    nav = nav if nav is not None else {}
+    if nav.get("reported"):
+        return
     try:
-        meta_img = page.query_selector('meta[property="og:image"]')
-        if meta_img:
-            cover_url = meta_img.get_attribute("content")
+        page_url = page.url
     except Exception:
-        pass
+        page_url = ""
+    outcome = _rate_outcome(page_url, nav.get("status"), fields, nav.get("logged_in", True))
+    if outcome:
+        nav["reported"] = True
+        _report_outcome(note_url, outcome)
+
+
+def _report_outcome(note_url, outcome):
+    lease = account_pool.current_lease()
+    if lease is not None:
+        # 账号池模式：信号记入当前账号自己的限速桶，并更新账号健康状态
+        lease.report(note_url, outcome)
+    else:
+        rate_limiter.get_limiter().report(note_url, outcome)
 
-    video_filename = f"video_{timestamp}.mp4"
-    local_video_path = None
-    if final_download_url:
-        print(f"📥 [Video] 准备下载...")
-        local_video_path = download_video(final_download_url, video_filename)
 
-    # 页面提流失败时，使用 yt-dlp 兜底
-    if not local_video_path:
-        local_video_path = download_video_with_ytdlp(note_url or source_url, timestamp)
+def _active_limiter():
+    """当前账号的限速器；未使用账号池时为全局限速器。"""
+    lease = account_pool.current_lease()
+    return lease.limiter if lease is not None else rate_limiter.get_limiter()
 
-    if not local_video_path:
+
+def _active_user_data_dir():
+    """当前租用账号的浏览器记忆目录；未使用账号池（或租到 default）时为 USER_DATA_DIR。"""
+    lease = account_pool.current_lease()
+    if lease is None or lease.name == account_pool.DEFAULT_PROFILE:
+        return USER_DATA_DIR
+    return lease.user_data_dir
+
+
+def _collect_note_meta(page, source_url, sniffed=None, nav=None):
+    """抓取笔记元数据（不下载视频），返回 (meta_data, 视频地址)。"""
+    note_url = page.url if page.url else source_url
+    note_id = _extract_note_id(note_url)
+    timestamp = _new_timestamp()
+
+    ready = _wait_for_note_ready(page, sniffed)
+
+    fields = _extract_note_fields(page, note_id, sniffed)
+    stats = fields["stats"]
+    print(f"📊 抓取到数据：赞({stats['likes']}) 藏({stats['collects']}) 评({stats['comments']}) [来源: {fields['source']}]")
+    _report_rate(source_url, page, fields, nav)
+
+    if not fields["video_url"]:
         raise Exception("❌ 未能找到有效的视频地址")
+    meta_data = _build_note_meta(note_id, note_url or source_url, fields, None, timestamp, ready)
+    return meta_data, fields["video_url"]
 
-    meta_data = {
-        "id": note_id,
-        "url": note_url or source_url,
-        "title": title,
-        "author": author,
-        "desc": desc,
-        "stats": stats,
-        "top_comments": "\n".join(comments_list),
-        "cover_url": cover_url,
-        "local_video_path": local_video_path,
-        "timestamp": timestamp
-    }
 
-    json_filename = f"meta_{timestamp}.json"
-    json_path = os.path.join(WORK_DIR, json_filename)
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(meta_data, f, ensure_ascii=False, indent=2)
-    print(f"✅ 元数据保存完成: {json_filename}")
-    return json_path
+def _extract_note_meta(page, source_url, sniffed=None, downloads=None, nav=None):
+    """抓取并保存笔记。传入 downloads 队列时视频转后台下载，返回对应 Future；否则同步返回 meta 路径。"""
+    meta_data, video_url = _collect_note_meta(page, source_url, sniffed, nav)
+    if downloads is not None:
+        print(f"📤 已提交后台下载（队列中 {downloads.pending() + 1} 条）")
+        return downloads.submit(meta_data, video_url)
+
+    return _store_note(meta_data, video_url)
+
+
+def _normalize_note_links(hrefs):
+    """把卡片 href 补全为绝对地址，并保序去重。"""
+    seen = set()
+    uniq = []
+    for href in hrefs:
+        if not href:
+            continue
+        full = urljoin("https://www.xiaohongshu.com", href)
+        if "/explore/" in full and full not in seen:
+            seen.add(full)
+            uniq.append(full)
+    return uniq
+
+
+def _parse_feed_payload(payload):
+    """解析 user_posted 接口 JSON，返回 (笔记摘要列表, cursor, has_more)。"""
+    data = (payload or {}).get("data") or {}
+    notes = []
+    for item in data.get("notes") or []:
+        note_id = item.get("note_id") or item.get("id")
+        if not note_id:
+            continue
+        url = f"https://www.xiaohongshu.com/explore/{note_id}"
+        if item.get("xsec_token"):
+            # 不带 xsec_token 直达详情页会被拦截
+            url += f"?xsec_token={quote(item['xsec_token'])}&xsec_source=pc_user"
+        cover = item.get("cover") or {}
+        interact = item.get("interact_info") or {}
+        notes.append({
+            "id": note_id,
+            "url": url,
+            "type": item.get("type", ""),
+            "title": item.get("display_title", ""),
+            "cover_url": cover.get("url_default") or cover.get("url", ""),
+            "likes": str(interact.get("liked_count", "0")),
+            "sticky": bool(interact.get("sticky")),
+        })
+    return notes, data.get("cursor"), bool(data.get("has_more"))
+
+
+class ProfileFeedCollector:
+    """收集达人主页 user_posted 接口响应，按 cursor 分页累积笔记列表。
+
+    handle_response 只把响应对象放入 pending，JSON 在主流程里解析，避免在事件回调中阻塞。
+    传入 watermark（crawl_state.Watermark）时跳过已采集过的笔记，连续遇到已知笔记即停止翻页。
+    接口报错（success=false）立即停止翻页，stop_reason 记录对应的限速信号并上报限速器。
+    """
+
+    def __init__(self, watermark=None):
+        self.watermark = watermark
+        self.pending = []
+        self.notes = {}
+        self.cursor = None
+        self.has_more = True
+        self.pages = 0
+        self.stop_reason = None
+        self.last_page_at = time.monotonic()
+
+    def handle_response(self, response):
+        try:
+            if FEED_API_PATH in response.url:
+                self.pending.append(response)
+        except Exception:
+            pass
+
+    def ingest(self, payload):
+        if not payload or payload.get("success") is False:
+            print(f"⚠️ 笔记列表接口返回异常: {str(payload)[:120]}")
+            self.has_more = False
+            self.stop_reason = FEED_ERROR_OUTCOMES.get((payload or {}).get("code"), "empty")
+            _report_outcome(FEED_API_URL, self.stop_reason)
+            return
+        notes, cursor, has_more = _parse_feed_payload(payload)
+        for note in notes:
+            if self.watermark is not None and note.get("type") == "video":
+                verdict = self.watermark.check(note["id"], sticky=note.get("sticky"))
+                if verdict == "stop":
+                    has_more = False
+                    break
+                if verdict == "known":
+                    continue
+            self.notes.setdefault(note["id"], note)
+        self.cursor = cursor
+        self.has_more = has_more and bool(notes)
+        self.pages += 1
+        self.last_page_at = time.monotonic()
+
+    def video_links(self):
+        """仅保留视频笔记（图文笔记没有视频可下载）。"""
+        return [n["url"] for n in self.notes.values() if n.get("type") == "video"]
+
+    def finished(self, max_items, idle_seconds):
+        if self.stop_reason:
+            return True
+        if len(self.video_links()) >= max_items:
+            return True
+        if self.pages and not self.has_more:
+            return True
+        return time.monotonic() - self.last_page_at > idle_seconds
+
+    def summary(self, started):
+        print(f"📡 接口分页 {self.pages} 页，共 {len(self.notes)} 条笔记"
+              f"（视频 {len(self.video_links())} 条），用时 {round(time.monotonic() - started, 1)}s")
+        if self.stop_reason:
+            print(f"⛔ 笔记列表接口报错（{self.stop_reason}），已停止翻页")
+        if self.watermark is not None and self.watermark.stopped:
+            print(f"🔖 已到达上次采集位置，跳过 {self.watermark.skipped} 条已采集笔记")
+
+
+def _harvest_profile_feed(page, feed, max_items, idle_seconds=None):
+    """滚到底触发页面自身（已签名）的 user_posted 分页请求，直接解析接口 JSON 收集笔记链接。"""
+    idle_seconds = FEED_IDLE_SECONDS if idle_seconds is None else idle_seconds
+    started = time.monotonic()
+    feed.last_page_at = started
+    while True:
+        while feed.pending:
+            response = feed.pending.pop(0)
+            try:
+                feed.ingest(response.json())
+            except Exception as e:
+                print(f"⚠️ 笔记列表接口解析失败: {e}")
+        if feed.finished(max_items, idle_seconds):
+            break
+        try:
+            page.evaluate(FEED_SCROLL_JS)
+        except Exception:
+            pass
+        try:
+            page.wait_for_timeout(200)
+        except Exception:
+            time.sleep(0.2)
+    feed.summary(started)
+    return feed.video_links()[:max_items]
 
 
 def _collect_note_links(page):
-    links = []
+    hrefs = []
     try:
         anchors = page.query_selector_all('a[href*="/explore/"]')
         for a in anchors:
-            href = a.get_attribute("href")
-            if not href:
-                continue
-            full = urljoin("https://www.xiaohongshu.com", href)
-            if "/explore/" in full:
-                links.append(full)
+            hrefs.append(a.get_attribute("href"))
     except Exception:
         pass
-    # 保序去重
-    seen = set()
-    uniq = []
-    for u in links:
-        if u not in seen:
-            seen.add(u)
-            uniq.append(u)
-    return uniq
+    return _normalize_note_links(hrefs)
 
 
 def _click_note_card(page, note_url):
@@ -472,7 +1067,8 @@ def _click_note_card(page, note_url):
             if not href:
                 continue
             full = urljoin("https://www.xiaohongshu.com", href)
-            if full != note_url:
+            # 接口拼出的链接带 xsec_token 参数，按 note id 比对
+            if full != note_url and _extract_note_id(full) != _extract_note_id(note_url):
                 continue
             try:
                 a.scroll_into_view_if_needed(timeout=3000)
@@ -484,182 +1080,801 @@ def _click_note_card(page, note_url):
         pass
     return False
 
-def run_scraper(url):
-    print(f"🚀 [Step 1] 启动猎人模式: {url}")
+def _launch_persistent_context(p, user_data_dir=USER_DATA_DIR):
+    """启动带登录记忆的浏览器；优先使用本机 Chrome，不可用时回退到内置 Chromium。
+
+    SCRAPE_HEADLESS=1 时无界面启动，防检测脚本挂在 context 上，对所有标签页生效。
+    """
+    headless = browser_daemon.headless_requested()
+    options = browser_daemon.launch_options(user_data_dir, headless, BROWSER_ARGS)
+    try:
+        context = p.chromium.launch_persistent_context(channel="chrome", **options)
+    except Exception:
+        context = p.chromium.launch_persistent_context(**options)
+    if headless:
+        context.add_init_script(WEBDRIVER_INIT_SCRIPT)
+    return context
 
-    with sync_playwright() as p:
-        context = None
-        if not os.path.exists(USER_DATA_DIR):
-             print(f"⚠️ 警告：未找到浏览器记忆文件夹，请先运行 login_tool.py！")
 
+def _is_daemon_profile(user_data_dir):
+    """常驻浏览器只服务默认账号目录；按绝对路径比较，传入绝对路径或换了工作目录也能识别。"""
+    path = os.path.abspath(user_data_dir)
+    return path in (os.path.abspath(USER_DATA_DIR), os.path.abspath(browser_daemon.USER_DATA_DIR))
+
+
+def _daemon_connect_failed(endpoint, user_data_dir, error):
+    """CDP 连接失败：常驻浏览器仍存活时它占着同一个用户目录，本地启动必然撞上 Chrome 的 profile 锁。"""
+    if browser_daemon.is_alive(endpoint):
+        raise RuntimeError(
+            f"常驻浏览器 {endpoint} 仍在运行并占用 {user_data_dir}，但 CDP 连接失败: {error}。"
+            f"请检查/重启常驻浏览器（python browser_daemon.py），或设置 BROWSER_DAEMON=0 后重试。"
+        )
+    print(f"⚠️ 常驻浏览器不可用，改为本地启动: {error}")
+
+
+@contextlib.contextmanager
+def _browser_session(p, user_data_dir=None):
+    """打开浏览器会话并返回 (context, page)。
+
+    配置了常驻浏览器（BROWSER_DAEMON / BROWSER_CDP_URL）时通过 CDP 连接复用，
+    只新开并在结束时关闭自己的标签页；否则本地启动持久化浏览器，结束时整体关闭。
+    user_data_dir 默认取当前租用账号的目录；常驻浏览器只服务默认账号。
+    """
+    browser = None
+    context = None
+    user_data_dir = user_data_dir or _active_user_data_dir()
+    endpoint = browser_daemon.resolve_endpoint() if _is_daemon_profile(user_data_dir) else None
+    if endpoint:
+        try:
+            browser = p.chromium.connect_over_cdp(endpoint, timeout=10000)
+            context = browser.contexts[0] if browser.contexts else browser.new_context(viewport=BROWSER_VIEWPORT)
+            print(f"🔌 已连接常驻浏览器: {endpoint}")
+        except Exception as e:
+            browser = None
+            _daemon_connect_failed(endpoint, user_data_dir, e)
+
+    if context is None:
+        if not os.path.exists(user_data_dir):
+            print(f"⚠️ 警告：未找到浏览器记忆文件夹 {user_data_dir}，请先运行 login_tool.py！")
         print(f"👀 正在唤醒有记忆的浏览器...")
+        context = _launch_persistent_context(p, user_data_dir)
+
+    page = None
+    try:
+        if browser is not None:
+            page = context.new_page()
+        else:
+            page = context.pages[0] if context.pages else context.new_page()
+        yield context, page
+    finally:
+        if browser is not None:
+            try:
+                if page:
+                    page.close()
+            except Exception:
+                pass
+            try:
+                # CDP 连接下 close 只断开连接，不会关闭常驻浏览器
+                browser.close()
+            except Exception:
+                pass
+        else:
+            try:
+                context.close()
+            except Exception:
+                pass
+
+
+def _resolve_download_outcomes(note_urls, outcomes):
+    """把抓取结果（meta 路径 / 下载 Future / 异常）统一解析为成功的 meta 路径列表。"""
+    results = []
+    for note_url, outcome in zip(note_urls, outcomes):
+        try:
+            if isinstance(outcome, BaseException):
+                raise outcome
+            json_path = outcome.result() if hasattr(outcome, "result") else outcome
+            if json_path:
+                results.append(json_path)
+        except Exception as e:
+            print(f"❌ 笔记采集失败 ({note_url}): {e}")
+    return results
+
+
+def _finish_profile_downloads(submitted, downloads, own_queue):
+    """submitted 为 [(note_url, Future)]。外部队列直接返回 Future 列表；自建队列则等待下载并汇总。"""
+    if not own_queue:
+        return [future for _, future in submitted]
+    print(f"\n⏳ 页面采集结束，等待后台下载完成（剩余 {downloads.pending()} 条）...")
+    downloads.close()
+    results = _resolve_download_outcomes([u for u, _ in submitted], [f for _, f in submitted])
+    print(f"\n🎉 达人主页采集结束，成功 {len(results)} 条。")
+    return results
+
+
+def _crawl_watermark(profile_url, incremental=None):
+    """增量采集：返回该达人的 Watermark（已采集笔记 = 采集记录 + 媒体缓存），关闭时返回 None。"""
+    if incremental is None:
+        incremental = crawl_state.incremental_enabled()
+    if not incremental:
+        return None
+    state = crawl_state.get_state(WORK_DIR)
+    cache = media_cache.get_cache(WORK_DIR) if media_cache.cache_enabled() else None
+    is_known = (lambda note_id: cache.lookup(note_id) is not None) if cache else None
+    watermark = state.watermark(profile_url, is_known=is_known)
+    entry = state.entry(profile_url)
+    if entry.get("last_run"):
+        last_run = datetime.fromtimestamp(entry["last_run"]).strftime("%Y-%m-%d %H:%M")
+        print(f"🔖 增量模式：上次采集于 {last_run}，已记录 {len(entry.get('known') or [])} 条笔记")
+    return watermark
+
+
+def _track_crawl_progress(profile_url, submitted):
+    """笔记落盘成功后写入采集记录（--full 全量重采时同样记录）。
+
+    submitted 按发现顺序排列；全部下载结束后，以第一条成功的笔记作为本次最新笔记，并记下成功条数。
+    """
+    state = crawl_state.get_state(WORK_DIR)
+    saved = [None] * len(submitted)
+    remaining = [len(submitted)]
+    lock = threading.Lock()
+
+    def _finish():
+        ok_ids = [note_id for note_id in saved if note_id]
+        if ok_ids:
+            state.record(profile_url, [], newest=ok_ids[0])
+        state.finish_run(profile_url, len(ok_ids))
+
+    def _record(index, note_url):
+        def _done(outcome):
+            try:
+                ok = outcome.result() if hasattr(outcome, "result") else outcome
+            except Exception:
+                ok = None
+            if ok:
+                note_id = crawl_state.note_id_from_url(note_url)
+                saved[index] = note_id
+                state.record(profile_url, [note_id])
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                _finish()
+        return _done
+
+    if not submitted:
+        _finish()
+    for index, (note_url, outcome) in enumerate(submitted):
+        callback = _record(index, note_url)
+        if hasattr(outcome, "add_done_callback"):
+            outcome.add_done_callback(callback)
+        else:
+            callback(outcome)
+
+
+def _scrape_note_http(url, downloads=None):
+    """免浏览器抓取：用 state.json 的 cookie 直接请求笔记页，解析 SSR 初始状态。
+
+    成功时与 run_scraper 返回值一致（Future / meta 路径）；遇到登录墙、风控或缺数据时返回 None，由调用方回退浏览器。
+    """
+    if not note_fetcher.http_fetch_enabled() or not note_fetcher.is_xhs_url(url):
+        return None
+    note_id = _extract_note_id(url)
+    result = note_fetcher.fetch_note(url, _active_user_data_dir(), note_id=None if note_id == "unknown" else note_id)
+    if result.reason in ("rate_limited", "captcha"):
+        # 风控是真实信号；登录墙/缺数据可能只是 state.json 过期，交给浏览器路径判断
+        _report_outcome(url, result.reason)
+    if not result.ok:
+        detail = f": {result.error}" if result.error else ""
+        print(f"↪️ HTTP 直连未取到笔记数据 [{result.reason}{detail}]，改用浏览器抓取。")
+        return None
+
+    fields = _fields_from_state_note(result.note)
+    if not fields.get("video_url") or _rate_outcome(fields=fields) != "ok":
+        print("↪️ HTTP 直连缺少视频地址或互动数据，改用浏览器抓取。")
+        return None
+    _report_outcome(url, "ok")
+    note_id = result.note.get("noteId") or _extract_note_id(result.url)
+    note_url = result.url if "/explore/" in result.url else url
+    stats = fields["stats"]
+    print(f"⚡ HTTP 直连取得笔记数据：赞({stats['likes']}) 藏({stats['collects']}) 评({stats['comments']})")
+    meta_data = _build_note_meta(note_id, note_url, fields, None, _new_timestamp())
+    meta_data["fetch_mode"] = "http"
+    if downloads is not None:
+        print(f"📤 已提交后台下载（队列中 {downloads.pending() + 1} 条）")
+        return downloads.submit(meta_data, fields["video_url"])
+    return _store_note(meta_data, fields["video_url"])
+
+
+def run_scraper(url, downloads=None):
+    """抓取单条笔记。传入 downloads 队列时返回下载 Future（由调用方统一等待），否则返回 meta 路径。
+
+    小红书笔记先走 HTTP 直连（见 note_fetcher），拿不到完整数据时才启动浏览器。
+    """
+    print(f"🚀 [Step 1] 启动猎人模式: {url}")
+
+    result = _scrape_note_http(url, downloads)
+    if result is not None:
+        if downloads is None:
+            print("✅ [Step 1 完成] 数据已保存")
+        return result
+
+    with sync_playwright() as p, _browser_session(p) as (context, page):
+        real_video_url = {"url": None}
+        # 拦截图片/字体/追踪/推荐流，视频流嗅探只对 CDN 地址触发
+        policy = route_policy.RoutePolicy(real_video_url).install(page)
+        page.add_init_script(WEBDRIVER_INIT_SCRIPT)
+
+        nav = {}
         try:
-            context = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=False,
-                viewport={'width': 1280, 'height': 800},
-                channel="chrome", 
-                args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-            )
-        except:
-            context = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=False,
-                viewport={'width': 1280, 'height': 800},
-                args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-            )
+            print("🌍 正在加载页面 (设置30秒超时)...")
+            response = page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            nav["status"] = response.status if response else None
+        except Exception as e:
+            print(f"⚠️ 页面加载提示 (Timeout)，正在停止网页转圈以提取数据...")
+            try:
+                page.evaluate("window.stop()")
+            except Exception:
+                pass
 
+        nav["logged_in"] = wait_for_login_if_needed(page, context=context)
         try:
-            if len(context.pages) > 0:
-                page = context.pages[0]
-            else:
-                page = context.new_page()
-            
-            real_video_url = {"url": None}
-            
-            def handle_response(response):
+            result = _extract_note_meta(page, url, real_video_url, downloads=downloads, nav=nav)
+        finally:
+            _report_rate(url, page, nav=nav)
+        policy.report()
+        if downloads is None:
+            print("✅ [Step 1 完成] 数据已保存")
+        return result
+
+
+def run_profile_scraper(profile_url, max_items=10, concurrency=None, downloads=None, discovery=None,
+                        incremental=None):
+    """达人主页真实用户模式：点击卡片 -> 分析 -> 返回 -> 下一条。
+
+    concurrency > 1 时切换为异步多标签页模式（见 run_profile_scraper_async）。
+    discovery="feed"（默认）时笔记列表取自 user_posted 接口分页，未捕获到接口时回退为滚动读取卡片。
+    incremental（默认 CRAWL_INCREMENTAL=1）时跳过已采集笔记，连续遇到已知笔记即停止（见 crawl_state）。
+    视频统一交给后台下载队列；传入外部 downloads 时返回 Future 列表，否则等待下载完成并返回 meta 路径列表。
+    """
+    if concurrency is None:
+        lease = account_pool.current_lease()
+        concurrency = lease.concurrency if lease is not None else DEFAULT_PROFILE_CONCURRENCY
+    discovery = (discovery or PROFILE_DISCOVERY).lower()
+    if concurrency > 1:
+        return asyncio.run(run_profile_scraper_async(
+            profile_url, max_items=max_items, concurrency=concurrency, downloads=downloads,
+            discovery=discovery, incremental=incremental,
+        ))
+
+    print(f"🚀 [Step 1] 达人主页模式: {profile_url}")
+    print(f"🎯 目标采集条数: {max_items}")
+
+    own_queue = downloads is None
+    if own_queue:
+        downloads = DownloadQueue()
+    results = []
+    visited = set()
+    watermark = _crawl_watermark(profile_url, incremental)
+    feed = ProfileFeedCollector(watermark) if discovery == "feed" else None
+    limiter = _active_limiter()
+    with sync_playwright() as p, _browser_session(p) as (context, page):
+        page.add_init_script(WEBDRIVER_INIT_SCRIPT)
+        policy = route_policy.RoutePolicy().install(page)
+        if feed is not None:
+            page.on("response", feed.handle_response)
+
+        print("🌍 打开达人主页...")
+        page.goto(profile_url, wait_until="domcontentloaded", timeout=30000)
+        if not wait_for_login_if_needed(page, context=context):
+            _report_rate(profile_url, page, nav={"logged_in": False})
+
+        feed_links = []
+        up_to_date = False
+        if feed is not None:
+            feed_links = _harvest_profile_feed(page, feed, max_items)
+            page.remove_listener("response", feed.handle_response)
+            up_to_date = not feed_links and watermark is not None and watermark.stopped
+            if up_to_date:
+                print("🔖 没有新笔记，跳过该达人。")
+            elif not feed_links:
+                print("⚠️ 未从接口拿到视频笔记，回退为滚动读取卡片。")
+        if not feed_links and not up_to_date:
+            time.sleep(2)
+
+        idle_rounds = 0
+        while not up_to_date and len(results) < max_items and idle_rounds < 8:
+            note_links = feed_links
+            if not note_links:
+                note_links = _collect_note_links(page)
+                if watermark is not None:
+                    note_links = watermark.filter(note_links)
+            pending = [u for u in note_links if u not in visited]
+
+            if not pending:
+                if feed_links or (watermark is not None and watermark.stopped):
+                    if watermark is not None and watermark.stopped and not feed_links:
+                        print(f"🔖 已到达上次采集位置，跳过 {watermark.skipped} 条已采集笔记")
+                    break
+                idle_rounds += 1
+                print("↘️ 未发现新卡片，向下滚动加载更多...")
                 try:
-                    if "video/mp4" in response.headers.get("content-type", "") or ".mp4" in response.url:
-                        if "sns-video" in response.url or "spectrum" in response.url:
-                            if not real_video_url["url"]: 
-                                print(f"🕵️ 嗅探到真实视频流: {response.url[:40]}...")
-                                real_video_url["url"] = response.url
+                    page.mouse.wheel(0, 1800)
                 except Exception:
                     pass
+                time.sleep(2)
+                continue
 
-            page.on("response", handle_response)
-            page.add_init_script("Object.defineProperty(navigator, 'webdriver', { get: () => undefined })")
+            idle_rounds = 0
+            for note_url in pending:
+                if len(results) >= max_items:
+                    break
+                visited.add(note_url)
+                print(f"\n🎬 进入笔记 ({len(results)+1}/{max_items}): {note_url}")
+
+                sniffed = policy.track({"url": None})
+                nav = {}
+                # 按域名自适应限速，替代固定的随机休息
+                limiter.acquire(note_url)
+                try:
+                    clicked = _click_note_card(page, note_url)
+                    if clicked:
+                        print("🖱️ 已模拟点击卡片进入详情页。")
+                        time.sleep(2)
+                    else:
+                        print("⚠️ 卡片点击失败，降级为同会话直达详情页。")
+                        try:
+                            response = page.goto(note_url, wait_until="domcontentloaded", timeout=30000)
+                        except Exception:
+                            response = page.goto(note_url, wait_until="load", timeout=45000)
+                        nav["status"] = response.status if response else None
 
-            try:
-                print("🌍 正在加载页面 (设置30秒超时)...")
-                page.goto(url, wait_until="domcontentloaded", timeout=30000)
-            except Exception as e:
-                print(f"⚠️ 页面加载提示 (Timeout)，正在停止网页转圈以提取数据...")
+                    nav["logged_in"] = wait_for_login_if_needed(page, context=context)
+                    results.append((note_url, _extract_note_meta(page, note_url, sniffed, downloads=downloads, nav=nav)))
+                    print("✅ 当前笔记元数据采集完成，视频转入后台下载。")
+                except Exception as e:
+                    print(f"❌ 当前笔记采集失败: {e}")
+                    _report_rate(note_url, page, nav=nav)
+
+                # 模拟真实用户返回达人主页
                 try:
-                    page.evaluate("window.stop()")
+                    page.go_back(wait_until="domcontentloaded", timeout=15000)
                 except Exception:
-                    pass
+                    page.goto(profile_url, wait_until="domcontentloaded", timeout=30000)
+        policy.report("达人主页采集")
 
-            wait_for_login_if_needed(page, context=context)
-            json_path = _extract_note_meta(page, url, real_video_url["url"])
-            print("✅ [Step 1 完成] 数据已保存")
-            time.sleep(1)
-            return json_path
-        finally:
-            if context:
-                try:
-                    context.close()
-                except:
-                    pass
+    _track_crawl_progress(profile_url, results)
+    return _finish_profile_downloads(results, downloads, own_queue)
 
 
-def run_profile_scraper(profile_url, max_items=10):
-    """达人主页真实用户模式：点击卡片 -> 分析 -> 返回 -> 下一条。"""
-    print(f"🚀 [Step 1] 达人主页模式: {profile_url}")
-    print(f"🎯 目标采集条数: {max_items}")
+# ==========================================
+# 👇 异步多标签页达人主页模式
+# ==========================================
+
 
-    with sync_playwright() as p:
-        context = None
-        results = []
-        visited = set()
+async def _launch_persistent_context_async(p, user_data_dir=USER_DATA_DIR):
+    headless = browser_daemon.headless_requested()
+    options = browser_daemon.launch_options(user_data_dir, headless, BROWSER_ARGS)
+    try:
+        context = await p.chromium.launch_persistent_context(channel="chrome", **options)
+    except Exception:
+        context = await p.chromium.launch_persistent_context(**options)
+    if headless:
+        await context.add_init_script(WEBDRIVER_INIT_SCRIPT)
+    return context
+
+
+@contextlib.asynccontextmanager
+async def _browser_session_async(p, user_data_dir=None):
+    """_browser_session 的异步版本，返回 (context, page)。"""
+    browser = None
+    context = None
+    user_data_dir = user_data_dir or _active_user_data_dir()
+    endpoint = None
+    if _is_daemon_profile(user_data_dir):
+        endpoint = await asyncio.to_thread(browser_daemon.resolve_endpoint)
+    if endpoint:
         try:
+            browser = await p.chromium.connect_over_cdp(endpoint, timeout=10000)
+            context = browser.contexts[0] if browser.contexts else await browser.new_context(viewport=BROWSER_VIEWPORT)
+            print(f"🔌 已连接常驻浏览器: {endpoint}")
+        except Exception as e:
+            browser = None
+            await asyncio.to_thread(_daemon_connect_failed, endpoint, user_data_dir, e)
+
+    if context is None:
+        context = await _launch_persistent_context_async(p, user_data_dir)
+
+    page = None
+    try:
+        if browser is not None:
+            page = await context.new_page()
+        else:
+            page = context.pages[0] if context.pages else await context.new_page()
+        yield context, page
+    finally:
+        if browser is not None:
+            try:
+                if page:
+                    await page.close()
+            except Exception:
+                pass
+            try:
+                await browser.close()
+            except Exception:
+                pass
+        else:
             try:
-                context = p.chromium.launch_persistent_context(
-                    user_data_dir=USER_DATA_DIR,
-                    headless=False,
-                    viewport={'width': 1280, 'height': 800},
-                    channel="chrome",
-                    args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-                )
+                await context.close()
             except Exception:
-                context = p.chromium.launch_persistent_context(
-                    user_data_dir=USER_DATA_DIR,
-                    headless=False,
-                    viewport={'width': 1280, 'height': 800},
-                    args=['--no-sandbox', '--disable-blink-features=AutomationControlled']
-                )
+                pass
 
-            page = context.pages[0] if context.pages else context.new_page()
-            page.add_init_script("Object.defineProperty(navigator, 'webdriver', { get: () => undefined })")
 
-            print("🌍 打开达人主页...")
-            page.goto(profile_url, wait_until="domcontentloaded", timeout=30000)
-            wait_for_login_if_needed(page, context=context)
-            time.sleep(2)
+async def _wait_for_login_async(context, timeout_seconds=None):
+    """异步模式下的登录等待：只看登录 cookie，登录后所有标签页共享同一会话。"""
+    if timeout_seconds is None:
+        timeout_seconds = DEFAULT_LOGIN_WAIT_SECONDS
+
+    async def _logged_in():
+        try:
+            return _cookies_have_login(await context.cookies("https://www.xiaohongshu.com"))
+        except Exception:
+            return False
+
+    if await _logged_in():
+        return True
+    if not STRICT_LOGIN_REQUIRED:
+        return True
+    if browser_daemon.headless_requested():
+        _alert_login_expired()
+        return False
+
+    # 只在导航 / 登录接口响应后重读 cookie，另按 WATCH_SLICE_SECONDS 兜底（HttpOnly cookie 无事件）
+    changed = asyncio.Event()
 
+    def _on_response(response):
+        try:
+            if login_watcher.is_login_event(response.url, response.request.resource_type):
+                changed.set()
+        except Exception:
+            pass
+
+    try:
+        context.on("response", _on_response)
+    except Exception:
+        pass
+    print(f"🔐 未检测到登录态（web_session），将等待最多 {timeout_seconds} 秒供你扫码登录...")
+    deadline = time.time() + timeout_seconds
+    try:
+        while time.time() < deadline:
+            remaining = max(0.0, deadline - time.time())
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=min(login_watcher.WATCH_SLICE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                pass
+            changed.clear()
+            if await _logged_in():
+                print("✅ 检测到登录完成，继续执行抓取。")
+                return True
+    finally:
+        try:
+            context.remove_listener("response", _on_response)
+        except Exception:
+            pass
+    print("⚠️ 登录等待超时，继续尝试抓取（可能失败）。")
+    return False
+
+
+async def _collect_profile_links_async(page, max_items, max_idle_rounds=8, watermark=None):
+    """滚动达人主页直到收集到 max_items 条笔记链接（或连续多轮无新增 / 到达增量水位）。"""
+    links = []
+    idle_rounds = 0
+    while len(links) < max_items and idle_rounds < max_idle_rounds:
+        try:
+            hrefs = await page.evaluate(NOTE_LINKS_JS)
+        except Exception:
+            hrefs = []
+        merged = _normalize_note_links(links + list(hrefs or []))
+        if watermark is not None:
+            merged = watermark.filter(merged)
+        if len(merged) == len(links):
+            idle_rounds += 1
+        else:
             idle_rounds = 0
-            while len(results) < max_items and idle_rounds < 8:
-                note_links = _collect_note_links(page)
-                pending = [u for u in note_links if u not in visited]
-
-                if not pending:
-                    idle_rounds += 1
-                    print("↘️ 未发现新卡片，向下滚动加载更多...")
-                    try:
-                        page.mouse.wheel(0, 1800)
-                    except Exception:
-                        pass
-                    time.sleep(2)
-                    continue
+        links = merged
+        if len(links) >= max_items:
+            break
+        if watermark is not None and watermark.stopped:
+            print(f"🔖 已到达上次采集位置，跳过 {watermark.skipped} 条已采集笔记")
+            break
+        try:
+            await page.mouse.wheel(0, 1800)
+        except Exception:
+            pass
+        await asyncio.sleep(2)
+    return links[:max_items]
+
+
+async def _harvest_profile_feed_async(page, feed, max_items, idle_seconds=None):
+    """_harvest_profile_feed 的异步版本。"""
+    idle_seconds = FEED_IDLE_SECONDS if idle_seconds is None else idle_seconds
+    started = time.monotonic()
+    feed.last_page_at = started
+    while True:
+        while feed.pending:
+            response = feed.pending.pop(0)
+            try:
+                feed.ingest(await response.json())
+            except Exception as e:
+                print(f"⚠️ 笔记列表接口解析失败: {e}")
+        if feed.finished(max_items, idle_seconds):
+            break
+        try:
+            await page.evaluate(FEED_SCROLL_JS)
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    feed.summary(started)
+    return feed.video_links()[:max_items]
 
-                idle_rounds = 0
-                for note_url in pending:
-                    if len(results) >= max_items:
-                        break
-                    visited.add(note_url)
-                    print(f"\n🎬 进入笔记 ({len(results)+1}/{max_items}): {note_url}")
 
-                    sniffed = {"url": None}
+async def _extract_note_meta_async(page, source_url, sniffed, downloads, nav=None):
+    """_extract_note_meta 的异步版本：抓完元数据即把视频交给后台队列，标签页立刻释放。"""
+    note_url = page.url if page.url else source_url
+    note_id = _extract_note_id(note_url)
+    timestamp = _new_timestamp()
 
-                    def handle_response(response):
-                        try:
-                            if "video/mp4" in response.headers.get("content-type", "") or ".mp4" in response.url:
-                                if "sns-video" in response.url or "spectrum" in response.url:
-                                    if not sniffed["url"]:
-                                        sniffed["url"] = response.url
-                        except Exception:
-                            pass
-
-                    page.on("response", handle_response)
-                    try:
-                        clicked = _click_note_card(page, note_url)
-                        if clicked:
-                            print("🖱️ 已模拟点击卡片进入详情页。")
-                            time.sleep(2)
-                        else:
-                            print("⚠️ 卡片点击失败，降级为同会话直达详情页。")
-                            try:
-                                page.goto(note_url, wait_until="domcontentloaded", timeout=30000)
-                            except Exception:
-                                page.goto(note_url, wait_until="load", timeout=45000)
-
-                        wait_for_login_if_needed(page, context=context)
-                        json_path = _extract_note_meta(page, note_url, sniffed["url"])
-                        results.append(json_path)
-                        print(f"✅ 当前笔记采集完成: {os.path.basename(json_path)}")
-                    except Exception as e:
-                        print(f"❌ 当前笔记采集失败: {e}")
-                    finally:
-                        try:
-                            page.remove_listener("response", handle_response)
-                        except Exception:
-                            pass
+    ready = await _wait_for_note_ready_async(page, sniffed)
 
-                    # 模拟真实用户返回达人主页
-                    try:
-                        page.go_back(wait_until="domcontentloaded", timeout=15000)
-                    except Exception:
-                        page.goto(profile_url, wait_until="domcontentloaded", timeout=30000)
-                    time.sleep(random.uniform(1.0, 2.2))
+    try:
+        payload = await page.evaluate(NOTE_EXTRACT_JS, note_id)
+    except Exception as e:
+        print(f"⚠️ [{note_id}] 页面字段抽取失败: {e}")
+        payload = {}
+    fields = _parse_note_payload(payload, sniffed.get("url"))
+    stats = fields["stats"]
+    print(f"📊 [{note_id}] 赞({stats['likes']}) 藏({stats['collects']}) 评({stats['comments']}) [来源: {fields['source']}]")
+    _report_rate(source_url, page, fields, nav)
+
+    if not fields["video_url"]:
+        raise Exception("❌ 未能找到有效的视频地址")
 
-            print(f"\n🎉 达人主页采集结束，成功 {len(results)} 条。")
-            return results
-        finally:
-            if context:
+    meta_data = _build_note_meta(note_id, note_url or source_url, fields, None, timestamp, ready)
+    # submit 在队列满时会阻塞，放到线程里避免卡住事件循环
+    return await asyncio.to_thread(downloads.submit, meta_data, fields["video_url"])
+
+
+async def _scrape_note_in_tab(context, note_url, downloads, route_stats=None):
+    """在独立标签页中抓取单条笔记，标签页自带请求拦截与视频流嗅探。"""
+    page = await context.new_page()
+    await page.add_init_script(WEBDRIVER_INIT_SCRIPT)
+    sniffed = {"url": None}
+    policy = await route_policy.RoutePolicy(sniffed, log=lambda *_: None).install_async(page)
+    nav = {}
+    try:
+        try:
+            response = await page.goto(note_url, wait_until="domcontentloaded", timeout=30000)
+        except Exception:
+            response = await page.goto(note_url, wait_until="load", timeout=45000)
+        nav["status"] = response.status if response else None
+        return await _extract_note_meta_async(page, note_url, sniffed, downloads, nav)
+    finally:
+        _report_rate(note_url, page, nav=nav)
+        if route_stats is not None:
+            route_stats.append(policy.summary())
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+
+async def _gather_bounded(items, worker, concurrency):
+    """以最多 concurrency 个并发执行 worker(item)，按输入顺序返回结果（异常原样返回）。"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(item):
+        async with semaphore:
+            return await worker(item)
+
+    return await asyncio.gather(*[_run(item) for item in items], return_exceptions=True)
+
+
+async def run_profile_scraper_async(profile_url, max_items=10, concurrency=3, downloads=None, discovery=None,
+                                    incremental=None):
+    """达人主页并发模式：同一持久化会话内同时打开 concurrency 个笔记标签页。"""
+    discovery = (discovery or PROFILE_DISCOVERY).lower()
+    print(f"🚀 [Step 1] 达人主页并发模式: {profile_url}")
+    print(f"🎯 目标采集条数: {max_items}，并发标签页: {concurrency}")
+
+    own_queue = downloads is None
+    if own_queue:
+        downloads = DownloadQueue()
+    submitted = []
+    watermark = _crawl_watermark(profile_url, incremental)
+    feed = ProfileFeedCollector(watermark) if discovery == "feed" else None
+    route_stats = []
+    async with async_playwright() as p, _browser_session_async(p) as (context, page):
+        await page.add_init_script(WEBDRIVER_INIT_SCRIPT)
+        policy = await route_policy.RoutePolicy(log=lambda *_: None).install_async(page)
+        if feed is not None:
+            page.on("response", feed.handle_response)
+
+        print("🌍 打开达人主页...")
+        await page.goto(profile_url, wait_until="domcontentloaded", timeout=30000)
+        if not await _wait_for_login_async(context):
+            _report_rate(profile_url, page, nav={"logged_in": False})
+
+        note_links = []
+        up_to_date = False
+        if feed is not None:
+            note_links = await _harvest_profile_feed_async(page, feed, max_items)
+            page.remove_listener("response", feed.handle_response)
+            up_to_date = not note_links and watermark is not None and watermark.stopped
+            if up_to_date:
+                print("🔖 没有新笔记，跳过该达人。")
+            elif not note_links:
+                print("⚠️ 未从接口拿到视频笔记，回退为滚动读取卡片。")
+        if not note_links and not up_to_date:
+            await asyncio.sleep(2)
+            note_links = await _collect_profile_links_async(page, max_items, watermark=watermark)
+        print(f"📋 发现 {len(note_links)} 条笔记，开始并发采集...")
+
+        limiter = _active_limiter()
+
+        async def _worker(note_url):
+            # 令牌桶按域名错开各标签页的打开时间，并随风控信号自适应快慢
+            await limiter.acquire_async(note_url)
+            print(f"\n🎬 打开笔记标签页: {note_url}")
+            return await _scrape_note_in_tab(context, note_url, downloads, route_stats)
+
+        outcomes = await _gather_bounded(note_links, _worker, concurrency)
+        for note_url, outcome in zip(note_links, outcomes):
+            if isinstance(outcome, BaseException):
+                print(f"❌ 笔记采集失败 ({note_url}): {outcome}")
+            else:
+                submitted.append((note_url, outcome))
+        route_stats.append(policy.summary())
+        route_policy.report_summary(route_policy.merge_summaries(route_stats), "达人主页采集")
+
+    _track_crawl_progress(profile_url, submitted)
+    return await asyncio.to_thread(_finish_profile_downloads, submitted, downloads, own_queue)
+
+
+# ==========================================
+# 👇 数据刷新模式：只更新已采集笔记的点赞/收藏/评论数
+# ==========================================
+
+
+def _update_note_stats(cache, entry, stats):
+    """只合并 meta 的 stats 字段（视频、文字稿等其余内容不动），返回是否有变化。"""
+    with open(entry["meta_path"], "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    old = meta.get("stats") or {}
+    merged = dict(old)
+    merged.update({k: str(v) for k, v in stats.items() if v not in (None, "")})
+    cache.refresh_meta(entry, {"stats": merged, "stats_refreshed_at": int(time.time())})
+    return merged != old
+
+
+def _stats_targets(cache, note_ids=None, profile_url=None):
+    """待刷新的笔记 [(note_id, entry, note_url)]：指定 id > 指定达人的已采集笔记 > 全部缓存笔记。"""
+    entries = cache.entries()
+    if note_ids is None and profile_url:
+        note_ids = crawl_state.get_state(WORK_DIR).entry(profile_url).get("known") or []
+    ids = list(entries) if note_ids is None else [n for n in note_ids if n in entries]
+    targets = []
+    for note_id in ids:
+        entry = entries[note_id]
+        try:
+            with open(entry["meta_path"], "r", encoding="utf-8") as f:
+                note_url = json.load(f).get("url")
+        except (OSError, ValueError):
+            continue
+        if note_url:
+            targets.append((note_id, entry, note_url))
+    return targets
+
+
+async def _refresh_note_in_tab(context, note_id, note_url):
+    """轻量打开笔记页：拦截视频流与图片，DOM 就绪即取数，返回解析后的字段。"""
+    page = await context.new_page()
+    await page.add_init_script(WEBDRIVER_INIT_SCRIPT)
+    await route_policy.RoutePolicy(block=True, abort_video=True, log=lambda *_: None).install_async(page)
+    nav = {}
+    fields = None
+    try:
+        response = await page.goto(note_url, wait_until="domcontentloaded", timeout=30000)
+        nav["status"] = response.status if response else None
+        try:
+            await page.wait_for_function(NOTE_DOM_READY_JS, timeout=int(STATS_READY_TIMEOUT * 1000), polling=100)
+        except Exception:
+            pass
+        fields = _parse_note_payload(await page.evaluate(NOTE_EXTRACT_JS, note_id))
+        return fields
+    finally:
+        _report_rate(note_url, page, fields, nav)
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+
+async def _refresh_from_feed(page, profile_url, cache):
+    """从达人 user_posted 接口读点赞数（接口不含收藏/评论），更新缓存中的笔记。"""
+    feed = ProfileFeedCollector()
+    page.on("response", feed.handle_response)
+    try:
+        print(f"📡 读取达人笔记列表: {profile_url}")
+        await page.goto(profile_url, wait_until="domcontentloaded", timeout=30000)
+        await _harvest_profile_feed_async(page, feed, STATS_FEED_MAX_ITEMS)
+    finally:
+        page.remove_listener("response", feed.handle_response)
+    refreshed = changed = 0
+    for note_id, note in feed.notes.items():
+        entry = cache.lookup(note_id)
+        if entry is None:
+            continue
+        refreshed += 1
+        changed += _update_note_stats(cache, entry, {"likes": note.get("likes")})
+    return refreshed, changed
+
+
+async def run_stats_refresh_async(note_ids=None, profile_url=None, source="note", concurrency=None):
+    """数据刷新模式：source="note" 并发回访已采集笔记取完整互动数；source="feed" 只读达人接口的点赞数。
+
+    只改写 meta 的 stats / stats_refreshed_at，不下载视频、不动文字稿。返回 {"refreshed", "changed", "failed"}。
+    """
+    concurrency = concurrency or STATS_REFRESH_CONCURRENCY
+    cache = media_cache.get_cache(WORK_DIR)
+    summary = {"refreshed": 0, "changed": 0, "failed": 0}
+    async with async_playwright() as p, _browser_session_async(p) as (context, page):
+        await page.add_init_script(WEBDRIVER_INIT_SCRIPT)
+        if not await _wait_for_login_async(context):
+            # 未登录时回访只会拿到登录墙，逐条失败还会拖慢限速器；直接结束
+            print("❌ [数据刷新] 未登录，已中止。请先运行 python login_tool.py 登录后重试。")
+            return summary
+
+        if source == "feed":
+            await route_policy.RoutePolicy(block=True, abort_video=True, log=lambda *_: None).install_async(page)
+            profiles = [profile_url] if profile_url else crawl_state.get_state(WORK_DIR).profile_urls()
+            print(f"🔄 [数据刷新] 接口模式，达人 {len(profiles)} 个")
+            for url in profiles:
+                await _active_limiter().acquire_async(url)
                 try:
-                    context.close()
-                except Exception:
-                    pass
+                    refreshed, changed = await _refresh_from_feed(page, url, cache)
+                    summary["refreshed"] += refreshed
+                    summary["changed"] += changed
+                except Exception as e:
+                    print(f"❌ 达人数据刷新失败 ({url}): {e}")
+                    summary["failed"] += 1
+        else:
+            targets = _stats_targets(cache, note_ids, profile_url)
+            print(f"🔄 [数据刷新] 笔记模式，共 {len(targets)} 条，并发标签页: {concurrency}")
+            limiter = _active_limiter()
+
+            async def _worker(target):
+                note_id, entry, note_url = target
+                await limiter.acquire_async(note_url)
+                fields = await _refresh_note_in_tab(context, note_id, note_url)
+                # 页面没渲染出互动数据（登录墙等）时不覆盖旧数据
+                if _rate_outcome(fields=fields) != "ok":
+                    raise Exception("未取到互动数据")
+                return _update_note_stats(cache, entry, fields["stats"])
+
+            outcomes = await _gather_bounded(targets, _worker, concurrency)
+            for (note_id, _, _), outcome in zip(targets, outcomes):
+                if isinstance(outcome, BaseException):
+                    print(f"⚠️ {note_id} 刷新失败: {outcome}")
+                    summary["failed"] += 1
+                else:
+                    summary["refreshed"] += 1
+                    summary["changed"] += bool(outcome)
+
+    print(f"✅ [数据刷新] 完成 {summary['refreshed']} 条，数据有变化 {summary['changed']} 条，失败 {summary['failed']} 条")
+    return summary
+
+
+def run_stats_refresh(note_ids=None, profile_url=None, source="note", concurrency=None):
+    return asyncio.run(run_stats_refresh_async(note_ids, profile_url, source, concurrency))
 
 
 if __name__ == "__main__":
@@ -674,18 +1889,60 @@ if __name__ == "__main__":
         "--max-items", type=int, default=int(os.getenv("PROFILE_MAX_ITEMS", "10")),
         help="达人主页模式下最大采集条数（默认: 10）"
     )
+    parser.add_argument(
+        "--concurrency", type=int, default=None,
+        help="达人主页模式下同时打开的笔记标签页数（默认: --account 账号的并发配置，否则 PROFILE_CONCURRENCY=1，即串行点击模式）"
+    )
+    parser.add_argument(
+        "--discovery", choices=["feed", "scroll"], default=PROFILE_DISCOVERY,
+        help="达人主页笔记发现方式：feed=解析 user_posted 接口分页（默认），scroll=滚动读取卡片"
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="达人主页模式下忽略增量水位，从头重新采集（默认只采集上次之后的新笔记）"
+    )
+    parser.add_argument(
+        "--account", type=str, default=None,
+        help="使用账号池中的指定账号（见 login_tool.py --list），使用其浏览器记忆、限速与并发配置"
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="无界面运行（复用已保存的登录态；登录失效时告警而不是等待扫码），等同 SCRAPE_HEADLESS=1"
+    )
+    parser.add_argument(
+        "--refresh-stats", nargs="?", const="note", choices=["note", "feed"], default=None,
+        help="只刷新已采集笔记的互动数据：note=并发回访笔记页（默认），feed=读达人接口点赞数；配合 --url 可限定单个达人/笔记"
+    )
     args = parser.parse_args()
+    if args.headless:
+        os.environ["SCRAPE_HEADLESS"] = "1"
+
+    if args.refresh_stats:
+        note_ids = None
+        profile_url = None
+        if args.url and is_profile_url(args.url):
+            profile_url = args.url
+        elif args.url:
+            note_ids = [_extract_note_id(args.url)]
+        # 未指定时为 None，由 run_stats_refresh_async 取 STATS_REFRESH_CONCURRENCY；显式 1 即串行
+        run_stats_refresh(note_ids, profile_url, source=args.refresh_stats, concurrency=args.concurrency)
+        sys.exit(0)
 
     if not args.url:
         print("用法: python step1_scraper.py --url <视频URL>")
         print("      python step1_scraper.py --url <达人主页URL> --max-items 20")
+        print("      python step1_scraper.py --url <达人主页URL> --max-items 50 --concurrency 4")
+        print("      python step1_scraper.py --refresh-stats [--url <达人主页URL>]")
         sys.exit(1)
 
     if not validate_url(args.url):
         print(f"❌ 无效 URL（仅支持 http/https）: {args.url}")
         sys.exit(1)
 
-    if is_profile_url(args.url):
-        run_profile_scraper(args.url, max_items=args.max_items)
-    else:
-        run_scraper(args.url)
+    lease = account_pool.get_pool().lease(name=args.account) if args.account else contextlib.nullcontext()
+    with lease:
+        if is_profile_url(args.url):
+            run_profile_scraper(args.url, max_items=args.max_items, concurrency=args.concurrency,
+                                discovery=args.discovery, incremental=False if args.full else None)
+        else:
+            run_scraper(args.url)
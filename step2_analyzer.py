@@ -2,17 +2,25 @@ import os
 import sys
 import json
 import argparse
+import asyncio
 import warnings
 import cv2
-import requests
 import base64
 import re
 import glob
 import time
 import traceback
+import contextlib
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
+import llm_cache
+import llm_transport
+import provider_health
+from http_pool import get_session
+from stage_graph import StageGraph
 from utils import (
     PROJECT_ROOT, WORK_DIR, env_clean, parse_number, make_logger,
     check_env_security,
@@ -26,6 +34,14 @@ except ImportError:
 # 忽略警告
 warnings.filterwarnings("ignore")
 
+# 并行分析（--workers）：默认进程数，以及同时进行的字幕提取（ASR/OCR）任务数——模型吃内存，默认只允许 1 个
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "1") or 1)
+ASR_CONCURRENCY = int(os.getenv("ASR_CONCURRENCY", "1") or 1)
+# 单条视频内部的阶段并行度：封面、抽帧、字幕提取互不依赖，可同时进行（1 = 原有串行顺序）
+ANALYSIS_STAGE_WORKERS = int(os.getenv("ANALYSIS_STAGE_WORKERS", "3") or 3)
+# 进程池 worker 中由 _init_worker 设置为跨进程信号量；串行模式下为 None（不限制）
+_asr_slots = None
+
 
 # 🔥 引入 JSON 修复库
 try:
@@ -52,44 +68,44 @@ if anthropic and anthropic_api_key:
 # 👇 Persona 动态加载（支持自定义）
 # ==========================================
 _DEFAULT_PERSONA = {
-    “name”: “Angel”,
-    “identity”: “前游戏行业打工人，现役环球流浪者（目前进度：23/197）。无足鸟文旅创始人。”,
-    “image”: “粉色头发，外表不好惹，内心极度真诚的 Solo Traveler。”,
-    “equipment”: “Sony A7C2, DJI Mini 3 Pro, Insta360 Ace Pro 2。主打自然光。”,
-    “analysis_perspective”: [
-        “我是”流量猎人”。我不看热闹，我看门道。”,
-        “封面是门面（决定点击），内容是陷阱（决定停留），变现是目的（决定价值）。”,
+    "name": "Angel",
+    "identity": "前游戏行业打工人，现役环球流浪者（目前进度：23/197）。无足鸟文旅创始人。",
+    "image": "粉色头发，外表不好惹，内心极度真诚的 Solo Traveler。",
+    "equipment": "Sony A7C2, DJI Mini 3 Pro, Insta360 Ace Pro 2。主打自然光。",
+    "analysis_perspective": [
+        "我是“流量猎人”。我不看热闹，我看门道。",
+        "封面是门面（决定点击），内容是陷阱（决定停留），变现是目的（决定价值）。",
     ],
-    “thinking_model”: [
-        “把热评当用户访谈：情绪共振>信息获取。”,
-        “把平台行为当数据：点赞=认同，收藏=有用，转发=社交货币。”,
-        “只要大概率不能复刻的（靠脸/靠运气/靠不可抗力），一律判为 C 级，不浪费时间。”,
+    "thinking_model": [
+        "把热评当用户访谈：情绪共振>信息获取。",
+        "把平台行为当数据：点赞=认同，收藏=有用，转发=社交货币。",
+        "只要大概率不能复刻的（靠脸/靠运气/靠不可抗力），一律判为 C 级，不浪费时间。",
     ],
-    “language”: “简体中文”,
+    "language": "简体中文",
 }
 
 
 def load_persona():
-    “””Load persona from persona.json (or PERSONA_FILE env var). Falls back to built-in default.”””
-    persona_path = env_clean(“PERSONA_FILE”, os.path.join(PROJECT_ROOT, “persona.json”))
+    """Load persona from persona.json (or PERSONA_FILE env var). Falls back to built-in default."""
+    persona_path = env_clean("PERSONA_FILE", os.path.join(PROJECT_ROOT, "persona.json"))
     if persona_path and os.path.exists(persona_path):
         try:
-            with open(persona_path, “r”, encoding=”utf-8”) as f:
+            with open(persona_path, "r", encoding="utf-8") as f:
                 persona = json.load(f)
-            print(f”✅ 已加载 Persona 配置: {persona.get('name', 'Unknown')} ({persona_path})”)
+            print(f"✅ 已加载 Persona 配置: {persona.get('name', 'Unknown')} ({persona_path})")
             return persona
         except Exception as e:
-            print(f”⚠️ Persona 配置加载失败 ({e})，使用内置默认值。”)
+            print(f"⚠️ Persona 配置加载失败 ({e})，使用内置默认值。")
     return _DEFAULT_PERSONA
 
 
 def build_persona_text(persona):
-    “””Convert persona dict to the prompt text block.”””
-    name = persona.get(“name”, “Analyst”)
-    perspectives = “\n”.join(persona.get(“analysis_perspective”, []))
-    thinking = “\n”.join(f”{i+1}. {t}” for i, t in enumerate(persona.get(“thinking_model”, [])))
-    lang = persona.get(“language”, “简体中文”)
-    return f”””
+    """Convert persona dict to the prompt text block."""
+    name = persona.get("name", "Analyst")
+    perspectives = "\n".join(persona.get("analysis_perspective", []))
+    thinking = "\n".join(f"{i+1}. {t}" for i, t in enumerate(persona.get("thinking_model", [])))
+    lang = persona.get("language", "简体中文")
+    return f"""
 【我是谁】：{name}，{persona.get('identity', '')}
 【核心形象】：{persona.get('image', '')}
 【拍摄装备】：{persona.get('equipment', '')}
@@ -98,11 +114,11 @@ def build_persona_text(persona):
 【思维模型】：
 {thinking}
 【语言要求】：所有输出必须使用【{lang}】。
-“””
+"""
 
 
 PERSONA = load_persona()
-PERSONA_NAME = PERSONA.get(“name”, “Analyst”)
+PERSONA_NAME = PERSONA.get("name", "Analyst")
 MY_PERSONA = build_persona_text(PERSONA)
 
 # ==========================================
@@ -263,7 +279,7 @@ def upload_to_imgbb(image_path, log=None):
         return None
     try:
         with open(image_path, "rb") as file:
-            res = requests.post("https://api.imgbb.com/1/upload", data={"key": api_key}, files={"image": file}, timeout=30)
+            res = get_session().post("https://api.imgbb.com/1/upload", data={"key": api_key}, files={"image": file}, timeout=30)
             data = res.json()
             if data.get('success'):
                 return data['data']['url']
@@ -278,9 +294,10 @@ def download_cover_image(url, save_dir, log=None):
     if not url:
         return None
     try:
-        response = requests.get(url, timeout=20)
+        response = get_session().get(url, timeout=20)
         if response.status_code == 200:
-            filename = f"cover_{int(datetime.now().timestamp())}.jpg"
+            # 并行分析时多个进程可能同一秒下载封面，文件名带上进程号
+            filename = f"cover_{int(datetime.now().timestamp())}_{os.getpid()}.jpg"
             path = os.path.join(save_dir, filename)
             image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
             img = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
@@ -308,6 +325,7 @@ def extract_visuals(video_path, log=None):
         log("👁️ [Vision] 正在进行智能分镜分析...")
     image_urls = []
     duration_str = "00:00"
+    frame_prefix = os.path.splitext(os.path.basename(video_path or ""))[0] or "video"
     try:
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS)
@@ -331,7 +349,7 @@ def extract_visuals(video_path, log=None):
             if prev_hist is None or cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > 0.4:
                 is_new = True
             if is_new:
-                path = f"workspace_data/frame_{saved_count}.jpg"
+                path = os.path.join(WORK_DIR, f"frame_{frame_prefix}_{saved_count}.jpg")
                 cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, 60])
                 link = upload_to_imgbb(path, log=log)
                 if link:
@@ -366,12 +384,13 @@ def _extract_content_text(content):
     return str(content)
 
 
-def call_anthropic_model(messages_content, model_name, log=None):
+async def call_anthropic_model_async(messages_content, model_name, log=None):
     if not client_claude:
         raise RuntimeError("Anthropic 客户端不可用，请检查 anthropic 包和 ANTHROPIC_API_KEY。")
     if log:
         log(f"🧠 [Brain] 使用 Anthropic 模型: {model_name}")
-    msg = client_claude.messages.create(
+    msg = await llm_transport.anthropic_messages(
+        anthropic_api_key,
         model=model_name,
         max_tokens=4096,
         messages=[{"role": "user", "content": messages_content}]
@@ -380,7 +399,11 @@ def call_anthropic_model(messages_content, model_name, log=None):
     return raw
 
 
-def call_openai_compatible_model(provider, model_name, api_key, base_url, text_prompt, cover_base64=None, log=None):
+def call_anthropic_model(messages_content, model_name, log=None):
+    return llm_transport.run(call_anthropic_model_async(messages_content, model_name, log=log))
+
+
+async def call_openai_compatible_model_async(provider, model_name, api_key, base_url, text_prompt, cover_base64=None, log=None):
     if not api_key:
         raise RuntimeError(f"{provider} 未配置 API Key。")
     if not base_url:
@@ -409,13 +432,22 @@ def call_openai_compatible_model(provider, model_name, api_key, base_url, text_p
     if log:
         log(f"🧠 [Brain] 使用 {provider} 模型: {model_name}")
 
+    health = provider_health.get_health()
     with_image = bool(cover_base64)
+    image_error = None
+    if with_image and health.accepts_images(provider, model_name) is False:
+        # 已知该模型不接受图片：直接发纯文本，省掉一次必然失败的请求
+        with_image = False
+        if log:
+            log(f"🖼️ {provider}/{model_name} 已知不支持图片输入，直接使用纯文本。")
     for attempt in range(2):
         payload = _build_payload(with_image=with_image)
-        response = requests.post(endpoint, headers=headers, json=payload, timeout=300)
+        # 连接池与每个 provider 的并发上限由 llm_transport 统一管理
+        response = await llm_transport.post_json(provider, endpoint, headers, payload, timeout=300)
         if response.status_code >= 400:
             msg = response.text[:500]
             if with_image and attempt == 0:
+                image_error = response.status_code
                 if log:
                     log(f"⚠️ {provider} 图像输入失败，自动降级为文本重试: {response.status_code} {msg}")
                 with_image = False
@@ -428,23 +460,34 @@ def call_openai_compatible_model(provider, model_name, api_key, base_url, text_p
             raise RuntimeError(f"{provider} API 返回无 choices: {data}")
         raw = _extract_content_text(choices[0].get("message", {}).get("content", ""))
         if raw:
+            if cover_base64 and with_image:
+                await asyncio.to_thread(health.set_image_support, provider, model_name, True)
+            elif image_error in provider_health.IMAGE_REJECT_STATUSES:
+                # 只有请求格式类错误才说明不支持图片；429/5xx 只是临时故障，不记录
+                await asyncio.to_thread(health.set_image_support, provider, model_name, False)
             return raw
         raise RuntimeError(f"{provider} API 返回内容为空: {data}")
 
     raise RuntimeError(f"{provider} 调用失败。")
 
+
+def call_openai_compatible_model(provider, model_name, api_key, base_url, text_prompt, cover_base64=None, log=None):
+    return llm_transport.run(call_openai_compatible_model_async(
+        provider, model_name, api_key, base_url, text_prompt, cover_base64=cover_base64, log=log
+    ))
+
 # ==========================================
 # 👇 核心分析逻辑 (Prompt 完全恢复不删减)
 # ==========================================
 
-def _invoke_provider(provider, cfg, messages_content, text_prompt, cover_base64, log=None):
+async def _invoke_provider(provider, cfg, messages_content, text_prompt, cover_base64, log=None):
     if provider == "anthropic":
-        return call_anthropic_model(
+        return await call_anthropic_model_async(
             messages_content=messages_content,
             model_name=cfg["model"],
             log=log,
         )
-    return call_openai_compatible_model(
+    return await call_openai_compatible_model_async(
         provider=provider,
         model_name=cfg["model"],
         api_key=cfg["api_key"],
@@ -456,6 +499,12 @@ def _invoke_provider(provider, cfg, messages_content, text_prompt, cover_base64,
 
 
 def analyze_content(meta, transcript, cover_base64=None, log=None):
+    """同步入口：在 llm_transport 的后台事件循环上执行 analyze_content_async。"""
+    return llm_transport.run(analyze_content_async(meta, transcript, cover_base64, log=log))
+
+
+async def analyze_content_async(meta, transcript, cover_base64=None, log=None):
+    """异步分析：积压批量处理时可 asyncio.gather 多条，并发上限见 llm_transport（LLM_CONCURRENCY）。"""
     if log:
         log("🧠 [Brain] 开始调用大模型做内容分析...")
     
@@ -468,7 +517,7 @@ def analyze_content(meta, transcript, cover_base64=None, log=None):
 
     messages_content = []
     
-    text_prompt = f”””
+    text_prompt = f"""
     【角色设定】
     你是 {PERSONA_NAME} 的首席内容参谋。请基于【{PERSONA_NAME} 独家爆款方法论】对视频进行全维度拆解。
 
@@ -563,7 +612,8 @@ def analyze_content(meta, transcript, cover_base64=None, log=None):
     
     allow_local_fallback = os.getenv("ALLOW_LOCAL_FALLBACK", "1") != "0"
     try:
-        provider_chain = build_provider_chain()
+        health = await asyncio.to_thread(provider_health.get_health)
+        provider_chain = health.order(build_provider_chain())
         if log:
             log(f"🧭 provider 尝试顺序: {provider_chain}")
 
@@ -571,7 +621,9 @@ def analyze_content(meta, transcript, cover_base64=None, log=None):
         used_provider = None
         used_model = None
         raw = None
+        hit = None
 
+        candidates = []
         for provider in provider_chain:
             provider, cfg = get_provider_config(provider)
             if not cfg:
@@ -584,21 +636,66 @@ def analyze_content(meta, transcript, cover_base64=None, log=None):
                 if log:
                     log("⚠️ 跳过 anthropic：客户端不可用或未配置 key。")
                 continue
+            candidates.append((provider, cfg))
 
+        # 先查本地缓存（任一 provider 对同一输入的历史回复都可复用），命中则不发起任何网络请求
+        cache = None
+        cache_keys = {}
+        if candidates and llm_cache.cache_enabled():
+            cache_keys = {p: llm_cache.fingerprint(p, cfg.get("model"), text_prompt, cover_base64) for p, cfg in candidates}
             try:
-                raw = _invoke_provider(provider, cfg, messages_content, text_prompt, cover_base64, log=log)
-                used_provider = provider
-                used_model = cfg.get("model")
+                cache = llm_cache.get_cache()
+                hit = await asyncio.to_thread(cache.get_first, list(cache_keys.values()))
+            except Exception as e:
+                # 缓存文件被锁/损坏/不可写时按未命中处理，且本次不再写入
+                cache, cache_keys, hit = None, {}, None
+                if log:
+                    log(f"⚠️ LLM 缓存不可用，按未命中处理: {e}")
+            if hit:
+                used_provider = next(p for p, key in cache_keys.items() if key == hit[0])
+                used_model = dict(candidates)[used_provider].get("model")
+                raw = hit[1]
+                if log:
+                    log(f"💾 命中 LLM 缓存（{used_provider}/{used_model}），跳过模型调用。")
+            elif cache and log:
+                log("💾 LLM 缓存未命中，调用模型。")
+
+        skipped = []
+        for provider, cfg in candidates:
+            if raw is not None:
                 break
+            claim = health.acquire(provider)
+            if not claim:
+                skipped.append(provider)
+                if log:
+                    log(f"🔌 跳过 {provider}：熔断中（近期连续失败）。")
+                continue
+            started = time.monotonic()
+            recorded = False
+            try:
+                raw = await _invoke_provider(provider, cfg, messages_content, text_prompt, cover_base64, log=log)
+                # 记录要加文件锁并重写状态文件，放到线程里做，免得卡住共享的传输事件循环
+                recorded = True
+                await asyncio.to_thread(health.record, provider, True, time.monotonic() - started)
             except Exception as e:
+                recorded = True
+                await asyncio.to_thread(health.record, provider, False)
                 last_err = e
                 if log:
                     log(f"⚠️ {provider} 调用失败，尝试下一个 provider: {e}")
                 continue
+            finally:
+                if not recorded:
+                    # 被取消时（CancelledError 不属于 Exception）不计成败，但要归还半开试探名额
+                    health.release(provider, claim)
+            used_provider = provider
+            used_model = cfg.get("model")
 
         if raw is None:
             if last_err:
                 raise last_err
+            if skipped:
+                raise RuntimeError(f"可用 provider 均在熔断中: {skipped}（可稍后重试或删除 {provider_health.STATE_FILE}）")
             raise RuntimeError("没有可用的分析 provider（请检查 ANALYSIS_PROVIDER 和各 provider API key）。")
         
         # 🔥 使用神器修复 JSON
@@ -623,6 +720,14 @@ def analyze_content(meta, transcript, cover_base64=None, log=None):
         required_keys = ['highlights', 'structure', 'grade', 'niche']
         for k in required_keys:
             if k not in result: result[k] = "（字段缺失）"
+
+        # 只缓存能解析的回复，避免下次直接复用坏结果
+        if hit is None and cache_keys.get(used_provider):
+            try:
+                await asyncio.to_thread(cache.put, cache_keys[used_provider], raw, used_provider, used_model)
+            except Exception as e:
+                if log:
+                    log(f"⚠️ LLM 缓存写入失败: {e}")
                 
         if log:
             log("✅ 大模型分析并修复完成。")
@@ -678,12 +783,27 @@ def _srt_to_transcript(srt_path):
         return "\n".join(lines)
 
 
+def _asr_slot(log=None):
+    """并行模式下占用一个 ASR 名额（跨进程信号量），串行模式为空操作。"""
+    if _asr_slots is None:
+        return contextlib.nullcontext()
+    if log:
+        log("⏳ [Audio] 等待 ASR 名额...")
+    return _asr_slots
+
+
 def extract_transcript(video_path, log=None):
     """
     Unified transcript extraction: FunASR smart extraction → Whisper fallback.
     Returns timestamped transcript string, or None on failure.
+
+    In --workers mode at most ASR_CONCURRENCY extractions run at once across processes.
     """
-    import tempfile
+    with _asr_slot(log):
+        return _extract_transcript(video_path, log=log)
+
+
+def _extract_transcript(video_path, log=None):
 
     srt_path = video_path.rsplit(".", 1)[0] + "_transcript.srt"
 
@@ -740,7 +860,34 @@ def extract_transcript(video_path, log=None):
     return None
 
 
+def _fetch_cover(meta, log):
+    """下载封面并转 base64（供多模态模型）；返回 (cover_base64, local_cover)。不上传图床。"""
+    log("🖼️ 处理封面图中...")
+    if not meta.get('cover_url'):
+        log("⚠️ meta 中无 cover_url，跳过封面处理。")
+        return None, None
+    local_cover = download_cover_image(meta['cover_url'], WORK_DIR, log=log)
+    if not local_cover:
+        log("⚠️ 封面图下载失败，后续按无封面处理。")
+        return None, None
+    try:
+        return encode_image(local_cover), local_cover
+    except Exception as e:
+        log(f"❌ 封面图编码失败: {e}\n{traceback.format_exc()}")
+        return None, None
+
+
+def _upload_cover(meta, local_cover, log):
+    """封面上传图床，失败时退回原始 cover_url。"""
+    if not local_cover:
+        return None
+    cover_url_public = upload_to_imgbb(local_cover, log=log) or meta.get('cover_url')
+    log("✅ 封面图处理完成。")
+    return cover_url_public
+
+
 def run_single_analysis(meta_path, cleanup=False):
+    """分析单条 meta，成功返回报告路径，失败返回 None。"""
     print(f"🚀 正在分析: {meta_path}")
     with open(meta_path, 'r', encoding='utf-8') as f:
         meta = json.load(f)
@@ -757,38 +904,43 @@ def run_single_analysis(meta_path, cleanup=False):
     #     print(f"⏭️ 报告已存在，跳过: {analysis_file}")
     #     return
 
-    log("🖼️ 处理封面图中...")
-    cover_base64 = None
-    cover_url_public = None
-    if meta.get('cover_url'):
-        local_cover = download_cover_image(meta['cover_url'], WORK_DIR, log=log)
-        if local_cover:
-            try:
-                cover_base64 = encode_image(local_cover)
-                cover_url_public = upload_to_imgbb(local_cover, log=log)
-                if not cover_url_public:
-                    cover_url_public = meta['cover_url']
-                log("✅ 封面图处理完成。")
-            except Exception as e:
-                log(f"❌ 封面图编码失败: {e}\n{traceback.format_exc()}")
-        else:
-            log("⚠️ 封面图下载失败，后续按无封面处理。")
-    else:
-        log("⚠️ meta 中无 cover_url，跳过封面处理。")
+    video_path = meta['local_video_path']
 
-    log("👂 [Audio] 开始智能字幕提取...")
-    transcript = extract_transcript(meta['local_video_path'], log=log)
+    def _transcript_stage():
+        log("👂 [Audio] 开始智能字幕提取...")
+        transcript = extract_transcript(video_path, log=log)
+        if not transcript:
+            # 抛错让依赖字幕的阶段（图床上传、抽帧、模型调用）全部跳过
+            raise RuntimeError("字幕为空")
+        return transcript
+
+    # 封面下载与字幕提取并行；图床上传和抽帧等字幕成功后再做，字幕失败就不白传图。
+    # 模型调用在字幕和封面就绪后立即开始，不等抽帧
+    graph = StageGraph(max_workers=ANALYSIS_STAGE_WORKERS)
+    graph.add("cover", lambda: _fetch_cover(meta, log))
+    graph.add("transcript", _transcript_stage)
+    graph.add("cover_upload", lambda cover, transcript: _upload_cover(meta, cover[1], log),
+              deps=("cover", "transcript"))
+    graph.add("visuals", lambda transcript: extract_visuals(video_path, log=log), deps=("transcript",))
+    graph.add("analysis", lambda cover, transcript: analyze_content(meta, transcript, cover[0], log=log),
+              deps=("cover", "transcript"))
+    results = graph.run()
+    for name, error in graph.errors.items():
+        log(f"❌ 阶段 {name} 异常: {error}")
+    log("⏱️ 阶段耗时: " + ", ".join(f"{name} {sec}s" for name, sec in graph.seconds.items()))
+
+    transcript = results.get("transcript")
     if not transcript:
         log("❌ [Audio] 字幕提取完全失败，无法继续分析。")
-        return
-    
-    images, duration = extract_visuals(meta['local_video_path'], log=log)
-    
-    analysis, used_provider, used_model = analyze_content(meta, transcript, cover_base64, log=log)
-    
+        return None
+
+    cover_url_public = results.get("cover_upload")
+    images, duration = results.get("visuals") or ([], "00:00")
+    analysis, used_provider, used_model = results.get("analysis") or (None, None, None)
+
     if not analysis:
         log("❌ 分析失败。")
-        return
+        return None
 
     final_data = {
         "analysis": analysis,
@@ -801,6 +953,7 @@ def run_single_analysis(meta_path, cleanup=False):
         "model_provider": used_provider or os.getenv("ANALYSIS_PROVIDER", "anthropic"),
         "model_name": used_model,
         "debug_log_file": log_file,
+        "stage_seconds": graph.seconds,
     }
     
     try:
@@ -809,6 +962,7 @@ def run_single_analysis(meta_path, cleanup=False):
         log(f"💾 分析报告已保存: {analysis_file}")
     except Exception as e:
         log(f"❌ 保存失败: {e}\n{traceback.format_exc()}")
+        return None
 
     # Cleanup: delete video file after successful analysis
     if cleanup and meta.get('local_video_path'):
@@ -819,6 +973,106 @@ def run_single_analysis(meta_path, cleanup=False):
                 log(f"🗑️ 已清理视频文件: {video_file}")
             except Exception as e:
                 log(f"⚠️ 视频文件清理失败: {e}")
+    return analysis_file
+
+
+# ==========================================
+# 👇 并行分析（进程池）
+# ==========================================
+
+
+def _worker_log_path(log_dir, pid=None):
+    return os.path.join(log_dir, f"step2_worker_{pid or os.getpid()}.log")
+
+
+def _init_worker(asr_slots, log_dir):
+    """进程池 worker 初始化：共享 ASR 信号量，输出重定向到该 worker 自己的日志，避免多进程输出交错。"""
+    global _asr_slots
+    _asr_slots = asr_slots
+    stream = open(_worker_log_path(log_dir), "a", encoding="utf-8", buffering=1)
+    sys.stdout = stream
+    sys.stderr = stream
+
+
+def _analyze_job(meta_path, cleanup=False, log_dir=None):
+    """worker 内执行单条分析，返回用于汇总的结果字典（不抛异常）。"""
+    started = time.time()
+    result = {
+        "meta_path": meta_path,
+        "worker_log": _worker_log_path(log_dir or WORK_DIR),
+        "analysis_file": None,
+        "error": None,
+    }
+    try:
+        result["analysis_file"] = run_single_analysis(meta_path, cleanup=cleanup)
+        if not result["analysis_file"]:
+            result["error"] = "分析失败（详见日志）"
+    except Exception as e:
+        print(f"❌ 任务异常: {e}\n{traceback.format_exc()}")
+        result["error"] = str(e)
+    result["ok"] = bool(result["analysis_file"])
+    result["seconds"] = round(time.time() - started, 1)
+    return result
+
+
+def print_batch_summary(results, elapsed):
+    ok = [r for r in results if r.get("ok")]
+    failed = [r for r in results if not r.get("ok")]
+    busy = sum(r.get("seconds") or 0 for r in results)
+    speedup = busy / elapsed if elapsed > 0 else 0
+    print("\n📊 并行分析汇总")
+    print(f"   ✅ 成功 {len(ok)} 条 / ❌ 失败 {len(failed)} 条")
+    print(f"   ⏱️ 总耗时 {elapsed:.0f} 秒，单条累计 {busy:.0f} 秒（并行加速约 {speedup:.1f}x）")
+    for r in failed:
+        print(f"   ❌ {os.path.basename(r['meta_path'])}: {r.get('error')}（日志: {r.get('worker_log')}）")
+
+
+def llm_cache_counters():
+    """缓存计数快照（缓存关闭或不可用时返回 None）。"""
+    if not llm_cache.cache_enabled():
+        return None
+    try:
+        return llm_cache.get_cache().counters()
+    except Exception as e:
+        print(f"⚠️ LLM 缓存不可用: {e}")
+        return None
+
+
+def print_cache_summary(before):
+    """打印本次运行的缓存命中情况；计数存在同一个数据库里，多进程 worker 的结果也会计入。"""
+    after = llm_cache_counters()
+    if before is None or after is None:
+        return
+    delta = llm_cache.counters_delta(before, after)
+    print(f"💾 LLM 缓存: 命中 {delta['hits']} / 未命中 {delta['misses']} / "
+          f"新写入 {delta['stores']} / 淘汰 {delta['evictions']}")
+
+
+def run_batch(meta_files, workers, cleanup=False, log_dir=None):
+    """用进程池并行分析多条视频：ASR 受 ASR_CONCURRENCY 限制，其余阶段（抽帧、LLM 调用）并行。"""
+    log_dir = log_dir or WORK_DIR
+    ctx = multiprocessing.get_context()
+    asr_slots = ctx.BoundedSemaphore(max(1, ASR_CONCURRENCY))
+    print(f"⚙️ 并行分析: {workers} 个进程，ASR 并发 {max(1, ASR_CONCURRENCY)}，worker 日志: {_worker_log_path(log_dir, '<pid>')}")
+    started = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(asr_slots, log_dir)) as pool:
+        futures = {pool.submit(_analyze_job, path, cleanup, log_dir): path for path in meta_files}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                # worker 进程崩溃（如 OOM）时 future 直接抛错
+                result = {"meta_path": futures[future], "ok": False, "error": f"worker 异常退出: {e}",
+                          "seconds": 0, "worker_log": None}
+            results.append(result)
+            mark = "✅" if result["ok"] else "❌"
+            detail = f" - {result['error']}" if result.get("error") else ""
+            print(f"{mark} [{done}/{len(meta_files)}] {os.path.basename(result['meta_path'])} "
+                  f"({result['seconds']} 秒){detail}")
+    print_batch_summary(results, time.time() - started)
+    return results
 
 
 if __name__ == "__main__":
@@ -833,7 +1087,17 @@ if __name__ == "__main__":
         "--cleanup", action="store_true",
         help="分析完成后自动删除视频文件以释放磁盘空间"
     )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=ANALYSIS_WORKERS,
+        help="并行分析的进程数（默认: 1，即串行；ASR 并发数由 ASR_CONCURRENCY 控制）"
+    )
+    parser.add_argument(
+        "--no-llm-cache", action="store_true",
+        help="跳过本地 LLM 回复缓存，强制重新调用模型（等同 LLM_CACHE=0）"
+    )
     args = parser.parse_args()
+    if args.no_llm_cache:
+        os.environ["LLM_CACHE"] = "0"
 
     print("🚀 启动 [Step 2: 满血本地分析] 模式...")
     check_env_security()
@@ -843,10 +1107,14 @@ if __name__ == "__main__":
     print(f"🧠 当前 provider 配置: ANALYSIS_PROVIDER={provider}, chain={chain}")
     print(f"👤 当前 Persona: {PERSONA_NAME}")
     cfgs = get_provider_configs()
+    health = provider_health.get_health()
     for name in chain:
         cfg = cfgs.get(name, {})
         key_ok = bool(cfg.get("api_key"))
-        print(f"   - {name}: model={cfg.get('model')} key={'OK' if key_ok else 'MISSING'}")
+        print(f"   - {name}: model={cfg.get('model')} key={'OK' if key_ok else 'MISSING'} 健康: {health.describe(name)}")
+    ordered = health.order(chain)
+    if ordered != chain:
+        print(f"🩺 按 provider 健康状况调整尝试顺序: {ordered}")
 
     if args.file:
         meta_files = [args.file]
@@ -858,13 +1126,19 @@ if __name__ == "__main__":
         sys.exit()
 
     print(f"📋 发现 {len(meta_files)} 个任务...")
-    for i, json_path in enumerate(meta_files):
-        print(f"\n🎬 [任务 {i+1}/{len(meta_files)}]")
-        try:
-            run_single_analysis(json_path, cleanup=args.cleanup)
-        except Exception as e:
-            print(f"❌ 任务 {i+1} 异常: {e}")
-        time.sleep(5)
+    workers = min(max(1, args.workers), len(meta_files))
+    cache_before = llm_cache_counters()
+    if workers > 1:
+        run_batch(meta_files, workers, cleanup=args.cleanup)
+    else:
+        for i, json_path in enumerate(meta_files):
+            print(f"\n🎬 [任务 {i+1}/{len(meta_files)}]")
+            try:
+                run_single_analysis(json_path, cleanup=args.cleanup)
+            except Exception as e:
+                print(f"❌ 任务 {i+1} 异常: {e}")
+            time.sleep(5)
+    print_cache_summary(cache_before)
 
     print("\n" + "="*60)
     print("🎉 分析阶段结束！请运行: python3 step4_uploader.py 上报数据")
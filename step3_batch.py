@@ -1,13 +1,70 @@
 import sys
-import time
-import random
 import os
 import json
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import account_pool
+import browser_daemon
+import rate_limiter
 import step1_scraper as step1
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+
+def scrape_one(url, downloads):
+    """采集一条链接，返回下载 Future 列表（失败返回空列表）。"""
+    if step1.is_profile_url(url):
+        max_items = int(os.getenv("PROFILE_MAX_ITEMS", "10"))
+        lease = account_pool.current_lease()
+        concurrency = lease.concurrency if lease is not None else step1.DEFAULT_PROFILE_CONCURRENCY
+        if concurrency > 1:
+            print(f"👤 检测到达人主页链接，切换并发标签页模式（最多 {max_items} 条，并发 {concurrency}）")
+        else:
+            print(f"👤 检测到达人主页链接，切换真实点击模式（最多 {max_items} 条）")
+        futures = step1.run_profile_scraper(
+            url, max_items=max_items, concurrency=concurrency, downloads=downloads
+        )
+        if futures:
+            print(f"📤 达人主页采集完成，{len(futures)} 条视频已进入下载队列")
+            return futures
+        print(f"❌ 达人主页采集失败")
+        return []
+    # 调用单条爬虫
+    future = step1.run_scraper(url, downloads=downloads)
+    print("📤 元数据已采集，视频已进入下载队列")
+    return [future]
+
+
+def run_with_accounts(links, downloads, pool, workers):
+    """多账号并行：每个线程为一条链接租用一个空闲账号，限速与并发按账号各自计算。
+
+    返回与 links 对齐的 Future 列表（None 表示该链接未能采集）。
+    """
+    results = [None] * len(links)
+    stop = threading.Event()
+
+    def _job(index, url):
+        if stop.is_set():
+            return
+        try:
+            with pool.lease() as lease:
+                lease.limiter.acquire(url)
+                print(f"\n🎬 [任务 {index+1}/{len(links)}] 账号 {lease.name} 下载中...")
+                print(f"🔗 {url}")
+                results[index] = scrape_one(url, downloads)
+        except account_pool.NoAccountAvailable as e:
+            print(f"❌ {e}")
+            stop.set()
+        except Exception as e:
+            print(f"❌ 异常 ({url}): {e}")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="account") as executor:
+        for index, url in enumerate(links):
+            executor.submit(_job, index, url)
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Step 3: 批量下载视频与元数据"
@@ -17,9 +74,27 @@ def main():
         default=os.path.join(BASE_DIR, "urls.txt"),
         help="链接文件路径（默认: urls.txt）"
     )
+    parser.add_argument(
+        "--browser-daemon", action="store_true",
+        help="复用常驻浏览器（自动拉起 browser_daemon.py），避免每条链接重启 Chrome"
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="无界面运行（适用于无图形界面的服务器），等同 SCRAPE_HEADLESS=1"
+    )
+    parser.add_argument(
+        "--accounts", type=int, default=int(os.getenv("SCRAPE_ACCOUNTS", "0") or 0),
+        help="并行使用的账号数（来自 login_tool.py 管理的账号池，0=池中全部可用账号；只有 1 个账号时按原串行流程）"
+    )
     args = parser.parse_args()
 
     os.chdir(BASE_DIR)
+    if args.headless:
+        os.environ["SCRAPE_HEADLESS"] = "1"
+    if args.browser_daemon:
+        os.environ["BROWSER_DAEMON"] = "1"
+    if browser_daemon.daemon_requested() and not os.getenv("BROWSER_CDP_URL"):
+        browser_daemon.ensure_daemon()
     print("🚀 启动 [Step 3: 批量下载] 模式...")
     print("👉 本步骤只负责将视频和元数据保存到本地，不进行分析。")
     print(f"📁 工作目录: {BASE_DIR}")
@@ -45,41 +120,56 @@ def main():
     print("="*60)
 
     success_count = 0
+    # 视频交给后台队列下载，浏览器处理下一条链接时上一条视频仍在下载
+    downloads = step1.DownloadQueue()
+    submitted = []
+    # 按域名自适应限速：干净响应逐步提速，遇到登录墙/验证码/429/461 自动退避
+    limiter = rate_limiter.get_limiter()
+    pool = account_pool.get_pool()
+    accounts = pool.usable()
+    workers = min(len(accounts), args.accounts or len(accounts), len(links))
 
-    for i, url in enumerate(links):
-        print(f"\n🎬 [任务 {i+1}/{len(links)}] 下载中...")
-        print(f"🔗 {url}")
+    if workers > 1:
+        print(f"👥 账号池模式：{workers} 个账号并行（{', '.join(accounts)}）")
+        futures_by_link = run_with_accounts(links, downloads, pool, workers)
+        submitted = [(url, futures) for url, futures in zip(links, futures_by_link) if futures]
+    else:
+        for i, url in enumerate(links):
+            limiter.acquire(url)
+            print(f"\n🎬 [任务 {i+1}/{len(links)}] 下载中...")
+            print(f"🔗 {url}")
 
-        try:
-            if step1.is_profile_url(url):
-                max_items = int(os.getenv("PROFILE_MAX_ITEMS", "10"))
-                print(f"👤 检测到达人主页链接，切换真实点击模式（最多 {max_items} 条）")
-                json_list = step1.run_profile_scraper(url, max_items=max_items)
-                if json_list:
-                    print(f"✅ 达人主页采集成功: {len(json_list)} 条")
-                    success_count += len(json_list)
-                else:
-                    print(f"❌ 达人主页采集失败")
-            else:
-                # 调用单条爬虫
-                json_path = step1.run_scraper(url)
-                if json_path:
-                    print(f"✅ 下载成功: {os.path.basename(json_path)}")
-                    success_count += 1
-                else:
-                    print(f"❌ 下载失败")
-
-        except KeyboardInterrupt:
-            print("\n⚠️ 用户中断任务，停止批处理。")
-            break
-        except Exception as e:
-            print(f"❌ 异常: {e}")
+            try:
+                futures = scrape_one(url, downloads)
+                if futures:
+                    submitted.append((url, futures))
+            except KeyboardInterrupt:
+                print("\n⚠️ 用户中断任务，停止批处理。")
+                break
+            except Exception as e:
+                print(f"❌ 异常: {e}")
+
+    print(f"\n⏳ 等待后台下载完成（剩余 {downloads.pending()} 条）...")
+    downloads.close()
+    for url, futures in submitted:
+        paths = step1._resolve_download_outcomes([url] * len(futures), futures)
+        print(f"🔗 {url}")
+        if paths:
+            print(f"✅ 下载成功: {', '.join(os.path.basename(p) for p in paths)}")
+            success_count += len(paths)
+        else:
+            print(f"❌ 下载失败")
 
-        # 随机休息，防封号
-        if i < len(links) - 1:
-            t = random.randint(5, 12)
-            print(f"☕️ 休息 {t} 秒...")
-            time.sleep(t)
+    if workers > 1:
+        for name in accounts:
+            record = pool.profiles().get(name, {})
+            for domain, state in pool.limiter_for(name).snapshot().items():
+                print(f"⏱️ [{name}] {domain}: 当前请求间隔 {state['interval']}s（风控信号 {state['penalties']} 次）")
+            if record.get("status") != account_pool.STATUS_OK:
+                print(f"🩺 账号 {name} 状态: {record.get('status')}")
+    else:
+        for domain, state in limiter.snapshot().items():
+            print(f"⏱️ {domain}: 当前请求间隔 {state['interval']}s（风控信号 {state['penalties']} 次）")
 
     print("\n" + "="*60)
     print(f"🎉 下载阶段结束！成功: {success_count}/{len(links)}")
@@ -104,6 +104,10 @@ def main(cli_args=None):
         "--skip-upload", action="store_true",
         help="跳过 Step 4 Notion 上传"
     )
+    parser.add_argument(
+        "--browser-daemon", action="store_true",
+        help="下载阶段复用常驻浏览器（见 browser_daemon.py）"
+    )
     args = parser.parse_args(cli_args)
 
     os.chdir(BASE_DIR)
@@ -123,6 +127,8 @@ def main(cli_args=None):
 
     # 1. 批量下载
     batch_args = ["--urls-file", urls_file]
+    if args.browser_daemon:
+        batch_args.append("--browser-daemon")
     run_script(os.path.join(BASE_DIR, "step3_batch.py"), extra_args=batch_args)
 
     # 2. 批量分析
@@ -1,7 +1,13 @@
+import asyncio
+import contextlib
 import importlib.util
+import json
 import os
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import call, mock_open, patch
+from unittest.mock import AsyncMock, MagicMock, call, mock_open, patch
 
 import step5_auto_pipeline
 
@@ -21,6 +27,23 @@ extract_subtitle = load_module("extract_subtitle", "scripts/extract_subtitle.py"
 extract_subtitle_funasr = load_module("extract_subtitle_funasr", "scripts/extract_subtitle_funasr.py")
 login_tool = load_module("login_tool", "login_tool.py")
 step1_scraper = load_module("step1_scraper", "step1_scraper.py")
+browser_daemon = load_module("browser_daemon", "browser_daemon.py")
+downloader = load_module("downloader", "downloader.py")
+http_pool = load_module("http_pool", "http_pool.py")
+media_cache = load_module("media_cache", "media_cache.py")
+route_policy = load_module("route_policy", "route_policy.py")
+ytdlp_engine = load_module("ytdlp_engine", "ytdlp_engine.py")
+rate_limiter = load_module("rate_limiter", "rate_limiter.py")
+account_pool = load_module("account_pool", "account_pool.py")
+crawl_state = load_module("crawl_state", "crawl_state.py")
+download_douyin = load_module("download_douyin", "scripts/download_douyin.py")
+note_fetcher = load_module("note_fetcher", "note_fetcher.py")
+login_watcher = load_module("login_watcher", "login_watcher.py")
+stage_graph = load_module("stage_graph", "stage_graph.py")
+llm_cache = load_module("llm_cache", "llm_cache.py")
+provider_health = load_module("provider_health", "provider_health.py")
+with patch("builtins.print"):
+    step2_analyzer = load_module("step2_analyzer", "step2_analyzer.py")
 
 
 class TimestampFormatRegressionTest(unittest.TestCase):
@@ -171,6 +194,265 @@ class LoginFlowRegressionTest(unittest.TestCase):
         self.assertFalse(ok)
 
 
+class _LaunchRecorder:
+    """Fake playwright whose Chrome channel is missing, so the bundled Chromium fallback is used."""
+
+    def __init__(self):
+        self.calls = []
+        self.context = MagicMock()
+        self.chromium = self
+
+    def launch_persistent_context(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get("channel"):
+            raise RuntimeError("chrome not installed")
+        return self.context
+
+
+class DaemonFallbackRegressionTest(unittest.TestCase):
+    def _playwright(self):
+        p = _LaunchRecorder()
+        p.connect_over_cdp = MagicMock(side_effect=RuntimeError("ws handshake failed"))
+        return p
+
+    def _open(self, p, alive):
+        with patch.object(step1_scraper.browser_daemon, "resolve_endpoint", return_value="http://127.0.0.1:9222"), \
+                patch.object(step1_scraper.browser_daemon, "is_alive", return_value=alive), \
+                patch("builtins.print"):
+            with step1_scraper._browser_session(p, step1_scraper.USER_DATA_DIR):
+                pass
+
+    def test_live_daemon_that_refuses_cdp_is_reported_instead_of_relaunching_its_profile(self):
+        p = self._playwright()
+        with self.assertRaises(RuntimeError) as raised:
+            self._open(p, alive=True)
+        self.assertIn("常驻浏览器", str(raised.exception))
+        self.assertEqual(p.calls, [])
+
+    def test_dead_daemon_falls_back_to_local_launch(self):
+        p = self._playwright()
+        self._open(p, alive=False)
+        self.assertTrue(p.calls)
+
+    def test_daemon_profile_is_matched_by_absolute_path(self):
+        self.assertTrue(step1_scraper._is_daemon_profile(os.path.abspath(step1_scraper.USER_DATA_DIR)))
+        self.assertTrue(step1_scraper._is_daemon_profile(step1_scraper.browser_daemon.USER_DATA_DIR))
+        self.assertFalse(step1_scraper._is_daemon_profile("/tmp/browser_profiles/alt1"))
+
+
+class HeadlessModeRegressionTest(unittest.TestCase):
+    def setUp(self):
+        step1_scraper._login_alerted.clear()
+
+    def test_headless_launch_keeps_init_script_and_desktop_user_agent(self):
+        p = _LaunchRecorder()
+        with patch.dict(os.environ, {"SCRAPE_HEADLESS": "1"}):
+            context = step1_scraper._launch_persistent_context(p, "/tmp/profile")
+        self.assertIs(context, p.context)
+        options = p.calls[-1]
+        self.assertTrue(options["headless"])
+        self.assertNotIn("Headless", options["user_agent"])
+        self.assertEqual(options["user_data_dir"], "/tmp/profile")
+        p.context.add_init_script.assert_called_once_with(step1_scraper.WEBDRIVER_INIT_SCRIPT)
+
+        p = _LaunchRecorder()
+        with patch.dict(os.environ, {"SCRAPE_HEADLESS": "0"}):
+            step1_scraper._launch_persistent_context(p, "/tmp/profile")
+        self.assertFalse(p.calls[-1]["headless"])
+        self.assertNotIn("user_agent", p.calls[-1])
+
+    def test_headless_login_expiry_alerts_once_instead_of_waiting(self):
+        page = LoginFlowRegressionTest._WaitPage()
+        context = LoginFlowRegressionTest._FakeContext([])
+        with patch.dict(os.environ, {"SCRAPE_HEADLESS": "1"}), \
+                patch.object(step1_scraper, "STRICT_LOGIN_REQUIRED", True), \
+                patch.object(step1_scraper, "page_requires_login", return_value=False), \
+                patch.object(step1_scraper, "LOGIN_ALERT_WEBHOOK", "https://hooks.example.com/x"), \
+                patch.object(step1_scraper, "get_session") as get_session, \
+                patch("builtins.print"):
+            first = step1_scraper.wait_for_login_if_needed(page, context=context, timeout_seconds=300)
+            second = step1_scraper.wait_for_login_if_needed(page, context=context, timeout_seconds=300)
+        self.assertEqual((first, second), (False, False))
+        self.assertEqual(page.wait_calls, 0)
+        post = get_session.return_value.post
+        post.assert_called_once()
+        self.assertEqual(post.call_args.kwargs["json"]["account"], account_pool.DEFAULT_PROFILE)
+
+    def test_headless_login_still_passes_with_session_cookie(self):
+        page = LoginFlowRegressionTest._WaitPage()
+        context = LoginFlowRegressionTest._FakeContext([{"name": "web_session"}])
+        with patch.dict(os.environ, {"SCRAPE_HEADLESS": "1"}), \
+                patch.object(step1_scraper, "page_requires_login", return_value=False):
+            self.assertTrue(step1_scraper.wait_for_login_if_needed(page, context=context))
+
+    def test_headless_force_wait_does_not_alert_a_logged_in_session(self):
+        page = LoginFlowRegressionTest._WaitPage()
+        context = LoginFlowRegressionTest._FakeContext([{"name": "web_session"}])
+        with patch.dict(os.environ, {"SCRAPE_HEADLESS": "1"}), \
+                patch.object(step1_scraper, "page_requires_login", return_value=False), \
+                patch.object(step1_scraper, "_alert_login_expired") as alert:
+            self.assertTrue(step1_scraper.wait_for_login_if_needed(page, context=context, force_wait=True))
+            alert.assert_not_called()
+        with patch.dict(os.environ, {"SCRAPE_HEADLESS": "1"}), \
+                patch.object(step1_scraper, "STRICT_LOGIN_REQUIRED", False), \
+                patch.object(step1_scraper, "page_requires_login", return_value=False), \
+                patch.object(step1_scraper, "_alert_login_expired") as alert:
+            context = LoginFlowRegressionTest._FakeContext([])
+            self.assertFalse(step1_scraper.wait_for_login_if_needed(page, context=context, force_wait=True))
+            alert.assert_called_once()
+
+    def test_login_qr_falls_back_to_full_page_screenshot(self):
+        page = MagicMock()
+        page.query_selector.return_value = None
+        self.assertTrue(login_tool.save_login_qr(page, "/tmp/qr.png"))
+        page.screenshot.assert_called_once_with(path="/tmp/qr.png")
+        page.query_selector.side_effect = lambda selector: MagicMock() if selector == ".qrcode-img" else None
+        page.screenshot.reset_mock()
+        self.assertTrue(login_tool.save_login_qr(page, "/tmp/qr.png"))
+        page.screenshot.assert_not_called()
+
+
+class _WatchedPage:
+    """Fake page with the evaluate / wait_for_function surface used by login_watcher."""
+
+    def __init__(self, state, changes=True):
+        self.state = dict(state)
+        self.changes = changes
+        self.during_wait = None
+        self.handlers = {}
+        self.waits = []
+        self.content_calls = 0
+        self.url = "https://www.xiaohongshu.com/explore/abc"
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def remove_listener(self, event, _handler):
+        self.handlers.pop(event, None)
+
+    def evaluate(self, _script, _arg=None):
+        return dict(self.state)
+
+    def wait_for_function(self, _script, arg=None, polling=None, timeout=None):
+        self.waits.append((arg, polling, timeout))
+        if self.during_wait:
+            self.during_wait()
+        if not self.changes:
+            time.sleep(timeout / 1000)
+            raise login_watcher.PlaywrightTimeoutError("timeout")
+
+    def content(self):
+        self.content_calls += 1
+        return ""
+
+    def is_closed(self):
+        return False
+
+
+class _CountingContext:
+    def __init__(self, cookies):
+        self.cookies_calls = 0
+        self._cookies = cookies
+
+    def cookies(self, *_args):
+        self.cookies_calls += 1
+        return self._cookies
+
+
+class LoginWatcherRegressionTest(unittest.TestCase):
+    STATE = {"login": True, "success": False, "content": False, "cookie": False, "hint": True}
+    SIGNALS = {"login": [".login-container"], "cookies": ["web_session"]}
+
+    def test_wait_parks_on_mutation_predicate_with_last_snapshot(self):
+        page = _WatchedPage(self.STATE)
+        with login_watcher.LoginWatcher(None, page, self.SIGNALS) as watcher:
+            self.assertTrue(watcher.wait(5))
+            page.changes = False
+            self.assertFalse(watcher.wait(0.2))
+        arg, polling, timeout = page.waits[0]
+        self.assertEqual((polling, timeout), ("mutation", login_watcher.EVENT_SLICE_SECONDS * 1000))
+        self.assertLessEqual(max(w[2] for w in page.waits[1:]), 200)
+        self.assertEqual(arg["last"], self.STATE)
+        self.assertEqual(page.handlers, {})
+
+    def test_cookies_are_reread_only_after_navigation(self):
+        page = _WatchedPage(self.STATE)
+        context = _CountingContext([{"name": "web_session"}])
+        watcher = login_watcher.LoginWatcher(context, page, self.SIGNALS)
+        self.assertTrue(watcher.has_login_cookie())
+        self.assertTrue(watcher.has_login_cookie())
+        self.assertEqual(context.cookies_calls, 1)
+        page.handlers["framenavigated"](MagicMock(parent_frame=None))
+        self.assertTrue(watcher.wait(5))
+        self.assertEqual(page.waits, [])
+        watcher.has_login_cookie()
+        self.assertEqual(context.cookies_calls, 2)
+
+    def test_login_response_during_park_wakes_the_wait(self):
+        page = _WatchedPage(self.STATE, changes=False)
+        response = MagicMock(url="https://edith.xiaohongshu.com/api/sns/web/v2/login/qrcode/status")
+        # Only an HttpOnly cookie changes: the DOM predicate never resolves, the login response does.
+        page.during_wait = lambda: page.handlers["response"](response)
+        with patch.object(login_watcher, "EVENT_SLICE_SECONDS", 0.05):
+            watcher = login_watcher.LoginWatcher(None, page, self.SIGNALS)
+            started = time.monotonic()
+            self.assertTrue(watcher.wait(15))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(len(page.waits), 1)
+
+    def test_navigation_destroying_the_context_counts_as_change(self):
+        page = _WatchedPage(self.STATE)
+
+        def destroyed(*_args, **_kwargs):
+            raise RuntimeError("Execution context was destroyed, most likely because of a navigation")
+
+        page.wait_for_function = destroyed
+        self.assertTrue(login_watcher.LoginWatcher(None, page, self.SIGNALS).wait(5))
+        page.wait_for_function = MagicMock(side_effect=RuntimeError("Target page has been closed"))
+        with self.assertRaises(RuntimeError):
+            login_watcher.LoginWatcher(None, page, self.SIGNALS).wait(5)
+
+    def test_page_requires_login_uses_one_probe_instead_of_page_content(self):
+        page = _WatchedPage(self.STATE)
+        page.url = "https://www.xiaohongshu.com/explore/abc"
+        self.assertTrue(step1_scraper.page_requires_login(page))
+        page.state.update(success=True)
+        self.assertFalse(step1_scraper.page_requires_login(page))
+        self.assertEqual(page.content_calls, 0)
+
+    def test_async_login_wait_wakes_on_login_response(self):
+        class _Context:
+            def __init__(self):
+                self.logged_in = False
+                self.handler = None
+
+            def on(self, _event, handler):
+                self.handler = handler
+
+            def remove_listener(self, _event, _handler):
+                self.handler = None
+
+            async def cookies(self, *_args):
+                return [{"name": "web_session"}] if self.logged_in else []
+
+        context = _Context()
+        response = MagicMock(url="https://edith.xiaohongshu.com/api/sns/web/v2/login/qrcode/status")
+
+        async def _run():
+            def _login():
+                context.logged_in = True
+                context.handler(response)
+
+            asyncio.get_running_loop().call_later(0.05, _login)
+            return await step1_scraper._wait_for_login_async(context, timeout_seconds=30)
+
+        with patch.object(step1_scraper, "STRICT_LOGIN_REQUIRED", True), \
+                patch.dict(os.environ, {"SCRAPE_HEADLESS": "0"}), patch("builtins.print"):
+            started = asyncio.run(asyncio.wait_for(_run(), timeout=5))
+        self.assertTrue(started)
+        self.assertIsNone(context.handler)
+
+
 class ProfileModeRegressionTest(unittest.TestCase):
     def test_is_profile_url(self):
         self.assertTrue(
@@ -187,17 +469,1876 @@ class ProfileModeRegressionTest(unittest.TestCase):
         )
         self.assertEqual(step1_scraper._extract_note_id(""), "unknown")
 
-    @patch("step1_scraper.subprocess.run")
-    @patch("step1_scraper.os.path.exists", return_value=True)
-    def test_download_video_with_ytdlp_prefers_mp4_path(self, mock_exists, mock_run):
-        class _Proc:
-            returncode = 0
-            stderr = ""
-            stdout = ""
-
-        mock_run.return_value = _Proc()
-        out = step1_scraper.download_video_with_ytdlp("https://example.com/note", 123)
+    def test_download_video_with_ytdlp_uses_engine_path(self):
+        engine = MagicMock()
+        engine.download.return_value = "workspace_data/video_123.mp4"
+        with patch.object(step1_scraper.ytdlp_engine, "get_engine", return_value=engine):
+            out = step1_scraper.download_video_with_ytdlp("https://example.com/note", 123)
         self.assertTrue(out.endswith("workspace_data/video_123.mp4"))
+        engine.download.assert_called_once_with("https://example.com/note", 123)
+        self.assertIsNone(step1_scraper.download_video_with_ytdlp("file:///etc/passwd", 1))
+
+
+class ConcurrentProfileRegressionTest(unittest.TestCase):
+    def test_normalize_note_links_dedupes_and_absolutizes(self):
+        links = step1_scraper._normalize_note_links(
+            ["/explore/a1", None, "https://www.xiaohongshu.com/explore/a1", "/user/profile/x", "/explore/b2"]
+        )
+        self.assertEqual(links, [
+            "https://www.xiaohongshu.com/explore/a1",
+            "https://www.xiaohongshu.com/explore/b2",
+        ])
+
+    def test_new_timestamp_is_unique_across_threads(self):
+        import threading
+
+        stamps = []
+
+        def _grab():
+            for _ in range(200):
+                stamps.append(step1_scraper._new_timestamp())
+
+        threads = [threading.Thread(target=_grab) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(stamps), len(set(stamps)))
+
+    def test_gather_bounded_caps_in_flight_tabs(self):
+        state = {"active": 0, "peak": 0}
+
+        async def _worker(item):
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.01)
+            state["active"] -= 1
+            if item == 3:
+                raise RuntimeError("boom")
+            return item * 10
+
+        outcomes = asyncio.run(step1_scraper._gather_bounded(range(6), _worker, 2))
+        self.assertEqual(state["peak"], 2)
+        self.assertEqual(outcomes[:3], [0, 10, 20])
+        self.assertIsInstance(outcomes[3], RuntimeError)
+
+
+class _FeedResponse:
+    def __init__(self, payload, url="https://edith.xiaohongshu.com/api/sns/web/v1/user_posted?num=30"):
+        self.url = url
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class _FeedPage:
+    """Fake profile page: every scroll to the bottom delivers the next user_posted page."""
+
+    def __init__(self, collector, pages):
+        self.collector = collector
+        self.pages = list(pages)
+        self.scrolls = 0
+
+    def evaluate(self, _script):
+        self.scrolls += 1
+        if self.pages:
+            self.collector.handle_response(_FeedResponse(self.pages.pop(0)))
+
+    def wait_for_timeout(self, _ms):
+        pass
+
+
+def _feed_page(start, count, has_more, kind="video"):
+    notes = [{"note_id": f"n{i}", "xsec_token": "AB=", "type": kind,
+              "display_title": f"t{i}", "interact_info": {"liked_count": str(i)}}
+             for i in range(start, start + count)]
+    return {"code": 0, "success": True, "data": {"cursor": f"n{start + count - 1}", "has_more": has_more, "notes": notes}}
+
+
+class ProfileFeedRegressionTest(unittest.TestCase):
+    def test_parse_feed_payload_builds_tokenized_urls(self):
+        notes, cursor, has_more = step1_scraper._parse_feed_payload(_feed_page(0, 2, True))
+        self.assertEqual(notes[0]["url"], "https://www.xiaohongshu.com/explore/n0?xsec_token=AB%3D&xsec_source=pc_user")
+        self.assertEqual((notes[1]["likes"], cursor, has_more), ("1", "n1", True))
+        self.assertEqual(step1_scraper._extract_note_id(notes[0]["url"]), "n0")
+
+    def test_harvest_paginates_until_has_more_is_false(self):
+        feed = step1_scraper.ProfileFeedCollector()
+        feed.handle_response(_FeedResponse(_feed_page(0, 30, True)))
+        feed.handle_response(_FeedResponse({}, url="https://edith.xiaohongshu.com/api/other"))
+        page = _FeedPage(feed, [_feed_page(30, 30, True, kind="normal"), _feed_page(60, 5, False)])
+        with patch("builtins.print"):
+            links = step1_scraper._harvest_profile_feed(page, feed, max_items=500, idle_seconds=5)
+        self.assertEqual(feed.pages, 3)
+        self.assertEqual(len(feed.notes), 65)
+        self.assertEqual(len(links), 35)  # image notes are skipped
+        self.assertEqual(page.scrolls, 2)
+
+    def test_harvest_stops_at_max_items_and_on_idle(self):
+        feed = step1_scraper.ProfileFeedCollector()
+        feed.handle_response(_FeedResponse(_feed_page(0, 30, True)))
+        with patch("builtins.print"):
+            links = step1_scraper._harvest_profile_feed(_FeedPage(feed, []), feed, max_items=10, idle_seconds=5)
+        self.assertEqual(len(links), 10)
+
+        idle = step1_scraper.ProfileFeedCollector()
+        with patch("builtins.print"):
+            links = step1_scraper._harvest_profile_feed(_FeedPage(idle, []), idle, max_items=10, idle_seconds=0)
+        self.assertEqual((links, idle.pages), ([], 0))
+
+    def test_error_payload_stops_paging_and_reports_the_outcome(self):
+        feed = step1_scraper.ProfileFeedCollector()
+        feed.handle_response(_FeedResponse(_feed_page(0, 3, True)))
+        page = _FeedPage(feed, [{"code": 300013, "success": False, "msg": "访问频次异常"}, _feed_page(3, 3, False)])
+        with patch.object(step1_scraper, "_report_outcome") as reported, patch("builtins.print"):
+            started = time.monotonic()
+            links = step1_scraper._harvest_profile_feed(page, feed, max_items=50, idle_seconds=30)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual((len(links), feed.stop_reason, page.scrolls), (3, "rate_limited", 1))
+        reported.assert_called_once_with(step1_scraper.FEED_API_URL, "rate_limited")
+
+
+class CrawlStateRegressionTest(unittest.TestCase):
+    def test_watermark_ignores_pinned_notes_and_stops_after_a_known_streak(self):
+        watermark = crawl_state.Watermark(["p0", "k1", "k2", "k3"], stop_after=2)
+        self.assertEqual(watermark.check("p0", sticky=True), "known")
+        self.assertEqual(watermark.check("new1"), "new")
+        self.assertEqual(watermark.check("k1"), "known")
+        self.assertEqual(watermark.check("k2"), "known")
+        self.assertTrue(watermark.stopped)
+        self.assertEqual(watermark.check("k3"), "stop")
+        self.assertEqual(watermark.check("new1"), "new")
+
+        urls = [f"https://www.xiaohongshu.com/explore/{i}" for i in ("a", "k1", "b", "k2", "k3", "c")]
+        fresh = crawl_state.Watermark(["k1", "k2", "k3"], stop_after=2).filter(urls)
+        self.assertEqual([crawl_state.note_id_from_url(u) for u in fresh], ["a", "b"])
+        extra = crawl_state.Watermark([], stop_after=1, is_known=lambda note_id: note_id == "k1")
+        self.assertEqual(extra.filter(urls), urls[:1])
+
+    def test_feed_collector_stops_paging_at_known_notes(self):
+        page = _feed_page(0, 6, True)
+        page["data"]["notes"][0]["interact_info"]["sticky"] = True
+        watermark = crawl_state.Watermark(["n0", "n3", "n4"], stop_after=2)
+        feed = step1_scraper.ProfileFeedCollector(watermark)
+        feed.ingest(page)
+        self.assertEqual([n["id"] for n in feed.notes.values()], ["n1", "n2"])
+        self.assertFalse(feed.has_more)
+        self.assertTrue(feed.finished(max_items=10, idle_seconds=60))
+
+    def test_ingested_notes_are_recorded_per_profile(self):
+        from concurrent.futures import Future
+
+        profile = "https://www.xiaohongshu.com/user/profile/abc?xsec_source=pc_feed"
+        failed, ok = Future(), Future()
+        with tempfile.TemporaryDirectory() as tmp, patch.object(step1_scraper, "WORK_DIR", tmp):
+            state = crawl_state.CrawlState(tmp)
+            step1_scraper._track_crawl_progress(profile, [
+                ("https://www.xiaohongshu.com/explore/n1?xsec_token=x", failed),
+                ("https://www.xiaohongshu.com/explore/n2", ok),
+                ("https://www.xiaohongshu.com/explore/n3", "workspace_data/meta_3.json"),
+            ])
+            # 下载未全部结束前不写 last_run
+            self.assertNotIn("last_run", state.entry(profile))
+            failed.set_exception(RuntimeError("download failed"))
+            ok.set_result("workspace_data/meta_2.json")
+            entry = state.entry("https://www.xiaohongshu.com/user/profile/abc")
+        self.assertEqual(sorted(entry["known"]), ["n2", "n3"])
+        # 首条失败时，按发现顺序第一条成功的笔记才是本次最新
+        self.assertEqual((entry["newest"], entry["last_new"]), ("n2", 2))
+
+    def test_separate_state_objects_do_not_overwrite_each_other(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            first, second = crawl_state.CrawlState(tmp), crawl_state.CrawlState(tmp)
+            first.record("https://www.xiaohongshu.com/user/profile/a", ["n1"])
+            second.record("https://www.xiaohongshu.com/user/profile/b", ["n2"])
+            first.finish_run("https://www.xiaohongshu.com/user/profile/a", 1)
+            self.assertEqual(len(crawl_state.CrawlState(tmp).profile_urls()), 2)
+
+
+class _FakeRequest:
+    def __init__(self, url, resource_type):
+        self.url = url
+        self.resource_type = resource_type
+
+
+class _FakeRoute:
+    def __init__(self):
+        self.action = None
+
+    def abort(self):
+        self.action = "abort"
+
+    def continue_(self):
+        self.action = "continue"
+
+    def fallback(self):
+        self.action = "fallback"
+
+
+class _RoutePage:
+    def __init__(self):
+        self.routes = []
+
+    def route(self, pattern, handler):
+        self.routes.append((pattern, handler))
+
+    def request(self, url, resource_type):
+        """Dispatch like Playwright: the most recently registered matching route runs first."""
+        for pattern, handler in reversed(self.routes):
+            if pattern.search(url):
+                route = _FakeRoute()
+                handler(route, _FakeRequest(url, resource_type))
+                if route.action != "fallback":
+                    return route.action
+        return "network"
+
+
+class RoutePolicyRegressionTest(unittest.TestCase):
+    def _policy(self, **kwargs):
+        kwargs.setdefault("block", True)
+        kwargs.setdefault("resources", route_policy.DEFAULT_BLOCK_RESOURCES)
+        kwargs.setdefault("extra", "ads.example.com")
+        kwargs.setdefault("abort_video", True)
+        return route_policy.RoutePolicy(log=lambda *_: None, **kwargs)
+
+    def test_blocks_non_essential_requests_and_keeps_api_and_documents(self):
+        page = _RoutePage()
+        policy = self._policy().install(page)
+        self.assertEqual(page.request("https://sns-webpic-qc.xhscdn.com/abc!nd_dft", "image"), "abort")
+        self.assertEqual(page.request("https://fe-static.xhscdn.com/font.woff2", "font"), "abort")
+        self.assertEqual(page.request("https://t2.xiaohongshu.com/api/v2/collect", "xhr"), "abort")
+        self.assertEqual(page.request("https://edith.xiaohongshu.com/api/sns/web/v1/homefeed", "fetch"), "abort")
+        self.assertEqual(page.request("https://ads.example.com/x.js", "script"), "abort")
+        self.assertEqual(page.request("https://edith.xiaohongshu.com/api/sns/web/v1/user_posted?num=30", "fetch"), "network")
+        self.assertEqual(page.request("https://fe-static.xhscdn.com/app.js", "script"), "network")
+        self.assertEqual(policy.stats, {"image": 1, "font": 1, "tracker": 1, "feed": 1, "extra": 1})
+        self.assertGreater(policy.estimated_saved_bytes(), 0)
+
+    def test_video_sniffer_records_first_stream_and_aborts_it(self):
+        page = _RoutePage()
+        sniffed = {"url": None}
+        policy = self._policy().install(page)
+        policy.track(sniffed)
+        self.assertEqual(page.request("https://sns-video-bd.xhscdn.com/stream/1.mp4", "media"), "abort")
+        page.request("https://sns-video-bd.xhscdn.com/stream/2.mp4", "media")
+        self.assertEqual(sniffed["url"], "https://sns-video-bd.xhscdn.com/stream/1.mp4")
+        # Non-stream hits on the video host fall through to the blocking route.
+        self.assertEqual(page.request("https://sns-video-bd.xhscdn.com/cover.jpg", "image"), "abort")
+        self.assertEqual(policy.stats["video"], 2)
+
+        fresh = policy.track({"url": None})
+        page.request("https://sns-video-bd.xhscdn.com/stream/3.mp4", "media")
+        self.assertTrue(fresh["url"].endswith("3.mp4"))
+
+    def test_blocking_disabled_keeps_only_the_sniffer(self):
+        page = _RoutePage()
+        sniffed = {"url": None}
+        self._policy(sniffed=sniffed, block=False, abort_video=False).install(page)
+        self.assertEqual(len(page.routes), 1)
+        self.assertEqual(page.request("https://sns-webpic-qc.xhscdn.com/abc", "image"), "network")
+        self.assertEqual(page.request("https://sns-video-bd.xhscdn.com/s.mp4", "media"), "network")
+        self.assertIsNotNone(sniffed["url"])
+
+    def test_merge_summaries_adds_tab_counts(self):
+        total = route_policy.merge_summaries([
+            {"blocked": {"image": 2}, "blocked_total": 2, "estimated_saved_bytes": 10},
+            {"blocked": {"image": 1, "font": 1}, "blocked_total": 2, "estimated_saved_bytes": 5},
+        ])
+        self.assertEqual(total, {"blocked": {"image": 3, "font": 1}, "blocked_total": 4, "estimated_saved_bytes": 15})
+
+
+class _FakeYoutubeDL:
+    instances = 0
+
+    def __init__(self, params):
+        type(self).instances += 1
+        # Like yt-dlp, keep output templates as a dict keyed by type
+        self.params = dict(params, outtmpl={"default": params["outtmpl"]})
+        self.calls = []
+
+    def extract_info(self, url, download=True):
+        self.calls.append(url)
+        if "broken" in url:
+            raise RuntimeError("unsupported url")
+        vid = url.rsplit("/", 1)[-1]
+        # yt-dlp merges into mp4 and reports the final file in requested_downloads
+        path = self.params["outtmpl"]["default"].replace("%(id)s", vid).replace("%(ext)s", "mp4")
+        with open(path, "wb") as f:
+            f.write(b"video")
+        return {"id": vid, "ext": "webm", "requested_downloads": [{"filepath": path}]}
+
+
+class YtdlpEngineRegressionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        _FakeYoutubeDL.instances = 0
+        patcher = patch.object(ytdlp_engine, "yt_dlp", MagicMock(YoutubeDL=_FakeYoutubeDL))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_reuses_one_instance_and_names_files_from_info(self):
+        engine = ytdlp_engine.YtdlpEngine(self.tmp.name, log=lambda *_: None)
+        results = engine.download_batch([("https://x/a1", 1), ("https://x/broken", 2), ("https://x/b2", 3)])
+        results += engine.download_batch([("https://x/c3", 4)])
+        self.assertEqual(_FakeYoutubeDL.instances, 1)
+        self.assertEqual(results[0], os.path.join(self.tmp.name, "video_1.mp4"))
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertTrue(os.path.exists(results[3]))
+        self.assertFalse(any(f.startswith("ytdlp_") for f in os.listdir(self.tmp.name)))
+
+    def test_concurrent_submissions_are_grouped_into_one_batch(self):
+        engine = ytdlp_engine.YtdlpEngine(self.tmp.name, batch_window=0.5, batch_size=3, log=lambda *_: None)
+        batches = []
+        real_batch = engine.download_batch
+        engine.download_batch = lambda jobs, **kw: batches.append(len(jobs)) or real_batch(jobs, **kw)
+        # Queue the burst before the worker thread picks up the first note.
+        with patch.object(engine, "_ensure_worker"):
+            futures = [engine.submit(f"https://x/n{i}", i) for i in range(3)]
+        engine._ensure_worker()
+        paths = [f.result(timeout=5) for f in futures]
+        self.assertEqual(batches, [3])
+        self.assertEqual(paths, [os.path.join(self.tmp.name, f"video_{i}.mp4") for i in range(3)])
+
+    def test_timeout_starts_with_the_download_and_abandoned_files_are_removed(self):
+        engine = ytdlp_engine.YtdlpEngine(self.tmp.name, batch_window=0.2, batch_size=2, log=lambda *_: None)
+        release = threading.Event()
+        real_one = engine._download_one
+
+        def slow_one(ydl, url, timestamp):
+            if url.endswith("slow"):
+                release.wait(5)
+            return real_one(ydl, url, timestamp)
+
+        engine._download_one = slow_one
+        outcomes = {}
+
+        def call(name, url, timestamp, timeout):
+            try:
+                outcomes[name] = engine.download(url, timestamp, timeout)
+            except Exception as e:
+                outcomes[name] = e
+
+        callers = [threading.Thread(target=call, args=("slow", "https://x/slow", 1, 0.1)),
+                   threading.Thread(target=call, args=("queued", "https://x/q2", 2, 0.5))]
+        callers[0].start()
+        time.sleep(0.05)
+        callers[1].start()
+        # The queued note waits longer than its own timeout behind the slow one; its clock starts later.
+        time.sleep(0.8)
+        release.set()
+        for caller in callers:
+            caller.join(5)
+        self.assertIsInstance(outcomes["slow"], Exception)
+        self.assertEqual(outcomes["queued"], os.path.join(self.tmp.name, "video_2.mp4"))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["video_2.mp4"])
+
+    def test_batch_window_is_one_deadline(self):
+        engine = ytdlp_engine.YtdlpEngine(self.tmp.name, batch_window=0.3, batch_size=10, log=lambda *_: None)
+        for i in range(3):
+            engine._jobs.put(i)
+
+        def trickle():
+            for i in range(3, 8):
+                time.sleep(0.1)
+                engine._jobs.put(i)
+
+        threading.Thread(target=trickle, daemon=True).start()
+        started = time.monotonic()
+        batch = engine._next_batch()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertLess(len(batch), 8)
+
+    def test_lone_submission_skips_the_batch_window(self):
+        engine = ytdlp_engine.YtdlpEngine(self.tmp.name, batch_window=5, log=lambda *_: None)
+        started = time.monotonic()
+        path = engine.download("https://x/a1", 1, timeout=5)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(path, os.path.join(self.tmp.name, "video_1.mp4"))
+
+    def test_notes_sharing_a_media_id_get_their_own_files(self):
+        engine = ytdlp_engine.YtdlpEngine(self.tmp.name, log=lambda *_: None)
+        written = []
+        real_one = engine._download_one
+
+        def spy(ydl, url, timestamp):
+            written.append(ydl.params["outtmpl"]["default"])
+            return real_one(ydl, url, timestamp)
+
+        engine._download_one = spy
+        results = engine.download_batch([("https://x/same", 1), ("https://x/same", 2)])
+        self.assertEqual(len(set(written)), 2)
+        self.assertEqual(results, [os.path.join(self.tmp.name, f"video_{i}.mp4") for i in (1, 2)])
+
+    def test_missing_yt_dlp_fails_the_future(self):
+        with patch.object(ytdlp_engine, "yt_dlp", None):
+            engine = ytdlp_engine.YtdlpEngine(self.tmp.name, batch_window=0, log=lambda *_: None)
+            with self.assertRaises(RuntimeError):
+                engine.download("https://x/a1", 1, timeout=5)
+
+
+class RateLimiterRegressionTest(unittest.TestCase):
+    def _limiter(self, **kwargs):
+        kwargs.setdefault("limits", {})
+        return rate_limiter.AdaptiveRateLimiter(jitter=0, log=lambda *_: None, **kwargs)
+
+    def test_domain_key_groups_platform_hosts(self):
+        self.assertEqual(rate_limiter.domain_key("https://www.xiaohongshu.com/explore/1"), "xiaohongshu")
+        self.assertEqual(rate_limiter.domain_key("http://xhslink.com/a/b"), "xiaohongshu")
+        self.assertEqual(rate_limiter.domain_key("https://v.douyin.com/x"), "douyin")
+        self.assertEqual(rate_limiter.domain_key("https://b23.tv/x"), "bilibili")
+        self.assertEqual(rate_limiter.domain_key("https://youtu.be/x"), "youtube")
+        self.assertEqual(rate_limiter.domain_key("https://example.org/x"), "example.org")
+        self.assertEqual(rate_limiter.parse_limits("xiaohongshu=5/2/60, bad=1/2"), {"xiaohongshu": (5.0, 2.0, 60.0)})
+
+    def test_reservations_are_staggered_by_the_interval(self):
+        limiter = self._limiter(limits={"xiaohongshu": (4.0, 1.0, 60.0)})
+        url = "https://www.xiaohongshu.com/explore/1"
+        waits = [limiter.reserve(url) for _ in range(3)]
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[1], 4.0, delta=0.05)
+        self.assertAlmostEqual(waits[2], 8.0, delta=0.05)
+        self.assertEqual(limiter.reserve("https://www.bilibili.com/video/1"), 0)
+
+    def test_clean_responses_speed_up_and_risk_signals_back_off(self):
+        limiter = self._limiter(limits={"xiaohongshu": (4.0, 1.0, 60.0)})
+        key = "xiaohongshu"
+        for _ in range(rate_limiter.INCREASE_STEPS + 5):
+            limiter.report(key, "ok")
+        self.assertAlmostEqual(limiter.interval(key), 1.0)
+        limiter.report(key, "rate_limited")
+        self.assertAlmostEqual(limiter.interval(key), 2.0)
+        # Hard signals pause the domain for a cool-down on top of the slower rate.
+        self.assertGreaterEqual(limiter.reserve(key), 2.0 * rate_limiter.COOLDOWN_INTERVALS - 0.05)
+        limiter.report(key, "empty")
+        self.assertAlmostEqual(limiter.interval(key), 2.0 / rate_limiter.SOFT_DECREASE)
+        limiter.report(key, None)
+        self.assertEqual(limiter.snapshot()[key]["penalties"], 2)
+        for _ in range(20):
+            limiter.report(key, "captcha")
+        self.assertAlmostEqual(limiter.interval(key), 60.0)
+
+    def test_learned_interval_is_persisted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rate_state.json")
+            limiter = self._limiter(limits={"douyin": (4.0, 1.0, 60.0)}, state_path=path)
+            limiter.report("douyin", "login_wall")
+            again = self._limiter(limits={"douyin": (4.0, 1.0, 60.0)}, state_path=path)
+            self.assertAlmostEqual(again.interval("https://www.douyin.com/video/1"), 8.0)
+
+    def test_clean_reports_are_written_at_most_every_save_interval(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            limiter = self._limiter(limits={"douyin": (4.0, 1.0, 60.0)}, state_path=os.path.join(tmp, "s.json"))
+            with patch.object(limiter, "_save_state", wraps=limiter._save_state) as save, \
+                    patch("builtins.open", wraps=open) as opened:
+                for _ in range(5):
+                    limiter.report("douyin", "ok")
+                writes = [c for c in opened.call_args_list if "w" in c.args[1:2]]
+                self.assertEqual(len(writes), 1)
+                limiter.report("douyin", "captcha")
+                self.assertEqual(len([c for c in opened.call_args_list if "w" in c.args[1:2]]), 2)
+                self.assertEqual(save.call_count, 6)
+            limiter.report("douyin", "ok")
+            limiter.flush()
+            with open(os.path.join(tmp, "s.json"), encoding="utf-8") as f:
+                saved = json.load(f)["intervals"]["douyin"]
+            self.assertAlmostEqual(saved, limiter.interval("douyin"), places=3)
+
+    def test_step1_classifies_note_outcomes(self):
+        outcome = step1_scraper._rate_outcome
+        self.assertEqual(outcome("https://www.xiaohongshu.com/explore/1", status=461), "rate_limited")
+        self.assertEqual(outcome("https://www.xiaohongshu.com/website-login/captcha?x=1"), "captcha")
+        self.assertEqual(outcome("https://www.xiaohongshu.com/explore/1", logged_in=False), "login_wall")
+        # A fresh note legitimately has zero interactions; only missing stats are a soft signal.
+        self.assertEqual(outcome("", fields={"stats": {"likes": "0", "collects": "0", "comments": "0"}}), "ok")
+        self.assertEqual(outcome("", fields=step1_scraper._parse_note_payload({"dom": {"stats_text": ""}})), "empty")
+        self.assertEqual(outcome("", fields={}), "empty")
+        self.assertEqual(outcome("", fields={"stats": {"likes": "12", "collects": "0", "comments": "0"}}), "ok")
+        self.assertIsNone(outcome("https://www.xiaohongshu.com/explore/1"))
+
+
+class AccountPoolRegressionTest(unittest.TestCase):
+    def _pool(self, tmp, module=account_pool, names=("alt1", "alt2")):
+        profiles_dir = os.path.join(tmp, "browser_profiles")
+        patches = [
+            patch.object(module, "PROFILES_DIR", profiles_dir),
+            patch.object(module, "DEFAULT_PROFILE_DIR", os.path.join(tmp, "browser_memory")),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        pool = module.AccountPool(pool_file=os.path.join(profiles_dir, "pool.json"), log=lambda *_: None)
+        for name in names:
+            pool.add(name, concurrency=2)
+        return pool
+
+    def test_login_tool_refuses_settings_for_profiles_that_never_logged_in(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = self._pool(tmp, module=login_tool.account_pool, names=("alt1",))
+            with patch.object(login_tool.account_pool, "get_pool", return_value=pool), \
+                    patch("builtins.print") as printed:
+                self.assertFalse(login_tool.update_profile("ghost", concurrency=3))
+                # default 一直在账号池里，但没有登录过（无 browser_memory 目录）
+                self.assertFalse(login_tool.update_profile("default", concurrency=3))
+                self.assertTrue(login_tool.update_profile("alt1", concurrency=3))
+            self.assertIn("请先运行", printed.call_args_list[0][0][0])
+            self.assertNotIn("ghost", pool.profiles())
+            self.assertEqual(pool.profiles()["alt1"]["concurrency"], 3)
+
+    def test_leases_spread_across_free_profiles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = self._pool(tmp)
+            # default has never been logged in (no browser_memory dir), so it is not handed out.
+            self.assertEqual(sorted(pool.usable()), ["alt1", "alt2"])
+            first = pool.acquire()
+            second = pool.acquire()
+            self.assertEqual({first.name, second.name}, {"alt1", "alt2"})
+            self.assertEqual(first.concurrency, 2)
+            self.assertIsNot(first.limiter, second.limiter)
+            with self.assertRaises(TimeoutError):
+                pool.acquire(timeout=0.1)
+            pool.release(first)
+            self.assertEqual(pool.acquire(timeout=1).name, first.name)
+
+    def test_health_signals_rotate_accounts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = self._pool(tmp)
+            with pool.lease(name="alt1") as lease:
+                self.assertIs(account_pool.current_lease(), lease)
+                lease.report("https://www.xiaohongshu.com/explore/1", "rate_limited")
+            self.assertIsNone(account_pool.current_lease())
+            self.assertEqual(pool.profiles()["alt1"]["status"], account_pool.STATUS_RATE_LIMITED)
+            # alt1 is cooling down, so every lease goes to alt2 until it is logged out too.
+            with pool.lease(timeout=1) as lease:
+                self.assertEqual(lease.name, "alt2")
+                lease.report("https://www.xiaohongshu.com/explore/2", "login_wall")
+            self.assertEqual(pool.usable(), ["alt1"])
+            reloaded = account_pool.AccountPool(pool_file=pool.pool_file, log=lambda *_: None)
+            self.assertEqual(reloaded.profiles()["alt2"]["status"], account_pool.STATUS_LOGGED_OUT)
+            pool.update("alt1", enabled=False)
+            with self.assertRaises(account_pool.NoAccountAvailable):
+                pool.acquire(timeout=1)
+
+    def test_step1_uses_leased_profile_dir_and_limiter(self):
+        module = step1_scraper.account_pool
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = self._pool(tmp, module=module, names=("alt1",))
+            self.assertEqual(step1_scraper._active_user_data_dir(), step1_scraper.USER_DATA_DIR)
+            page = MagicMock(url="https://www.xiaohongshu.com/website-login/captcha")
+            with pool.lease(name="alt1") as lease:
+                self.assertEqual(step1_scraper._active_user_data_dir(), os.path.join(tmp, "browser_profiles", "alt1"))
+                self.assertIs(step1_scraper._active_limiter(), lease.limiter)
+                step1_scraper._report_rate("https://www.xiaohongshu.com/explore/1", page, nav={})
+            self.assertEqual(lease.limiter.snapshot()["xiaohongshu"]["penalties"], 1)
+            self.assertEqual(pool.profiles()["alt1"]["status"], module.STATUS_RATE_LIMITED)
+
+
+class BrowserDaemonRegressionTest(unittest.TestCase):
+    @patch.dict(os.environ, {"BROWSER_CDP_URL": "", "BROWSER_DAEMON": "0"})
+    def test_resolve_endpoint_disabled_by_default(self):
+        self.assertIsNone(browser_daemon.resolve_endpoint())
+
+    @patch.dict(os.environ, {"BROWSER_CDP_URL": "http://127.0.0.1:9555", "BROWSER_DAEMON": "1"})
+    def test_explicit_cdp_url_wins(self):
+        with patch.object(browser_daemon, "ensure_daemon") as mock_ensure:
+            self.assertEqual(browser_daemon.resolve_endpoint(), "http://127.0.0.1:9555")
+        mock_ensure.assert_not_called()
+
+    def test_ensure_daemon_reuses_live_service(self):
+        with patch.object(browser_daemon, "is_alive", return_value=True), patch.object(
+            browser_daemon.subprocess, "Popen"
+        ) as mock_popen:
+            self.assertEqual(browser_daemon.ensure_daemon(port=9444), "http://127.0.0.1:9444")
+        mock_popen.assert_not_called()
+
+
+class NoteReadinessRegressionTest(unittest.TestCase):
+    class _ReadyPage:
+        def __init__(self, dom_ready=True, video_hint=False):
+            self.dom_ready = dom_ready
+            self.video_hint = video_hint
+            self.timeouts = 0
+
+            class _Mouse:
+                def wheel(self, *_args):
+                    pass
+
+            self.mouse = _Mouse()
+
+        def wait_for_function(self, _js, arg=None, **_kwargs):
+            if not (self.dom_ready and (arg or self.video_hint)):
+                raise TimeoutError("signals not ready")
+
+        def evaluate(self, js, *_args):
+            if js == step1_scraper.NOTE_SIGNALS_JS:
+                return {"dom": self.dom_ready, "video": self.video_hint}
+            return self.video_hint
+
+        def wait_for_timeout(self, _ms):
+            self.timeouts += 1
+            if self.on_timeout:
+                self.on_timeout()
+
+        on_timeout = None
+
+    def test_fast_page_returns_immediately_with_saved_time(self):
+        page = self._ReadyPage()
+        report = step1_scraper._wait_for_note_ready(page, {"url": "https://sns-video/x.mp4"}, timeout=5)
+        self.assertFalse(report["timed_out"])
+        self.assertEqual(page.timeouts, 0)
+        self.assertGreater(report["saved_s"], 3.5)
+
+    def test_video_hint_counts_as_ready_without_sniffing(self):
+        page = self._ReadyPage(video_hint=True)
+        report = step1_scraper._wait_for_note_ready(page, {"url": None}, timeout=5)
+        self.assertEqual(report["signals"], {"dom": True, "video": True})
+
+    def test_dom_and_video_are_awaited_together(self):
+        page = self._ReadyPage()
+        sniffed = {"url": None}
+        # The sniffer fills in the stream URL while the DOM is already ready.
+        page.on_timeout = lambda: sniffed.update(url="https://sns-video/x.mp4")
+        report = step1_scraper._wait_for_note_ready(page, sniffed, timeout=5)
+        self.assertFalse(report["timed_out"])
+        self.assertLess(report["waited_s"], 1)
+
+    def test_missing_video_reports_dom_signal(self):
+        page = self._ReadyPage()
+        report = step1_scraper._wait_for_note_ready(page, {"url": None}, timeout=0.2)
+        self.assertTrue(report["timed_out"])
+        self.assertEqual(report["signals"], {"dom": True, "video": False})
+
+    def test_missing_signals_are_bounded_by_timeout(self):
+        page = self._ReadyPage(dom_ready=False)
+        report = step1_scraper._wait_for_note_ready(page, {"url": None}, timeout=0.2)
+        self.assertTrue(report["timed_out"])
+        self.assertEqual(report["signals"], {"dom": False, "video": False})
+        self.assertGreaterEqual(page.timeouts, 1)
+
+
+class NotePayloadRegressionTest(unittest.TestCase):
+    STATE_NOTE = {
+        "noteId": "66cdef",
+        "title": "冰岛自驾",
+        "desc": "第一天 #旅行",
+        "type": "video",
+        "time": 1700000000000,
+        "user": {"nickname": "Angel"},
+        "interactInfo": {"likedCount": "1.2万", "collectedCount": "3000", "commentCount": "120"},
+        "imageList": [{"urlDefault": "https://sns-img/cover.jpg"}],
+        "video": {"media": {"stream": {"h264": [{"masterUrl": "https://sns-video/a.mp4"}]}}},
+    }
+
+    def test_state_note_is_preferred_over_dom(self):
+        payload = {
+            "state_note": self.STATE_NOTE,
+            "dom": {"title": "DOM 标题", "counts": ["1", "2", "3"], "author": "DOM 作者",
+                    "comments": ["好看", "求攻略"]},
+        }
+        fields = step1_scraper._parse_note_payload(payload)
+        self.assertEqual(fields["source"], "state")
+        self.assertEqual(fields["title"], "冰岛自驾")
+        self.assertEqual(fields["author"], "Angel")
+        self.assertEqual(fields["stats"], {"likes": "1.2万", "collects": "3000", "comments": "120"})
+        self.assertEqual(fields["video_url"], "https://sns-video/a.mp4")
+        self.assertEqual(fields["cover_url"], "https://sns-img/cover.jpg")
+        self.assertEqual(fields["top_comments"], "好看\n求攻略")
+        self.assertIn("pub_time", fields)
+
+    def test_dom_fallback_and_sniffed_url_priority(self):
+        payload = {
+            "state_note": None,
+            "dom": {"title": "标题", "counts": [], "stats_text": "赞 88 收藏 9 评论 3",
+                    "author": "小明 关注", "video_src": "blob:xyz",
+                    "script_video": '{"masterUrl":"http:\\u002F\\u002Fcdn\\u002Fv.mp4"}'},
+        }
+        fields = step1_scraper._parse_note_payload(payload)
+        self.assertEqual(fields["source"], "dom")
+        self.assertEqual(fields["author"], "小明")
+        self.assertEqual(fields["stats"], {"likes": "88", "collects": "9", "comments": "3"})
+        self.assertEqual(fields["video_url"], "http://cdn/v.mp4")
+
+        sniffed = step1_scraper._parse_note_payload(payload, "https://sns-video/sniffed.mp4")
+        self.assertEqual(sniffed["video_url"], "https://sns-video/sniffed.mp4")
+
+
+class DownloadQueueRegressionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch.object(step1_scraper, "WORK_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _meta(self, note_id, ts):
+        return {"id": note_id, "url": f"https://www.xiaohongshu.com/explore/{note_id}",
+                "timestamp": ts, "local_video_path": None, "stats": {}}
+
+    def test_meta_is_written_only_after_download_finishes(self):
+        release = threading.Event()
+
+        def _fake_download(_url, _note_url, ts):
+            release.wait(2)
+            return os.path.join(self.tmp.name, f"video_{ts}.mp4")
+
+        with patch.object(step1_scraper, "_download_note_video", side_effect=_fake_download):
+            downloads = step1_scraper.DownloadQueue(workers=1, max_pending=2)
+            future = downloads.submit(self._meta("n1", 1), "https://sns-video/1.mp4")
+            self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "meta_1.json")))
+            release.set()
+            self.assertEqual(downloads.close(), [future.result()])
+
+        with open(future.result(), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.assertTrue(meta["local_video_path"].endswith("video_1.mp4"))
+        self.assertEqual(downloads.results.get_nowait()[:2], ("n1", future.result()))
+
+    def test_failed_download_reported_on_results_channel(self):
+        with patch.object(step1_scraper, "_download_note_video", return_value=None):
+            downloads = step1_scraper.DownloadQueue(workers=1)
+            future = downloads.submit(self._meta("n2", 2), "https://sns-video/2.mp4")
+            self.assertEqual(downloads.close(), [])
+        note_id, path, err = downloads.results.get_nowait()
+        self.assertEqual((note_id, path), ("n2", None))
+        self.assertIsNotNone(err)
+        self.assertEqual(step1_scraper._resolve_download_outcomes(["u"], [future]), [])
+
+
+class MediaCacheRegressionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch.object(step1_scraper, "WORK_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.downloads = []
+
+    def _fake_download(self, _url, _note_url, ts):
+        self.downloads.append(ts)
+        path = os.path.join(self.tmp.name, f"video_{ts}.mp4")
+        with open(path, "wb") as f:
+            f.write(b"same-bytes")
+        return path
+
+    def _meta(self, note_id, ts, likes):
+        return {"id": note_id, "url": f"https://www.xiaohongshu.com/explore/{note_id}",
+                "timestamp": ts, "local_video_path": None, "stats": {"likes": likes}}
+
+    def test_known_note_refreshes_meta_and_reuses_video(self):
+        with patch.object(step1_scraper, "_download_note_video", side_effect=self._fake_download):
+            first = step1_scraper._store_note(self._meta("n1", 1, "10"), "https://sns-video/1.mp4")
+            second = step1_scraper._store_note(self._meta("n1", 2, "99"), "https://sns-video/1.mp4")
+        self.assertEqual(first, second)
+        self.assertEqual(self.downloads, [1])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "meta_2.json")))
+        with open(first, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.assertEqual((meta["timestamp"], meta["stats"]["likes"]), (1, "99"))
+        self.assertIn("refreshed_at", meta)
+
+    def test_missing_video_is_redownloaded_under_cached_name(self):
+        with patch.object(step1_scraper, "_download_note_video", side_effect=self._fake_download):
+            first = step1_scraper._store_note(self._meta("n1", 1, "10"), "https://sns-video/1.mp4")
+            os.remove(os.path.join(self.tmp.name, "video_1.mp4"))
+            second = step1_scraper._store_note(self._meta("n1", 2, "11"), "https://sns-video/1.mp4")
+        self.assertEqual(first, second)
+        self.assertEqual(self.downloads, [1, "1"])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "video_1.mp4")))
+
+    def test_same_video_under_new_note_is_hard_linked(self):
+        with patch.object(step1_scraper, "_download_note_video", side_effect=self._fake_download):
+            step1_scraper._store_note(self._meta("n1", 1, "1"), "https://sns-video/1.mp4")
+            step1_scraper._store_note(self._meta("n2", 2, "1"), "https://sns-video/2.mp4")
+        a = os.stat(os.path.join(self.tmp.name, "video_1.mp4"))
+        b = os.stat(os.path.join(self.tmp.name, "video_2.mp4"))
+        self.assertEqual((a.st_ino, a.st_dev), (b.st_ino, b.st_dev))
+        index = media_cache.get_cache(self.tmp.name)._load()
+        self.assertEqual(set(index["notes"]), {"n1", "n2"})
+        self.assertEqual(len(index["hashes"]), 1)
+
+
+class _StatsFeedPage:
+    """Fake async profile page that serves one user_posted page on navigation."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.listeners = []
+
+    def on(self, _event, handler):
+        self.listeners.append(handler)
+
+    def remove_listener(self, _event, handler):
+        self.listeners.remove(handler)
+
+    async def goto(self, _url, **_kwargs):
+        for handler in list(self.listeners):
+            handler(_AsyncFeedResponse(self.payload))
+
+    async def evaluate(self, _script):
+        pass
+
+
+class _AsyncFeedResponse(_FeedResponse):
+    async def json(self):
+        return self._payload
+
+
+class StatsRefreshRegressionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch.object(step1_scraper, "WORK_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = step1_scraper.media_cache.get_cache(self.tmp.name)
+        for note_id in ("n1", "n2"):
+            meta_path = os.path.join(self.tmp.name, f"meta_{note_id}.json")
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"id": note_id, "url": f"https://www.xiaohongshu.com/explore/{note_id}?xsec_token=t",
+                           "local_video_path": f"video_{note_id}.mp4", "transcript": "keep",
+                           "stats": {"likes": "1", "collects": "2", "comments": "3"}}, f)
+            self.cache.record(note_id, None, meta_path)
+
+    def _meta(self, note_id):
+        with open(os.path.join(self.tmp.name, f"meta_{note_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_update_only_touches_stats(self):
+        entry = self.cache.lookup("n1")
+        self.assertTrue(step1_scraper._update_note_stats(self.cache, entry, {"likes": "9", "comments": None}))
+        self.assertFalse(step1_scraper._update_note_stats(self.cache, entry, {"likes": "9"}))
+        meta = self._meta("n1")
+        self.assertEqual(meta["stats"], {"likes": "9", "collects": "2", "comments": "3"})
+        self.assertEqual((meta["transcript"], meta["local_video_path"]), ("keep", "video_n1.mp4"))
+        self.assertIn("stats_refreshed_at", meta)
+
+    def test_targets_come_from_cache_and_crawl_state(self):
+        targets = step1_scraper._stats_targets(self.cache)
+        self.assertEqual(sorted(t[0] for t in targets), ["n1", "n2"])
+        self.assertTrue(targets[0][2].startswith("https://www.xiaohongshu.com/explore/"))
+        self.assertEqual([t[0] for t in step1_scraper._stats_targets(self.cache, note_ids=["n2", "gone"])], ["n2"])
+        profile = "https://www.xiaohongshu.com/user/profile/abc"
+        step1_scraper.crawl_state.get_state(self.tmp.name).record(profile, ["n1"])
+        self.assertEqual([t[0] for t in step1_scraper._stats_targets(self.cache, profile_url=profile)], ["n1"])
+
+    def test_feed_refresh_updates_likes_of_known_notes(self):
+        payload = _feed_page(0, 3, False)
+        payload["data"]["notes"][1]["interact_info"]["liked_count"] = "2.1万"
+        page = _StatsFeedPage(payload)
+        with patch("builtins.print"):
+            refreshed, changed = asyncio.run(step1_scraper._refresh_from_feed(
+                page, "https://www.xiaohongshu.com/user/profile/abc", self.cache))
+        # n0 was never scraped; the like counts of n1 and n2 both moved.
+        self.assertEqual((refreshed, changed), (2, 2))
+        self.assertEqual(self._meta("n1")["stats"]["likes"], "2.1万")
+        self.assertEqual(self._meta("n2")["stats"]["collects"], "2")
+        self.assertEqual(page.listeners, [])
+
+    def _refresh(self, logged_in, **kwargs):
+        page = MagicMock()
+        page.add_init_script = AsyncMock()
+
+        @contextlib.asynccontextmanager
+        async def session(_p):
+            yield MagicMock(), page
+
+        @contextlib.asynccontextmanager
+        async def playwright():
+            yield MagicMock()
+
+        gathered = AsyncMock(return_value=[True, False])
+        with patch.object(step1_scraper, "async_playwright", playwright), \
+                patch.object(step1_scraper, "_browser_session_async", session), \
+                patch.object(step1_scraper, "_wait_for_login_async", AsyncMock(return_value=logged_in)), \
+                patch.object(step1_scraper, "_gather_bounded", gathered), \
+                patch("builtins.print"):
+            summary = asyncio.run(step1_scraper.run_stats_refresh_async(**kwargs))
+        return summary, gathered
+
+    def test_refresh_aborts_when_login_wait_fails(self):
+        summary, gathered = self._refresh(False)
+        gathered.assert_not_called()
+        self.assertEqual(summary, {"refreshed": 0, "changed": 0, "failed": 0})
+
+    def test_explicit_concurrency_of_one_is_kept(self):
+        summary, gathered = self._refresh(True, concurrency=1)
+        self.assertEqual(gathered.call_args[0][2], 1)
+        self.assertEqual(summary, {"refreshed": 2, "changed": 1, "failed": 0})
+
+
+class _DouyinPageResponse:
+    def __init__(self, chunks, url="https://www.douyin.com/video/7300000000000000001"):
+        self.chunks = chunks
+        self.url = url
+        self.encoding = "utf-8"
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=None, decode_unicode=False):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class DouyinDownloaderRegressionTest(unittest.TestCase):
+    RENDER = {"app": {"videoDetail": {"video": {"playAddr": [{"src": "//v.douyin.com/playwm/1"}]}},
+                      "related": [{"video": {"play_addr": {"url_list": ["https://v.douyin.com/playwm/2"]}}}]}}
+
+    def _page_chunks(self):
+        from urllib.parse import quote as url_quote
+
+        html = ("<html><head>" + "x" * 5000 +
+                '<script id="RENDER_DATA" type="application/json">' + url_quote(json.dumps(self.RENDER)) +
+                "</script><body>" + "y" * 5000)
+        return [html[i:i + 37] for i in range(0, len(html), 37)]
+
+    def test_scanner_stops_reading_at_the_script_end(self):
+        response = _DouyinPageResponse(self._page_chunks())
+        session = MagicMock()
+        session.get.return_value = response
+        with patch.object(download_douyin, "get_session", return_value=session):
+            url, _ua, data = download_douyin.fetch_render_data("https://v.douyin.com/abc/")
+        self.assertEqual(data, self.RENDER)
+        self.assertEqual(url, response.url)
+        self.assertTrue(response.closed)
+        self.assertLess(response.read, len(response.chunks))
+        self.assertEqual(session.get.call_args.kwargs["stream"], True)
+
+    def test_router_data_assignment_is_parsed(self):
+        html = '<script>window._ROUTER_DATA = {"a": [1, {"b": 2}]};</script>'
+        self.assertEqual(download_douyin.extract_render_data(html), {"a": [1, {"b": 2}]})
+        self.assertIsNone(download_douyin.extract_render_data("<html>nothing</html>"))
+
+    def test_tree_walk_prefers_play_addr_and_strips_watermark(self):
+        self.assertEqual(download_douyin.extract_video_url(self.RENDER), "https://v.douyin.com/play/2")
+        only_play = {"x": [{"playAddr": ["//cdn/playwm/3"]}]}
+        self.assertEqual(download_douyin.extract_video_url(only_play), "https://cdn/play/3")
+        self.assertIsNone(download_douyin.extract_video_url({"video": {"cover": {}}}))
+
+    def test_batch_resolves_concurrently_and_keeps_order(self):
+        in_flight = {"now": 0, "peak": 0}
+        lock = threading.Lock()
+
+        def _fetch(url):
+            import time as _time
+
+            with lock:
+                in_flight["now"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+            _time.sleep(0.05)
+            with lock:
+                in_flight["now"] -= 1
+            if url.endswith("bad"):
+                return url, "ua", None
+            return f"https://www.douyin.com/video/{url[-1]}", "ua", self.RENDER
+
+        def _download(video_url, output_path, user_agent, label=""):
+            with open(output_path, "wb") as f:
+                f.write(b"v")
+            return True
+
+        urls = ["https://v.douyin.com/1", "https://v.douyin.com/bad", "https://v.douyin.com/3"]
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(download_douyin, "fetch_render_data", side_effect=_fetch), \
+                patch.object(download_douyin, "download_video", side_effect=_download), \
+                patch("builtins.print"):
+            results = asyncio.run(download_douyin.download_douyin_batch(urls, tmp, workers=3))
+            names = [os.path.basename(r) if r else None for r in results]
+        self.assertEqual(names, ["douyin_1.mp4", None, "douyin_3.mp4"])
+        self.assertGreater(in_flight["peak"], 1)
+
+    def test_progress_output_is_throttled(self):
+        with patch("builtins.print") as printed:
+            progress = download_douyin.throttled_progress("[1/2]", interval=60)
+            for done in range(0, 101):
+                progress(done, 100)
+        # first call and the completion line only
+        self.assertEqual(printed.call_count, 2)
+
+
+class _NotePageResponse:
+    def __init__(self, url, status=200, text=""):
+        self.url = url
+        self.status_code = status
+        self.text = text
+
+
+class _NotePageSession:
+    def __init__(self, response):
+        self.response = response
+        self.cookies = http_pool.requests.Session().cookies
+
+    def get(self, url, **_kwargs):
+        return self.response
+
+
+class NoteFetcherRegressionTest(unittest.TestCase):
+    NOTE_HTML = (
+        '<script>window.__INITIAL_STATE__={"note":{"noteDetailMap":{"abc":{"note":{'
+        '"noteId":"abc","title":"t","desc":"say \\"undefined\\"","user":{"nickname":"n"},"extra":undefined,'
+        '"interactInfo":{"likedCount":"12","collectedCount":"3","commentCount":"4"},'
+        '"video":{"media":{"stream":{"h264":[{"masterUrl":"https://cdn/v.mp4"}]}}}}}}}}</script>'
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_storage_state_cookies_skip_expired_entries(self):
+        state_path = os.path.join(self.tmp.name, "state.json")
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"cookies": [
+                {"name": "web_session", "value": "s", "domain": ".xiaohongshu.com", "path": "/", "expires": -1},
+                {"name": "old", "value": "o", "domain": ".xiaohongshu.com", "path": "/", "expires": 1},
+            ]}, f)
+        session = http_pool.requests.Session()
+        self.assertEqual(note_fetcher.load_storage_cookies(session, state_path), 1)
+        self.assertEqual(session.cookies.get("web_session", domain=".xiaohongshu.com"), "s")
+        self.assertEqual(note_fetcher.load_storage_cookies(session, os.path.join(self.tmp.name, "nope")), 0)
+
+    def test_initial_state_parses_js_undefined_outside_strings(self):
+        note = note_fetcher.note_from_state(note_fetcher.extract_initial_state(self.NOTE_HTML), "abc")
+        self.assertIsNone(note["extra"])
+        self.assertEqual(note["desc"], 'say "undefined"')
+        self.assertIsNone(note_fetcher.extract_initial_state("<html>login</html>"))
+
+    def test_fetch_note_classifies_unusable_pages(self):
+        cases = [
+            (_NotePageResponse("https://www.xiaohongshu.com/explore/abc", text=self.NOTE_HTML), None),
+            (_NotePageResponse("https://www.xiaohongshu.com/login?redirect=x"), "login_wall"),
+            (_NotePageResponse("https://www.xiaohongshu.com/explore/abc", status=461), "rate_limited"),
+            (_NotePageResponse("https://www.xiaohongshu.com/explore/abc", text="<html></html>"), "missing"),
+        ]
+        for response, reason in cases:
+            with patch.object(note_fetcher, "session_for", return_value=_NotePageSession(response)):
+                result = note_fetcher.fetch_note(response.url, self.tmp.name, note_id="abc")
+            self.assertEqual(result.reason, reason)
+            self.assertEqual(result.ok, reason is None)
+
+    def test_run_scraper_uses_http_result_and_skips_browser(self):
+        note = note_fetcher.note_from_state(note_fetcher.extract_initial_state(self.NOTE_HTML), "abc")
+        fetched = step1_scraper.note_fetcher.NoteFetch("https://www.xiaohongshu.com/explore/abc", 200, note)
+        downloads = MagicMock()
+        downloads.pending.return_value = 0
+        with patch.object(step1_scraper.note_fetcher, "fetch_note", return_value=fetched), \
+                patch.object(step1_scraper, "sync_playwright") as playwright, \
+                patch.object(step1_scraper, "_report_outcome") as report, \
+                patch("builtins.print"):
+            step1_scraper.run_scraper("https://www.xiaohongshu.com/explore/abc?xsec_token=t", downloads)
+        playwright.assert_not_called()
+        meta, video_url = downloads.submit.call_args.args
+        self.assertEqual((meta["id"], meta["stats"]["likes"], video_url), ("abc", "12", "https://cdn/v.mp4"))
+        report.assert_called_once_with("https://www.xiaohongshu.com/explore/abc?xsec_token=t", "ok")
+
+    def test_login_wall_falls_back_to_browser_without_marking_account(self):
+        blocked = step1_scraper.note_fetcher.NoteFetch("https://www.xiaohongshu.com/login", reason="login_wall")
+        with patch.object(step1_scraper.note_fetcher, "fetch_note", return_value=blocked), \
+                patch.object(step1_scraper, "_report_outcome") as report, \
+                patch("builtins.print"):
+            self.assertIsNone(step1_scraper._scrape_note_http("https://www.xiaohongshu.com/explore/abc"))
+            with patch.dict(os.environ, {"NOTE_HTTP_FETCH": "0"}):
+                self.assertIsNone(step1_scraper._scrape_note_http("https://www.xiaohongshu.com/explore/abc"))
+        report.assert_not_called()
+
+
+class _InlineFuture:
+    def __init__(self, fn, args):
+        self._fn, self._args = fn, args
+
+    def result(self):
+        return self._fn(*self._args)
+
+
+class _InlineExecutor:
+    """Stands in for ProcessPoolExecutor: runs jobs in-process, without the worker initializer."""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def submit(self, fn, *args):
+        return _InlineFuture(fn, args)
+
+
+class AnalyzerWorkerPoolRegressionTest(unittest.TestCase):
+    def test_job_reports_failures_without_raising(self):
+        with patch.object(step2_analyzer, "run_single_analysis", side_effect=["a.json", None, RuntimeError("boom")]), \
+                patch("builtins.print"):
+            ok = step2_analyzer._analyze_job("meta_1.json", log_dir="/tmp")
+            empty = step2_analyzer._analyze_job("meta_2.json", log_dir="/tmp")
+            crashed = step2_analyzer._analyze_job("meta_3.json", log_dir="/tmp")
+        self.assertEqual((ok["ok"], ok["analysis_file"], ok["error"]), (True, "a.json", None))
+        self.assertFalse(empty["ok"])
+        self.assertEqual((crashed["ok"], crashed["error"]), (False, "boom"))
+        self.assertEqual(ok["worker_log"], os.path.join("/tmp", f"step2_worker_{os.getpid()}.log"))
+
+    def test_batch_aggregates_results_and_passes_asr_semaphore(self):
+        def fake_job(meta_path, cleanup=False, log_dir=None):
+            if meta_path == "meta_bad.json":
+                raise RuntimeError("worker died")
+            return {"meta_path": meta_path, "ok": True, "analysis_file": "x", "error": None,
+                    "seconds": 2.0, "worker_log": "w.log"}
+
+        executors = []
+
+        def make_executor(**kwargs):
+            executors.append(_InlineExecutor(**kwargs))
+            return executors[-1]
+
+        with patch.object(step2_analyzer, "ProcessPoolExecutor", side_effect=make_executor), \
+                patch.object(step2_analyzer, "as_completed", side_effect=list), \
+                patch.object(step2_analyzer, "_analyze_job", side_effect=fake_job), \
+                patch.object(step2_analyzer, "ASR_CONCURRENCY", 2), \
+                patch("builtins.print") as printed:
+            results = step2_analyzer.run_batch(["meta_a.json", "meta_bad.json"], workers=2, log_dir="/tmp")
+        self.assertEqual([r["ok"] for r in results], [True, False])
+        self.assertIn("worker died", results[1]["error"])
+        kwargs = executors[0].kwargs
+        self.assertEqual(kwargs["max_workers"], 2)
+        self.assertIs(kwargs["initializer"], step2_analyzer._init_worker)
+        asr_slots, log_dir = kwargs["initargs"]
+        self.assertEqual(log_dir, "/tmp")
+        self.assertTrue(asr_slots.acquire(False) and asr_slots.acquire(False))
+        self.assertFalse(asr_slots.acquire(False))
+        self.assertTrue(any("成功 1 条 / ❌ 失败 1 条" in str(c) for c in printed.call_args_list))
+
+    def test_transcript_extraction_holds_an_asr_slot(self):
+        slots = threading.BoundedSemaphore(1)
+        held = []
+
+        def fake_extract(_video_path, log=None):
+            held.append(not slots.acquire(False))
+            return "text"
+
+        with patch.object(step2_analyzer, "_asr_slots", slots), \
+                patch.object(step2_analyzer, "_extract_transcript", side_effect=fake_extract):
+            self.assertEqual(step2_analyzer.extract_transcript("v.mp4"), "text")
+        self.assertEqual(held, [True])
+        self.assertTrue(slots.acquire(False))
+
+
+class StageGraphRegressionTest(unittest.TestCase):
+    def test_independent_stages_overlap_and_dependents_get_results(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def branch(value):
+            # Both branches must be in flight at once for the barrier to release.
+            barrier.wait()
+            return value
+
+        graph = stage_graph.StageGraph(max_workers=3)
+        graph.add("a", lambda: branch(1))
+        graph.add("b", lambda: branch(2))
+        graph.add("sum", lambda a, b: a + b, deps=("a", "b"))
+        self.assertEqual(graph.run()["sum"], 3)
+        self.assertEqual(set(graph.seconds), {"a", "b", "sum"})
+
+    def test_failed_stage_skips_only_its_dependents(self):
+        def boom():
+            raise RuntimeError("asr failed")
+
+        graph = stage_graph.StageGraph()
+        graph.add("transcript", boom)
+        graph.add("visuals", lambda: "frames")
+        graph.add("analysis", lambda transcript: transcript, deps=("transcript",))
+        results = graph.run()
+        self.assertEqual(results, {"visuals": "frames"})
+        self.assertIsInstance(graph.errors["transcript"], RuntimeError)
+        self.assertEqual(graph.skipped, ["analysis"])
+        with self.assertRaises(ValueError):
+            graph.add("late", lambda missing: None, deps=("missing",))
+
+    def test_analysis_starts_without_waiting_for_frame_extraction(self):
+        llm_started = threading.Event()
+
+        def slow_visuals(_video_path, log=None):
+            # Finishes only once the LLM call is already running.
+            self.assertTrue(llm_started.wait(5))
+            return ["frame"], "00:30"
+
+        def fake_analyze(meta, transcript, cover_base64, log=None):
+            llm_started.set()
+            return {"ok": True}, "openai", "m"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            meta_path = os.path.join(tmp, "meta_1.json")
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"local_video_path": "v.mp4"}, f)
+            with patch.object(step2_analyzer, "WORK_DIR", tmp), \
+                    patch.object(step2_analyzer, "ANALYSIS_STAGE_WORKERS", 3), \
+                    patch.object(step2_analyzer, "_fetch_cover", return_value=("b64", "cover.jpg")), \
+                    patch.object(step2_analyzer, "upload_to_imgbb", return_value="https://img"), \
+                    patch.object(step2_analyzer, "extract_transcript", return_value="[00:01] hi"), \
+                    patch.object(step2_analyzer, "extract_visuals", side_effect=slow_visuals), \
+                    patch.object(step2_analyzer, "analyze_content", side_effect=fake_analyze), \
+                    patch("builtins.print"):
+                report_path = step2_analyzer.run_single_analysis(meta_path)
+            with open(report_path, encoding="utf-8") as f:
+                report = json.load(f)
+        self.assertEqual((report["visual_images"], report["cover_url_public"]), (["frame"], "https://img"))
+        self.assertIn("analysis", report["stage_seconds"])
+
+    def test_failed_transcript_skips_uploads_and_visual_stages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            meta_path = os.path.join(tmp, "meta_1.json")
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"local_video_path": "v.mp4", "cover_url": "https://cover"}, f)
+            with patch.object(step2_analyzer, "WORK_DIR", tmp), \
+                    patch.object(step2_analyzer, "ANALYSIS_STAGE_WORKERS", 3), \
+                    patch.object(step2_analyzer, "_fetch_cover", return_value=("b64", "cover.jpg")), \
+                    patch.object(step2_analyzer, "extract_transcript", return_value=None), \
+                    patch.object(step2_analyzer, "upload_to_imgbb") as upload, \
+                    patch.object(step2_analyzer, "extract_visuals") as visuals, \
+                    patch.object(step2_analyzer, "analyze_content") as analyze, \
+                    patch("builtins.print"):
+                self.assertIsNone(step2_analyzer.run_single_analysis(meta_path))
+        upload.assert_not_called()
+        visuals.assert_not_called()
+        analyze.assert_not_called()
+
+
+class LLMTransportRegressionTest(unittest.TestCase):
+    def setUp(self):
+        # step2_analyzer shares the imported llm_transport module; reset its pooled state per test.
+        self.transport = step2_analyzer.llm_transport
+        self.transport._semaphores.clear()
+        patcher = patch.object(self.transport, "_client", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        health = step2_analyzer.provider_health.ProviderHealth(log=lambda _msg: None)
+        patcher = patch.object(step2_analyzer.provider_health, "get_health", return_value=health)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_per_provider_semaphore_bounds_in_flight_requests(self):
+        in_flight = {"kimi": 0, "qwen": 0}
+        peak = {"kimi": 0, "qwen": 0}
+
+        async def handler(request):
+            provider = request.url.host.split(".")[0]
+            in_flight[provider] += 1
+            peak[provider] = max(peak[provider], in_flight[provider])
+            await asyncio.sleep(0.02)
+            in_flight[provider] -= 1
+            return self.transport.httpx.Response(200, json={"provider": provider})
+
+        async def burst():
+            calls = [self.transport.post_json(p, f"https://{p}.example.com/v1/chat/completions", {}, {})
+                     for p in ("kimi", "qwen") for _ in range(6)]
+            return await asyncio.gather(*calls)
+
+        self.transport._client = self.transport.httpx.AsyncClient(
+            transport=self.transport.httpx.MockTransport(handler))
+        with patch.dict(os.environ, {"LLM_CONCURRENCY": "3", "LLM_CONCURRENCY_KIMI": "2"}):
+            responses = asyncio.run(burst())
+        self.assertEqual(peak, {"kimi": 2, "qwen": 3})
+        self.assertEqual(responses[0].json(), {"provider": "kimi"})
+
+    def test_sync_callers_on_many_threads_share_the_loop(self):
+        loops = []
+
+        async def where():
+            loops.append(asyncio.get_running_loop())
+            return threading.current_thread().name
+
+        names = []
+        threads = [threading.Thread(target=lambda: names.append(self.transport.run(where()))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(set(names), {"llm-transport"})
+        self.assertEqual(len(set(map(id, loops))), 1)
+
+    def test_forked_worker_starts_its_own_loop(self):
+        parent = self.transport.get_loop()
+        self.assertIs(self.transport.get_loop(), parent)
+        # fork 出来的子进程继承了 _loop 对象，但没有继承跑它的线程
+        with patch.object(self.transport.os, "getpid", return_value=os.getpid() + 1):
+            child = self.transport.get_loop()
+
+            async def where():
+                return threading.current_thread().name
+
+            self.assertEqual(self.transport.run(where(), timeout=5), "llm-transport")
+        self.assertIsNot(child, parent)
+
+    def test_health_records_are_saved_off_the_transport_loop(self):
+        threads = []
+        health = step2_analyzer.provider_health.get_health()
+        original = health.record
+
+        def record(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return original(*args, **kwargs)
+
+        async def fake_invoke(provider, cfg, *args, **kwargs):
+            return json.dumps({"summary": "ok"})
+
+        meta = {"title": "t", "author": "a", "desc": "d", "stats": {}}
+        configs = {"kimi": {"api_key": "k", "model": "kimi-m", "base_url": "https://api.example.com/v1"}}
+        with patch.object(health, "record", side_effect=record), \
+                patch.object(step2_analyzer, "build_provider_chain", return_value=["kimi"]), \
+                patch.object(step2_analyzer, "get_provider_configs", return_value=configs), \
+                patch("builtins.print"), \
+                patch.object(step2_analyzer, "_invoke_provider", side_effect=fake_invoke), \
+                patch.dict(os.environ, {"LLM_CACHE": "0"}):
+            step2_analyzer.analyze_content(meta, "transcript", None, log=None)
+        self.assertTrue(threads)
+        self.assertNotIn("llm-transport", threads)
+
+    def test_openai_compatible_call_retries_without_image(self):
+        payloads = []
+        replies = [self.transport.LLMResponse(400, "image not supported"),
+                   self.transport.LLMResponse(200, json.dumps({"choices": [{"message": {"content": "ok"}}]}))]
+
+        async def fake_post(provider, url, headers, payload, timeout=300):
+            payloads.append(payload)
+            return replies.pop(0)
+
+        with patch.object(self.transport, "post_json", side_effect=fake_post):
+            raw = step2_analyzer.call_openai_compatible_model(
+                "kimi", "m", "key", "https://api.example.com/v1", "prompt", cover_base64="abc")
+        self.assertEqual(raw, "ok")
+        self.assertIsInstance(payloads[0]["messages"][0]["content"], list)
+        self.assertEqual(payloads[1]["messages"][0]["content"], "prompt")
+
+
+class LLMCacheRegressionTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache.sqlite3")
+
+    def test_fingerprint_covers_provider_model_prompt_and_cover(self):
+        base = llm_cache.fingerprint("kimi", "m", "prompt", "cover")
+        self.assertEqual(base, llm_cache.fingerprint("kimi", "m", "prompt", "cover"))
+        variants = [llm_cache.fingerprint("qwen", "m", "prompt", "cover"),
+                    llm_cache.fingerprint("kimi", "m2", "prompt", "cover"),
+                    llm_cache.fingerprint("kimi", "m", "prompt!", "cover"),
+                    llm_cache.fingerprint("kimi", "m", "prompt", "other"),
+                    llm_cache.fingerprint("kimi", "m", "prompt")]
+        self.assertNotIn(base, variants)
+
+    def test_ttl_expiry_and_lru_eviction(self):
+        cache = llm_cache.ResponseCache(self.path, ttl_seconds=60, max_bytes=10)
+        with patch.object(llm_cache.time, "time", return_value=1000):
+            cache.put("a", "aaaa")
+            cache.put("b", "bbbb")
+        with patch.object(llm_cache.time, "time", return_value=1001):
+            self.assertEqual(cache.get("a"), "aaaa")  # "a" is now the most recently used
+            cache.put("c", "cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.entry_count(), 2)
+        with patch.object(llm_cache.time, "time", return_value=1100):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.counters(), {"hits": 1, "misses": 2, "stores": 3, "evictions": 1})
+
+    def test_lookup_across_the_chain_counts_one_miss(self):
+        cache = llm_cache.ResponseCache(self.path)
+        self.assertIsNone(cache.get_first(["k1", "k2", "k3"]))
+        cache.put("k2", "reply")
+        self.assertEqual(cache.get_first(["k1", "k2"]), ("k2", "reply"))
+        self.assertEqual(cache.counters()["misses"], 1)
+        self.assertEqual(cache.counters()["hits"], 1)
+
+    def test_second_analysis_is_served_from_cache(self):
+        cache = llm_cache.ResponseCache(self.path)
+        reply = json.dumps({"highlights": "h", "structure": "s", "grade": "A", "niche": "n"})
+        configs = {"kimi": {"api_key": "k", "model": "kimi-m", "base_url": "https://api.example.com/v1"}}
+        meta = {"title": "t", "author": "a", "desc": "d", "stats": {"likes": "1.2万", "comments": 3, "collects": 4}}
+
+        async def fake_invoke(provider, cfg, messages_content, text_prompt, cover_base64, log=None):
+            return reply
+
+        health = step2_analyzer.provider_health.ProviderHealth(log=lambda _msg: None)
+        with patch.object(step2_analyzer.llm_cache, "get_cache", return_value=cache), \
+                patch.object(step2_analyzer.provider_health, "get_health", return_value=health), \
+                patch.object(step2_analyzer, "build_provider_chain", return_value=["kimi"]), \
+                patch.object(step2_analyzer, "get_provider_configs", return_value=configs), \
+                patch.object(step2_analyzer, "_invoke_provider", side_effect=fake_invoke) as invoked, \
+                patch.dict(os.environ, {"LLM_CACHE": "1"}), \
+                patch("builtins.print"):
+            first = step2_analyzer.analyze_content(meta, "[00:01] hi", cover_base64="abc")
+            second = step2_analyzer.analyze_content(meta, "[00:01] hi", cover_base64="abc")
+            with patch.dict(os.environ, {"LLM_CACHE": "0"}):
+                step2_analyzer.analyze_content(meta, "[00:01] hi", cover_base64="abc")
+        self.assertEqual(first, second)
+        self.assertEqual(second[1:], ("kimi", "kimi-m"))
+        self.assertEqual(invoked.call_count, 2)
+        self.assertEqual(cache.counters(), {"hits": 1, "misses": 1, "stores": 1, "evictions": 0})
+
+    def test_unusable_cache_falls_through_to_providers(self):
+        import sqlite3
+
+        broken = MagicMock()
+        broken.get_first.side_effect = sqlite3.OperationalError("database is locked")
+        reply = json.dumps({"highlights": "h", "structure": "s", "grade": "A", "niche": "n"})
+        configs = {"kimi": {"api_key": "k", "model": "kimi-m", "base_url": "https://api.example.com/v1"}}
+        meta = {"title": "t", "author": "a", "desc": "d", "stats": {"likes": 1, "comments": 1, "collects": 1}}
+        health = step2_analyzer.provider_health.ProviderHealth(log=lambda _msg: None)
+
+        async def fake_invoke(*_args, **_kwargs):
+            return reply
+
+        for get_cache in ({"return_value": broken}, {"side_effect": sqlite3.DatabaseError("file is not a database")}):
+            with patch.object(step2_analyzer.llm_cache, "get_cache", **get_cache), \
+                    patch.object(step2_analyzer.provider_health, "get_health", return_value=health), \
+                    patch.object(step2_analyzer, "build_provider_chain", return_value=["kimi"]), \
+                    patch.object(step2_analyzer, "get_provider_configs", return_value=configs), \
+                    patch.object(step2_analyzer, "_invoke_provider", side_effect=fake_invoke), \
+                    patch.dict(os.environ, {"LLM_CACHE": "1"}), \
+                    patch("builtins.print"):
+                _result, provider, _model = step2_analyzer.analyze_content(meta, "[00:01] hi")
+            self.assertEqual(provider, "kimi")
+        broken.put.assert_not_called()
+
+
+class ProviderHealthRegressionTest(unittest.TestCase):
+    def make(self, path=None, **kwargs):
+        return provider_health.ProviderHealth(state_path=path, failures=2, cooldown=60, log=lambda _msg: None, **kwargs)
+
+    def test_breaker_opens_half_opens_and_doubles_cooldown(self):
+        health = self.make()
+        with patch.object(provider_health.time, "time", return_value=1000):
+            health.record("kimi", ok=False)
+            self.assertTrue(health.acquire("kimi"))
+            health.record("kimi", ok=False)
+            self.assertFalse(health.acquire("kimi"))
+        with patch.object(provider_health.time, "time", return_value=1061):
+            # Cool-down over: exactly one trial call goes through.
+            self.assertTrue(health.acquire("kimi"))
+            self.assertFalse(health.acquire("kimi"))
+            health.record("kimi", ok=False)
+            self.assertEqual(health.snapshot()["kimi"]["open_until"], 1061 + 120)
+        with patch.object(provider_health.time, "time", return_value=1200):
+            self.assertTrue(health.acquire("kimi"))
+            health.record("kimi", ok=True, seconds=4)
+            self.assertTrue(health.acquire("kimi") and health.acquire("kimi"))
+        self.assertEqual(health.snapshot()["kimi"]["failures"], 0)
+
+    def test_order_demotes_unhealthy_and_optionally_sorts_by_latency(self):
+        health = self.make()
+        health.record("anthropic", ok=False)
+        health.record("anthropic", ok=False)
+        health.record("openai", ok=False)
+        health.record("kimi", ok=True, seconds=30)
+        health.record("qwen", ok=True, seconds=5)
+        chain = ["anthropic", "openai", "kimi", "qwen", "minimax"]
+        self.assertEqual(health.order(chain), ["kimi", "qwen", "minimax", "openai", "anthropic"])
+        health.routing = "latency"
+        self.assertEqual(health.order(chain), ["minimax", "qwen", "kimi", "openai", "anthropic"])
+
+    def test_state_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "provider_health.json")
+            health = self.make(path)
+            health.record("kimi", ok=False)
+            health.record("kimi", ok=False)
+            health.set_image_support("kimi", "moonshot-v1-8k", False)
+            restarted = self.make(path)
+        self.assertFalse(restarted.acquire("kimi"))
+        self.assertIs(restarted.accepts_images("kimi", "moonshot-v1-8k"), False)
+        self.assertIsNone(restarted.accepts_images("kimi", "moonshot-v1-8k-vision"))
+
+    def test_analysis_skips_open_breaker_and_records_outcomes(self):
+        health = self.make()
+        health.record("anthropic", ok=False)
+        health.record("anthropic", ok=False)
+        configs = {name: {"api_key": "k", "model": f"{name}-m", "base_url": "https://api.example.com/v1"}
+                   for name in ("anthropic", "kimi", "qwen")}
+        meta = {"title": "t", "author": "a", "desc": "d", "stats": {"likes": 1, "comments": 1, "collects": 1}}
+        reply = json.dumps({"highlights": "h", "structure": "s", "grade": "A", "niche": "n"})
+        called = []
+
+        async def fake_invoke(provider, cfg, messages_content, text_prompt, cover_base64, log=None):
+            called.append(provider)
+            if provider == "kimi":
+                raise RuntimeError("timeout")
+            return reply
+
+        with patch.object(step2_analyzer.provider_health, "get_health", return_value=health), \
+                patch.object(step2_analyzer, "build_provider_chain", return_value=["anthropic", "kimi", "qwen"]), \
+                patch.object(step2_analyzer, "get_provider_configs", return_value=configs), \
+                patch.object(step2_analyzer, "client_claude", object()), \
+                patch.object(step2_analyzer, "_invoke_provider", side_effect=fake_invoke), \
+                patch.dict(os.environ, {"LLM_CACHE": "0"}), \
+                patch("builtins.print"):
+            _result, provider, _model = step2_analyzer.analyze_content(meta, "[00:01] hi")
+        self.assertEqual(provider, "qwen")
+        self.assertEqual(called, ["kimi", "qwen"])
+        snapshot = health.snapshot()
+        self.assertEqual((snapshot["kimi"]["failures"], snapshot["qwen"]["calls"]), (1, 1))
+
+    def test_only_request_shape_errors_mark_a_model_text_only(self):
+        ok = json.dumps({"choices": [{"message": {"content": "ok"}}]})
+        for status, expected in ((503, None), (429, None), (415, False)):
+            health = self.make()
+            replies = [step2_analyzer.llm_transport.LLMResponse(status, "error"),
+                       step2_analyzer.llm_transport.LLMResponse(200, ok)]
+
+            async def fake_post(provider, url, headers, payload, timeout=300):
+                return replies.pop(0)
+
+            with patch.object(step2_analyzer.provider_health, "get_health", return_value=health), \
+                    patch.object(step2_analyzer.llm_transport, "post_json", side_effect=fake_post):
+                step2_analyzer.call_openai_compatible_model(
+                    "kimi", "m", "key", "https://api.example.com/v1", "prompt", cover_base64="abc")
+            self.assertIs(health.accepts_images("kimi", "m"), expected, status)
+
+    def test_workers_merge_instead_of_overwriting_each_other(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "provider_health.json")
+            first, second = self.make(path), self.make(path)
+            first.record("kimi", ok=False)
+            first.record("kimi", ok=False)
+            first.set_image_support("kimi", "m", False)
+            second.record("qwen", ok=True, seconds=3)
+            second.set_image_support("kimi", "vision", True)
+            restarted = self.make(path)
+        self.assertFalse(second.acquire("kimi"))
+        self.assertFalse(restarted.acquire("kimi"))
+        self.assertEqual(restarted.snapshot()["qwen"]["latency"], 3)
+        self.assertIs(restarted.accepts_images("kimi", "m"), False)
+        self.assertIs(restarted.accepts_images("kimi", "vision"), True)
+
+    def test_cancelled_trial_call_releases_the_half_open_slot(self):
+        health = self.make()
+        with patch.object(provider_health.time, "time", return_value=0):
+            health.record("kimi", ok=False)
+            health.record("kimi", ok=False)
+        configs = {"kimi": {"api_key": "k", "model": "kimi-m", "base_url": "https://api.example.com/v1"}}
+        meta = {"title": "t", "author": "a", "desc": "d", "stats": {"likes": 1, "comments": 1, "collects": 1}}
+
+        async def cancelled(*_args, **_kwargs):
+            raise asyncio.CancelledError()
+
+        with patch.object(step2_analyzer.provider_health, "get_health", return_value=health), \
+                patch.object(step2_analyzer, "build_provider_chain", return_value=["kimi"]), \
+                patch.object(step2_analyzer, "get_provider_configs", return_value=configs), \
+                patch.object(step2_analyzer, "_invoke_provider", side_effect=cancelled), \
+                patch.dict(os.environ, {"LLM_CACHE": "0"}), \
+                patch("builtins.print"):
+            with self.assertRaises(BaseException):
+                step2_analyzer.analyze_content(meta, "[00:01] hi")
+        self.assertEqual(health.acquire("kimi"), provider_health.TRIAL)
+
+    def test_known_text_only_model_skips_the_image_attempt(self):
+        health = self.make()
+        payloads = []
+        replies = [step2_analyzer.llm_transport.LLMResponse(400, "image not supported")]
+        ok = json.dumps({"choices": [{"message": {"content": "ok"}}]})
+
+        async def fake_post(provider, url, headers, payload, timeout=300):
+            payloads.append(payload)
+            return replies.pop(0) if replies else step2_analyzer.llm_transport.LLMResponse(200, ok)
+
+        def call():
+            return step2_analyzer.call_openai_compatible_model(
+                "kimi", "m", "key", "https://api.example.com/v1", "prompt", cover_base64="abc")
+
+        with patch.object(step2_analyzer.provider_health, "get_health", return_value=health), \
+                patch.object(step2_analyzer.llm_transport, "post_json", side_effect=fake_post):
+            self.assertEqual(call(), "ok")
+            self.assertIs(health.accepts_images("kimi", "m"), False)
+            self.assertEqual(call(), "ok")
+        self.assertEqual(len(payloads), 3)
+        self.assertEqual(payloads[2]["messages"][0]["content"], "prompt")
+
+
+class _FakeStreamResponse:
+    def __init__(self, status_code, body=b"", headers=None, fail_after=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.fail_after = fail_after
+
+    def iter_content(self, chunk_size=1):
+        sent = 0
+        for i in range(0, len(self.body), 4):
+            if self.fail_after is not None and sent >= self.fail_after:
+                raise ConnectionError("connection reset")
+            chunk = self.body[i:i + 4]
+            sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class _FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, headers=None, **_kwargs):
+        self.calls.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+
+class ResumableDownloadRegressionTest(unittest.TestCase):
+    BODY = b"0123456789abcdef"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dest = os.path.join(self.tmp.name, "video.mp4")
+        patcher = patch.object(downloader.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resume_only_fetches_missing_bytes(self):
+        session = _FakeSession([
+            _FakeStreamResponse(200, self.BODY, {"Content-Length": "16"}, fail_after=8),
+            _FakeStreamResponse(206, self.BODY[8:], {"Content-Range": "bytes 8-15/16", "Content-Length": "8"}),
+        ])
+        out = downloader.download_file("https://cdn/v.mp4", self.dest, session=session, log=lambda *_: None)
+        self.assertEqual(out, self.dest)
+        self.assertEqual(session.calls[1]["Range"], "bytes=8-")
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+
+    def test_short_stream_is_not_renamed(self):
+        session = _FakeSession([_FakeStreamResponse(200, self.BODY[:10], {"Content-Length": "16"})])
+        out = downloader.download_file(
+            "https://cdn/v.mp4", self.dest, session=session, retries=0, log=lambda *_: None
+        )
+        self.assertIsNone(out)
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(os.path.getsize(self.dest + ".part"), 10)
+
+    def test_server_ignoring_range_restarts_cleanly(self):
+        with open(self.dest + ".part", "wb") as f:
+            f.write(b"stale")
+        session = _FakeSession([_FakeStreamResponse(200, self.BODY, {"Content-Length": "16"})])
+        out = downloader.download_file("https://cdn/v.mp4", self.dest, session=session, log=lambda *_: None)
+        self.assertEqual(session.calls[0]["Range"], "bytes=5-")
+        with open(out, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+
+
+class _RangeServerSession:
+    """Serves byte ranges of a fixed body; optionally fails one segment ``fail_times`` times."""
+
+    def __init__(self, body, fail_start=None, fail_times=1):
+        self.body = body
+        self.fail_start = fail_start
+        self.fail_times = fail_times
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, **_kwargs):
+        rng = (headers or {}).get("Range", "")
+        start, _, end = rng.replace("bytes=", "").partition("-")
+        start = int(start or 0)
+        end = int(end) if end else len(self.body) - 1
+        with self.lock:
+            self.ranges.append((start, end))
+            fail = start == self.fail_start
+            if fail:
+                self.fail_times -= 1
+                if not self.fail_times:
+                    self.fail_start = None
+        return _FakeStreamResponse(
+            206,
+            self.body[start:end + 1],
+            {"Content-Range": f"bytes {start}-{end}/{len(self.body)}"},
+            fail_after=4 if fail else None,
+        )
+
+
+class SegmentedDownloadRegressionTest(unittest.TestCase):
+    BODY = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dest = os.path.join(self.tmp.name, "big.mp4")
+        patcher = patch.object(downloader.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_plan_segments_covers_whole_file(self):
+        ranges = downloader.plan_segments(10, 3)
+        self.assertEqual(ranges, [(0, 2), (3, 5), (6, 9)])
+
+    def test_segmented_download_reassembles_file_and_retries_segment(self):
+        session = _RangeServerSession(self.BODY, fail_start=256)
+        out = downloader.download_file(
+            "https://cdn/big.mp4", self.dest, session=session, segments=4,
+            segment_min_size=1, log=lambda *_: None,
+        )
+        self.assertEqual(out, self.dest)
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+        self.assertIn((0, 0), session.ranges)
+        self.assertEqual(session.ranges.count((256, 511)), 2)
+        self.assertFalse(os.path.exists(self.dest + ".part.segments"))
+
+    def test_small_file_falls_back_to_single_stream(self):
+        session = _RangeServerSession(self.BODY)
+        downloader.download_file(
+            "https://cdn/big.mp4", self.dest, session=session, segments=4,
+            segment_min_size=10 * len(self.BODY), log=lambda *_: None,
+        )
+        self.assertEqual(session.ranges, [(0, 0), (0, len(self.BODY) - 1)])
+
+    def _leave_segmented_part(self, done):
+        with open(self.dest + ".part", "wb") as f:
+            f.truncate(len(self.BODY))
+            for index in done:
+                f.seek(index * 256)
+                f.write(self.BODY[index * 256:(index + 1) * 256])
+        ranges = [list(r) for r in downloader.plan_segments(len(self.BODY), 4)]
+        with open(self.dest + ".part.segments", "w", encoding="utf-8") as f:
+            json.dump({"total": len(self.BODY), "ranges": ranges, "done": list(done)}, f)
+
+    def test_segmented_leftover_resumes_segmented_even_for_single_stream_calls(self):
+        self._leave_segmented_part(done=[0, 1])
+        session = _RangeServerSession(self.BODY)
+        out = downloader.download_file("https://cdn/big.mp4", self.dest, session=session,
+                                       segments=1, log=lambda *_: None)
+        self.assertEqual(out, self.dest)
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+        self.assertEqual(sorted(session.ranges), [(0, 0), (512, 767), (768, 1023)])
+
+    def test_segmented_leftover_is_discarded_when_ranges_are_unavailable(self):
+        self._leave_segmented_part(done=[0])
+        session = MagicMock()
+        session.get.side_effect = lambda url, headers=None, **_kw: _FakeStreamResponse(
+            200, self.BODY, {"Content-Length": str(len(self.BODY))})
+        out = downloader.download_file("https://cdn/big.mp4", self.dest, session=session,
+                                       segments=1, log=lambda *_: None)
+        self.assertEqual(out, self.dest)
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+        self.assertFalse(os.path.exists(self.dest + ".part.segments"))
+
+    def test_failed_segment_round_refetches_only_unfinished_ranges(self):
+        # Fails every in-round retry of one segment; the next round picks up only that segment.
+        session = _RangeServerSession(self.BODY, fail_start=256, fail_times=downloader.SEGMENT_RETRIES + 1)
+        out = downloader.download_file("https://cdn/big.mp4", self.dest, session=session, segments=4,
+                                       segment_min_size=1, log=lambda *_: None)
+        self.assertEqual(out, self.dest)
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.BODY)
+        self.assertEqual(session.ranges.count((0, 255)), 1)
+        self.assertEqual(session.ranges.count((256, 511)), downloader.SEGMENT_RETRIES + 2)
+
+
+class HttpPoolRegressionTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(http_pool.close_all)
+
+    def test_get_session_is_shared_across_threads(self):
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(http_pool.get_session("t"))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({id(s) for s in seen}), 1)
+        self.assertIsNot(http_pool.get_session("t"), http_pool.get_session("other"))
+
+    def test_host_pool_sizes_mount_dedicated_adapters(self):
+        with patch.dict(os.environ, {"HTTP_HOST_POOL_SIZES": "cdn.example.com=32, bad, api.example.com=x"}):
+            session = http_pool.build_session()
+        adapter = session.get_adapter("https://cdn.example.com/v.mp4")
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertIsNot(adapter, session.get_adapter("https://api.example.com/"))
+        self.assertEqual(http_pool.parse_host_pool_sizes("a=1,b"), {"a": 1})
+
+    def test_default_timeout_applied_only_when_missing(self):
+        session = http_pool.build_session(timeout=7)
+        with patch("requests.Session.request") as request:
+            session.get("https://example.com")
+            session.get("https://example.com", timeout=99)
+        self.assertEqual(request.call_args_list[0].kwargs["timeout"], 7)
+        self.assertEqual(request.call_args_list[1].kwargs["timeout"], 99)
+
+    def test_unknown_or_missing_transport_falls_back_to_requests(self):
+        def broken(pool_maxsize, config):
+            raise ImportError("no such backend")
+
+        http_pool.register_transport("broken", broken)
+        with patch("builtins.print"):
+            session = http_pool.build_session(transport="broken")
+            other = http_pool.build_session(transport="nope")
+        self.assertIsInstance(session.get_adapter("https://x/"), http_pool.HTTPAdapter)
+        self.assertIsInstance(other.get_adapter("https://x/"), http_pool.HTTPAdapter)
+
+    def test_httpx_transport_decodes_gzip_bodies(self):
+        import gzip
+        import httpx
+
+        payload = json.dumps({"ok": True, "items": list(range(50))}).encode()
+        body = gzip.compress(payload)
+
+        def handler(request):
+            return httpx.Response(200, content=body,
+                                  headers={"Content-Encoding": "gzip", "Content-Length": str(len(body))})
+
+        session = http_pool.build_session(transport="httpx")
+        session.trust_env = False  # keep CA-bundle / proxy variables of this machine out of it
+        adapter = session.get_adapter("https://api.example.com/")
+        adapter._client = httpx.Client(transport=httpx.MockTransport(handler))
+        response = session.get("https://api.example.com/data")
+        self.assertEqual(response.json()["items"][-1], 49)
+        self.assertNotIn("Content-Encoding", response.headers)
+        streamed = session.get("https://api.example.com/data", stream=True)
+        self.assertEqual(b"".join(streamed.iter_content(chunk_size=7)), payload)
+
+    def test_httpx_transport_honours_verify_cert_and_proxy_settings(self):
+        import httpx
+
+        built = []
+        session = http_pool.build_session(transport="httpx")
+        adapter = session.get_adapter("https://api.example.com/")
+
+        def build_client(verify, cert, proxy):
+            built.append((verify, cert, proxy))
+            return httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+
+        adapter._client = build_client(True, None, None)
+        built.clear()
+        with patch.object(adapter, "_build_client", side_effect=build_client), \
+                patch.dict(os.environ, {"HTTPS_PROXY": "http://proxy.local:3128", "REQUESTS_CA_BUNDLE": "/etc/ca.pem"}):
+            session.get("https://api.example.com/a", verify=False)
+            session.get("https://api.example.com/b")
+            session.get("https://api.example.com/c", cert=("c.pem", "k.pem"))
+            session.get("https://api.example.com/d", verify=False)
+        self.assertEqual(built, [(False, None, "http://proxy.local:3128"),
+                                 ("/etc/ca.pem", None, "http://proxy.local:3128"),
+                                 ("/etc/ca.pem", ("c.pem", "k.pem"), "http://proxy.local:3128")])
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(OSError):
+                # A bundle path becomes an SSL context instead of being dropped.
+                http_pool._ssl_context(os.path.join(tmp, "missing.pem"), None)
+        self.assertEqual(http_pool._ssl_context(False, None).verify_mode, http_pool.ssl.CERT_NONE)
+
+    def test_httpx_transport_keeps_set_cookie_in_the_session_jar(self):
+        import httpx
+
+        def handler(request):
+            return httpx.Response(200, headers=[("Set-Cookie", "a1=x; Path=/"), ("Set-Cookie", "web_session=s; Path=/")])
+
+        session = http_pool.build_session(transport="httpx")
+        session.trust_env = False
+        session.get_adapter("https://www.example.com/")._client = httpx.Client(transport=httpx.MockTransport(handler))
+        response = session.get("https://www.example.com/login")
+        self.assertEqual(response.cookies.get("web_session"), "s")
+        self.assertEqual(session.cookies.get_dict(), {"a1": "x", "web_session": "s"})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+"""
+In-process yt-dlp engine for step1's fallback downloads.
+
+Instead of spawning the ``yt-dlp`` binary per note (interpreter + extractor
+start-up every time), one persistent ``yt_dlp.YoutubeDL`` instance lives on a
+background thread and downloads the queued notes one after another. A lone
+request starts immediately; when several are already queued (a burst of failed
+notes), the batch also takes whatever arrives within ``YTDLP_BATCH_WINDOW``
+seconds of the first. Batching only amortizes extractor setup and groups the
+log output; it does not download in parallel. The output path of every note
+comes from yt-dlp's info dict, so there is no directory scanning afterwards.
+
+Configuration (environment / .env):
+
+    YTDLP_BATCH_WINDOW   seconds a burst waits for more failed notes before its batch starts (default 1)
+    YTDLP_BATCH_SIZE     max notes per batch (default 8)
+    YTDLP_TIMEOUT        seconds a caller waits once its note's download has started (default 300);
+                         a note whose caller gave up is discarded instead of being saved
+"""
+
+import os
+import time
+import itertools
+import queue
+import threading
+from concurrent.futures import CancelledError, Future, TimeoutError as FuturesTimeoutError
+
+from utils import env_clean
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+YTDLP_FORMAT = "bv*[height<=1080]+ba/b[height<=1080]/b"
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _env_float(name, default):
+    try:
+        return float(env_clean(name, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class _QuietLogger:
+    """Keep yt-dlp's own output off the console; errors surface through exceptions."""
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+class YtdlpEngine:
+    """Batches fallback downloads onto a single long-lived ``YoutubeDL`` instance."""
+
+    def __init__(self, work_dir, batch_window=None, batch_size=None, log=print):
+        self.work_dir = work_dir
+        self.batch_window = _env_float("YTDLP_BATCH_WINDOW", 1.0) if batch_window is None else batch_window
+        self.batch_size = int(_env_float("YTDLP_BATCH_SIZE", 8) if batch_size is None else batch_size)
+        self.log = log
+        self._ydl = None
+        self._ydl_lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._deliver_lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def _params(self):
+        return {
+            "format": YTDLP_FORMAT,
+            "merge_output_format": "mp4",
+            # Replaced per job in _download_one; each note's file is renamed to video_<timestamp> afterwards.
+            "outtmpl": os.path.join(self.work_dir, "ytdlp_%(id)s.%(ext)s"),
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+            "logger": _QuietLogger(),
+            "socket_timeout": 30,
+            "retries": 3,
+        }
+
+    def _instance(self):
+        if self._ydl is None:
+            if yt_dlp is None:
+                raise RuntimeError("yt_dlp 未安装（pip install yt-dlp）")
+            self._ydl = yt_dlp.YoutubeDL(self._params())
+        return self._ydl
+
+    @staticmethod
+    def output_path(ydl, info):
+        """Final file of a processed info dict (after merging), or None."""
+        for item in info.get("requested_downloads") or []:
+            if item.get("filepath"):
+                return item["filepath"]
+        path = info.get("filepath") or info.get("_filename")
+        if not path:
+            try:
+                path = ydl.prepare_filename(info)
+            except Exception:
+                return None
+        return path
+
+    def _download_one(self, ydl, url, timestamp):
+        # A per-job file name: two notes sharing a media id must not write (or clean up) the same file.
+        ydl.params["outtmpl"]["default"] = os.path.join(
+            self.work_dir, f"ytdlp_{timestamp}_{next(self._seq)}_%(id)s.%(ext)s")
+        info = ydl.extract_info(url, download=True)
+        if info and info.get("entries"):
+            info = next((e for e in info["entries"] if e), None)
+        path = self.output_path(ydl, info or {})
+        if not path or not os.path.exists(path):
+            raise RuntimeError("yt-dlp 未产出视频文件")
+        ext = os.path.splitext(path)[1] or ".mp4"
+        final_path = os.path.join(self.work_dir, f"video_{timestamp}{ext}")
+        os.replace(path, final_path)
+        return final_path
+
+    def download_batch(self, jobs, start=None):
+        """Download ``[(url, timestamp), ...]`` on the shared instance.
+
+        Returns one entry per job, in order: the local path or the exception raised.
+        ``start(index)`` is called right before each job; returning False skips it.
+        """
+        results = []
+        with self._ydl_lock:
+            ydl = self._instance()
+            for index, (url, timestamp) in enumerate(jobs):
+                if start is not None and not start(index):
+                    results.append(CancelledError())
+                    continue
+                try:
+                    results.append(self._download_one(ydl, url, timestamp))
+                except Exception as e:
+                    results.append(e)
+        return results
+
+    def _ensure_worker(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ytdlp-engine", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._jobs.get()]
+        if self._jobs.empty():
+            # Nothing else pending: waiting out the window would only delay this note.
+            return batch
+        # One window for the whole batch, measured from its first job.
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _start(job):
+        # False when the caller already cancelled the job while it was queued.
+        if not job.set_running_or_notify_cancel():
+            return False
+        job.started.set()
+        return True
+
+    def _deliver(self, job, outcome):
+        with self._deliver_lock:
+            if job.cancelled():
+                return
+            if job.abandoned:
+                # The caller timed out and left; do not leave its file behind.
+                if isinstance(outcome, str) and os.path.exists(outcome):
+                    os.remove(outcome)
+                    self.log(f"🧹 [yt-dlp] 调用方已超时放弃，删除 {os.path.basename(outcome)}")
+                outcome = TimeoutError("yt-dlp 下载超时，调用方已放弃")
+            if isinstance(outcome, BaseException):
+                job.set_exception(outcome)
+            else:
+                job.set_result(outcome)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if len(batch) > 1:
+                self.log(f"🛟 [yt-dlp] 合并 {len(batch)} 条兜底下载为一批")
+            try:
+                results = self.download_batch([(job.url, job.timestamp) for job in batch],
+                                              start=lambda i: self._start(batch[i]))
+            except Exception as e:
+                results = [e] * len(batch)
+            for job, outcome in zip(batch, results):
+                self._deliver(job, outcome)
+
+    def submit(self, url, timestamp):
+        """Queue one note for the next batch; returns a Future resolving to the local path."""
+        job = _Job(url, timestamp)
+        self._jobs.put(job)
+        self._ensure_worker()
+        return job
+
+    def download(self, url, timestamp, timeout=None):
+        """Blocking download; ``timeout`` counts from when this note's download starts, not from queueing."""
+        timeout = _env_float("YTDLP_TIMEOUT", 300) if timeout is None else timeout
+        job = self.submit(url, timestamp)
+        job.started.wait()
+        try:
+            return job.result(timeout=timeout)
+        except FuturesTimeoutError:
+            with self._deliver_lock:
+                job.abandoned = not job.done()
+            if job.abandoned:
+                raise
+            return job.result()
+
+
+class _Job(Future):
+    """A queued note; ``started`` is set when its download begins (or it finished without starting)."""
+
+    def __init__(self, url, timestamp):
+        super().__init__()
+        self.url = url
+        self.timestamp = timestamp
+        self.abandoned = False
+        self.started = threading.Event()
+        self.add_done_callback(lambda _job: self.started.set())
+
+
+def get_engine(work_dir):
+    """Process-wide engine for ``work_dir``."""
+    key = os.path.abspath(work_dir)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = YtdlpEngine(work_dir)
+        return _engines[key]